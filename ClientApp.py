@@ -1,9 +1,30 @@
 import os
 import argparse
 
-from HTTP_v1_1.client import HTTPClient
+from HTTP_v1_1.transfer import BulkTransfer
 from HTTP_v1_1.client import ConnectionError
 from HTTP_v1_1.client import RequestError
+from HTTP_v1_1.logger import configureLogging
+
+
+def readFilenames(filenames):
+    """
+    Expand "@manifest" arguments into the file names listed in the
+    manifest, one per line; blank lines and "#" comments are skipped.
+    """
+    expanded = []
+    for filename in filenames:
+        if not filename.startswith("@"):
+            expanded.append(filename)
+            continue
+
+        with open(filename[1:]) as manifest:
+            for line in manifest:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    expanded.append(line)
+
+    return expanded
 
 
 def ClientApp(**args):
@@ -12,26 +33,46 @@ def ClientApp(**args):
     serverIP = args["server_ip"]
     serverPort = args["server_port"]
     method = args["method"]
-    filename = args["filename"]
+    filenames = readFilenames(args["filename"] or [])
     clientDirectory = args["client_directory"]
+    connections = args["connections"]
+    jobs = args["jobs"]
+    retries = args["retries"]
+    engine = args["engine"]
+    pipeline = args["pipeline"]
+
+    configureLogging(args["log_level"], name="HTTPClient")
     
-    httpClient = HTTPClient(clientIP, clientPort, clientDirectory)
+    # Files are transferred jobs at a time over persistent connections,
+    # rather than connecting for each file
+    transfer = BulkTransfer(serverIP, serverPort, clientIP, clientPort, clientDirectory,
+                            concurrency=jobs,
+                            retries=retries,
+                            connections=connections,
+                            engine=engine,
+                            pipeline=pipeline)
     
     try:
-        httpClient.connect(serverIP, serverPort)
-        httpClient.request(method, filename)
-    except ConnectionError as e:
-        print("Unexpected exception in establishing connection with HTTP server!")
-        print(e)
-    except RequestError as e:
-        print("Unexpected exception in http request to HTTP server!")
-        print(e)
+        # Every file of the client directory, along with the given ones
+        if args["all"]:
+            filenames += [filename for filename in transfer.localFiles() if filename not in filenames]
+        if not filenames:
+            filenames = ["index.html"]
+
+        report = transfer.run([(method, filename) for filename in filenames])
+        for method, filename, error in report["failed"]:
+            if isinstance(error, ConnectionError):
+                print("Unexpected exception in establishing connection with HTTP server!")
+                print(error)
+            elif isinstance(error, RequestError):
+                print("Unexpected exception in http request to HTTP server! [%s]" % filename)
+                print(error)
+            else:
+                print("Unexpected exception! [%s]" % filename)
+                print(error)
     except Exception as e:
         print("Unexpected exception!")
         print(e)
-    finally:
-        if httpClient:
-            httpClient.close()
 
 
 if __name__ == "__main__":
@@ -44,8 +85,15 @@ if __name__ == "__main__":
                                            -t <server_ip> \
                                            -p <server_port> \
                                            -m <method> \
-                                           -f <filename> \
-                                           -d <client_directory>')
+                                           -f <filename> [<filename> ...] \
+                                           -a \
+                                           -d <client_directory> \
+                                           -n <connections> \
+                                           -j <jobs> \
+                                           -R <retries> \
+                                           -e <engine> \
+                                           -P <pipeline> \
+                                           -l <log_level>')
 
     parser.add_argument("-s", "--client_ip", type=str, default="127.0.0.1",
                         help="Client hostname, default: 127.0.0.1")
@@ -57,10 +105,26 @@ if __name__ == "__main__":
                         help="Server port, default: 8080")
     parser.add_argument("-m", "--method", type=str, default="GET",
                         help="Request method, default: GET")
-    parser.add_argument("-f", "--filename", type=str, default="index.html",
-                        help="File name, default: index.html")
+    parser.add_argument("-f", "--filename", type=str, nargs="+",
+                        help="File names, or @<manifest> listing one file name per line, default: index.html")
+    parser.add_argument("-a", "--all", action="store_true",
+                        help="Every file in the client directory: PUT uploads them, GET refreshes them")
     parser.add_argument("-d", "--client_directory", type=str, default=os.path.join(os.getcwd(), "data", "client"),
                         help="Client directory, default: /<Current Working Directory>/data/client/")
+    parser.add_argument("-n", "--connections", type=int, default=1,
+                        help="Parallel connections for downloading byte ranges of each GET, or with -e async, "
+                             "connections to the server, default: 1")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Files transferred concurrently, default: 1")
+    parser.add_argument("-R", "--retries", type=int, default=3,
+                        help="Retries of a failed transfer, with exponential backoff, default: 3")
+    parser.add_argument("-e", "--engine", type=str, default="thread", choices=["thread", "async"],
+                        help="Transfer engine, a thread per job or coroutines of a single thread, default: thread")
+    parser.add_argument("-P", "--pipeline", type=int, default=8,
+                        help="With -e async, GET requests sent ahead of their responses on a connection, default: 8")
+    parser.add_argument("-l", "--log_level", type=str, default="info",
+                        choices=["debug", "info", "warning", "error", "critical"],
+                        help="Client log level, default: info")
 
     # Read user inputs
     args = vars(parser.parse_args())
@@ -0,0 +1,508 @@
+import sys
+import os
+import socket
+import logging
+import asyncio
+
+from HTTP_v1_1.server import RequestHandler, LINGER_RESET
+from HTTP_v1_1.cache import ResponseCache, DigestCache
+from HTTP_v1_1.parser import ParseError
+from HTTP_v1_1.metrics import Metrics, MetricsServer
+from HTTP_v1_1.encoding import Compressor
+from HTTP_v1_1.reaper import Reaper
+from HTTP_v1_1.resolver import PathResolver
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+log = logging.getLogger(__name__)
+
+
+class AsyncClientConnection(RequestHandler):
+    """
+    Serves a client connection as a coroutine on the event loop,
+    with the same GET/PUT semantics as ClientThread.
+    """
+
+    def __init__(self, reader,
+                       writer,
+                       clientIP,
+                       clientPort,
+                       serverIP,
+                       serverPort,
+                       bufferSize=16384,
+                       threadName=None,
+                       www=os.getcwd(),
+                       keepAliveTimeout=15,
+                       maxRequests=100,
+                       chunkSize=262144,
+                       sendfile=True,
+                       cache=None,
+                       maxBodySize=0,
+                       metrics=None,
+                       metricsPath=None,
+                       compressor=None,
+                       headerTimeout=10,
+                       bodyTimeout=30,
+                       writeTimeout=30,
+                       minRate=1024,
+                       reaper=None,
+                       resolver=None,
+                       digests=None):
+        RequestHandler.__init__(self, clientIP,
+                                      clientPort,
+                                      serverIP,
+                                      serverPort,
+                                      bufferSize=bufferSize,
+                                      threadName=threadName,
+                                      www=www,
+                                      keepAliveTimeout=keepAliveTimeout,
+                                      maxRequests=maxRequests,
+                                      chunkSize=chunkSize,
+                                      sendfile=sendfile,
+                                      cache=cache,
+                                      maxBodySize=maxBodySize,
+                                      metrics=metrics,
+                                      metricsPath=metricsPath,
+                                      compressor=compressor,
+                                      headerTimeout=headerTimeout,
+                                      bodyTimeout=bodyTimeout,
+                                      writeTimeout=writeTimeout,
+                                      minRate=minRate,
+                                      reaper=reaper,
+                                      resolver=resolver,
+                                      digests=digests)
+        self.reader = reader
+        self.writer = writer
+        self.loop = None
+
+    async def run(self):
+        """
+        Request handler.
+        Serves requests on the persistent connection, in order,
+        until the client closes it, asks for "Connection: close",
+        stays idle longer than keepAliveTimeout, misses a deadline
+        or maxRequests have been served.
+        """
+        self.loop = asyncio.get_running_loop()
+        if self.metrics is not None:
+            self.metrics.connectionOpened()
+        if self.reaper is not None:
+            self.reaper.add(self)
+
+        linger = True
+        try:
+            while await self._handleRequest() and not self.closing:
+                pass
+        except asyncio.TimeoutError:
+            if self.phase == "idle":
+                log.debug("[%s] Client connection idle for %ds", self.threadName, self.keepAliveTimeout)
+            else:
+                log.info("[%s] Client connection timed out (%s)", self.threadName, self.phase)
+                self._reset()
+            linger = False
+        except Exception as e:
+            # Failing I/O is expected once the reaper aborted the connection
+            if not self.aborted:
+                log.error("[%s] Problem handling client request", self.threadName)
+            log.debug("[%s] %r", self.threadName, e)
+        finally:
+            # Close client connection
+            log.debug("[%s] Closing client connection", self.threadName)
+            if self.reaper is not None:
+                self.reaper.discard(self)
+            self._enterPhase(None)
+            if linger and not self.aborted:
+                await self._linger()
+            self.writer.close()
+            if self.metrics is not None:
+                self.metrics.connectionClosed(self.bytesReceived)
+
+    async def _linger(self):
+        """
+        Signal the end of the responses and discard unread request
+        data for a while, like ClientThread._linger().
+        """
+        try:
+            if self.writer.can_write_eof():
+                self.writer.write_eof()
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + self.lingerTimeout
+            while loop.time() < deadline:
+                if not await asyncio.wait_for(self.reader.read(self.chunkSize), deadline - loop.time()):
+                    break
+        except Exception:
+            pass
+
+    def abort(self):
+        """
+        Make the pending and future I/O of the connection fail,
+        and reset the connection. Called from the reaper thread.
+        """
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._reset)
+
+    def _reset(self):
+        """
+        Drop the unsent data and close the connection with a reset.
+        """
+        sock = self.writer.get_extra_info('socket')
+        try:
+            if sock is not None:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_RESET)
+        except OSError:
+            pass
+        self.writer.transport.abort()
+
+    async def _handleRequest(self):
+        """
+        Receive and serve a single request.
+        Returns True if the connection should be kept open.
+        """
+        # Receive request from client
+        log.debug("[%s] Receiving client request", self.threadName)
+        try:
+            clientRequest = await self._recvRequest()
+        except ParseError as e:
+            try:
+                await self._send(*self._badRequest(e))
+            finally:
+                self._requestDone()
+            return False
+        if clientRequest is None:
+            return False
+
+        requestMethod = self._parseRequest(clientRequest)
+        try:
+            if requestMethod in ('GET', 'HEAD'):
+                await self._handleGET()
+            elif requestMethod == 'PUT':
+                await self._handlePUT()
+            else:
+                await self._send(*self._notImplemented(requestMethod))
+        finally:
+            self._requestDone()
+
+        return self.keepAlive
+
+    async def _recv(self, size):
+        """
+        Receive at most size bytes within the phase deadline.
+        """
+        data = await asyncio.wait_for(self.reader.read(size), self.phaseTimeout)
+        self.bytesReceived += len(data)
+        self._progress(len(data))
+        return data
+
+    async def _send(self, *buffers):
+        """
+        Send buffers, waiting at most writeTimeout for the client to take them.
+        """
+        if self.phase != "write":
+            self._enterPhase("write")
+        self.writer.writelines(buffers)
+        size = sum(len(buffer) for buffer in buffers)
+        self.bytesSent += size
+        await asyncio.wait_for(self.writer.drain(), self.phaseTimeout)
+        self._progress(size)
+
+    async def _recvRequest(self):
+        """
+        Receive request line and headers.
+        Returns the parsed Request, or None if the client
+        closed the connection between requests.
+        """
+        self._enterPhase("head" if self.buffer.strip() else "idle")
+        while True:
+            clientRequest = self._nextRequest()
+            if clientRequest is not None:
+                self._enterPhase(None)
+                return clientRequest
+
+            data = await self._recv(self.bufferSize)
+            if not data:
+                if self.buffer.strip():
+                    raise IOError("Connection closed before the request header was complete")
+                return None
+            self.buffer += data
+            if self.phase == "idle" and self.buffer.strip():
+                self._enterPhase("head")
+
+    async def _handleGET(self):
+        """
+        Handle GET.
+        """
+        if self._compressing() or self._hashing():
+            # Keep compressing and hashing files off the event loop
+            httpResponse, f, parts = await self.loop.run_in_executor(None, self._openGET)
+        else:
+            httpResponse, f, parts = self._openGET()
+        await self._send(*httpResponse)
+        if f is None:
+            return
+
+        # Send requested file over TCP connection to the client
+        with f:
+            for prefix, offset, length in parts:
+                if prefix:
+                    await self._send(prefix)
+                if not length:
+                    continue
+
+                if self.sendfile:
+                    try:
+                        await self._sendFile(f, offset, length)
+                        continue
+                    except asyncio.SendfileNotAvailableError:
+                        # e.g. TLS transports; nothing has been sent yet
+                        self.sendfile = False
+
+                f.seek(offset)
+                for payload in self._readChunks(f, length):
+                    await self._send(payload)
+
+    async def _sendFile(self, f, offset, length):
+        """
+        Send length bytes of f from offset with sendfile(), chunkSize
+        bytes at a time so that the write deadlines see the progress.
+        """
+        end = offset + length
+        while offset < end:
+            sent = await asyncio.wait_for(
+                self.loop.sendfile(self.writer.transport, f, offset, min(self.chunkSize, end - offset),
+                                   fallback=False),
+                self.phaseTimeout)
+            if not sent:
+                raise IOError("File shrank while it was being sent")
+            offset += sent
+            self.bytesSent += sent
+            self._progress(sent)
+
+    async def _handlePUT(self):
+        """
+        Handle PUT.
+        """
+        httpResponse, f = self._openPUT()
+        if f is None:
+            await self._send(*httpResponse)
+            return
+
+        error = None
+        try:
+            self._enterPhase("body")
+            data = self._takeBufferedBody()
+            while not self._writeBody(f, data):
+                data = await self._recv(self._bodyRecvSize())
+                if not data:
+                    raise IOError("Connection closed before the request body was complete")
+        except Exception as e:
+            error = e
+
+        await self._send(*self._closePUT(f, error))
+
+
+class AsyncHTTPServer(object):
+    """
+    Event loop server engine.
+    Serves every connection from a single thread on non-blocking
+    sockets, so mostly idle keep-alive connections cost no thread.
+    """
+
+    def __init__(self, hostname="127.0.0.1", port=8080, www=os.getcwd(), capacity=10,
+                       keepAliveTimeout=15, maxRequests=100, reusePort=False,
+                       chunkSize=262144, sendfile=True,
+                       cacheSize=0, cacheMaxFileSize=1024 * 1024, maxBodySize=0,
+                       metricsPath=None, metricsPort=0, profile=False,
+                       compression=True, compressMinSize=1024, compressMaxSize=1024 * 1024,
+                       compressCacheSize=16 * 1024 * 1024,
+                       headerTimeout=10, bodyTimeout=30, writeTimeout=30, minRate=1024,
+                       shutdownTimeout=10, statCacheSize=4096):
+        self.hostname = hostname
+        self.port = port
+        self.www = www
+        self.capacity = capacity
+        # Let several server processes listen on the same port
+        self.reusePort = reusePort
+        self.chunkSize = chunkSize
+        self.sendfile = sendfile
+        # Largest PUT request body accepted, 0 for no limit
+        self.maxBodySize = maxBodySize
+
+        # Cache of small files, shared by all connections
+        self.cache = None
+        if cacheSize:
+            self.cache = ResponseCache(cacheSize, cacheMaxFileSize)
+
+        # Request paths confined to www, as with HTTPServer
+        self.resolver = PathResolver(www, statCacheSize)
+
+        # SHA-256 digests of files, as with HTTPServer
+        self.digests = DigestCache()
+
+        # gzip/deflate encoding of files, for clients accepting it
+        self.compressor = None
+        if compression:
+            self.compressor = Compressor(compressMinSize, compressMaxSize, compressCacheSize)
+        self.keepAliveTimeout = keepAliveTimeout
+        self.maxRequests = maxRequests
+        self.loop = None
+        self.server = None
+
+        # Slow client protection, as with HTTPServer
+        self.headerTimeout = headerTimeout
+        self.bodyTimeout = bodyTimeout
+        self.writeTimeout = writeTimeout
+        self.minRate = minRate
+        self.shutdownTimeout = shutdownTimeout
+        self.reaper = Reaper(name="%d-reaper" % port)
+
+        # Metrics, as with HTTPServer
+        self.metrics = None
+        self.metricsServer = None
+        self.metricsPath = metricsPath or "/__metrics"
+        self.metricsPort = metricsPort
+        if metricsPath or metricsPort:
+            self.metrics = Metrics(profile=profile)
+            self.metrics.registerCache(self.cache)
+            if self.compressor is not None:
+                self.metrics.registerCache(self.compressor.cache, "compressed_cache")
+            self.metrics.registerCache(self.digests, "digest_cache")
+
+    def start(self):
+        """
+        Start the server.
+        """
+        log.info("Launching HTTP server on %s:%d", self.hostname, self.port)
+
+        self._raiseFileLimit()
+        self.loop = asyncio.new_event_loop()
+
+        try:
+            try:
+                self.server = self.loop.run_until_complete(
+                    asyncio.start_server(self._serve, self.hostname, self.port, backlog=self.capacity,
+                                         reuse_port=self.reusePort))
+            except Exception as e:
+                log.error("Failed to launch HTTP server!")
+                log.debug(e)
+                sys.exit(1)
+
+            log.info("HTTP server is successfully launched at %s:%d", self.hostname, self.port)
+            log.info("Press Ctrl+C to shut down the running HTTP server and exit.")
+
+            log.info("HTTP server is listening at port %d", self.port)
+            if self.metrics is not None:
+                self._startMetricsServer()
+            self.reaper.start()
+            self.loop.run_forever()
+        finally:
+            self._shutdown()
+
+    async def _serve(self, reader, writer):
+        """
+        Serve a newly established client connection.
+        """
+        clientIP, clientPort = writer.get_extra_info('peername')[:2]
+        log.debug("Established client connection with %s:%d", clientIP, clientPort)
+
+        threadName = "%d->%s:%d" % (self.port, clientIP, clientPort)
+        connection = AsyncClientConnection(reader,
+                                           writer,
+                                           clientIP,
+                                           clientPort,
+                                           self.hostname,
+                                           self.port,
+                                           threadName=threadName,
+                                           www=self.www,
+                                           keepAliveTimeout=self.keepAliveTimeout,
+                                           maxRequests=self.maxRequests,
+                                           chunkSize=self.chunkSize,
+                                           sendfile=self.sendfile,
+                                           cache=self.cache,
+                                           maxBodySize=self.maxBodySize,
+                                           metrics=self.metrics,
+                                           metricsPath=None if self.metricsPort else self.metricsPath,
+                                           compressor=self.compressor,
+                                           headerTimeout=self.headerTimeout,
+                                           bodyTimeout=self.bodyTimeout,
+                                           writeTimeout=self.writeTimeout,
+                                           minRate=self.minRate,
+                                           reaper=self.reaper,
+                                           resolver=self.resolver,
+                                           digests=self.digests)
+        await connection.run()
+
+    def _startMetricsServer(self):
+        """
+        Serve the metrics on metricsPort, if set. The metrics server
+        runs on a thread of its own, so it stays responsive while the
+        event loop is busy.
+        """
+        if not self.metricsPort:
+            log.info("Serving metrics at %s", self.metricsPath)
+            return
+
+        try:
+            self.metricsServer = MetricsServer(self.metrics, self.hostname, self.metricsPort,
+                                               self.metricsPath, reusePort=self.reusePort)
+            self.metricsServer.start()
+        except Exception as e:
+            log.error("Could not serve metrics on port %d!", self.metricsPort)
+            log.debug(e)
+
+    def _raiseFileLimit(self):
+        """
+        Raise the open file limit to the hard limit,
+        as every connection holds a file descriptor.
+        """
+        if resource is None:
+            return
+
+        try:
+            soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+            if soft != hard:
+                resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+                log.debug("Raised open file limit from %d to %d", soft, hard)
+        except (ValueError, OSError) as e:
+            log.debug("Could not raise open file limit: %r", e)
+
+    def _shutdown(self):
+        """
+        Close the listening socket and the idle client connections,
+        give the others up to shutdownTimeout to finish their current
+        request, then close the event loop.
+        """
+        if self.loop is None or self.loop.is_closed():
+            return
+
+        if self.server is not None:
+            self.server.close()
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+        if self.metrics is not None:
+            self.metrics.close()
+
+        self.reaper.closeIdle()
+        tasks = asyncio.all_tasks(self.loop)
+        if tasks:
+            done, pending = self.loop.run_until_complete(asyncio.wait(tasks, timeout=self.shutdownTimeout))
+            aborted = self.reaper.abortAll()
+            if aborted:
+                log.warn("Aborted %d client connections still open after %ds", aborted, self.shutdownTimeout)
+            for task in pending:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.reaper.stop()
+        self.loop.close()
+
+    def stop(self):
+        """
+        Stop the server.
+        """
+        log.info("Shutting down HTTP server %s:%d", self.hostname, self.port)
+
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self.loop.stop)
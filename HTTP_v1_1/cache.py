@@ -0,0 +1,261 @@
+import os
+import time
+import hashlib
+import threading
+
+from collections import OrderedDict
+from email.utils import formatdate
+
+
+def fileValidators(stat):
+    """
+    Returns the ETag and Last-Modified values of a file, given its stat().
+    """
+    etag = '"%x-%x-%x"' % (stat.st_ino, stat.st_size, int(stat.st_mtime * 1000000))
+    lastModified = formatdate(stat.st_mtime, usegmt=True)
+    return etag, lastModified
+
+
+class CacheEntry(object):
+    """
+    Cached file body along with the file identity it was read from,
+    its validators and its SHA-256 digest.
+    """
+
+    __slots__ = ("body", "mtime", "size", "inode", "etag", "lastModified", "digest", "checked")
+
+    def __init__(self, body, stat):
+        self.body = body
+        self.mtime = stat.st_mtime
+        self.size = stat.st_size
+        self.inode = stat.st_ino
+        self.etag, self.lastModified = fileValidators(stat)
+        self.digest = hashlib.sha256(body).digest()
+        self.checked = time.time()
+
+    def matches(self, stat):
+        return (stat.st_mtime == self.mtime and
+                stat.st_size == self.size and
+                stat.st_ino == self.inode)
+
+
+class ResponseCache(object):
+    """
+    Server-wide in-memory cache of small static files.
+    Bounded by the total size of cached bodies, evicting the least
+    recently used files first. A hit only goes back to the filesystem
+    to revalidate the entry when it was last checked more than
+    revalidateInterval seconds ago; entries are dropped when the file
+    changes (mtime, size or inode) or is overwritten by PUT.
+    """
+
+    def __init__(self, maxBytes=64 * 1024 * 1024, maxFileSize=1024 * 1024, revalidateInterval=1.0):
+        self.maxBytes = maxBytes
+        self.maxFileSize = maxFileSize
+        self.revalidateInterval = revalidateInterval
+
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path):
+        """
+        Returns the cached entry of path, or None.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            now = time.time()
+            if now - entry.checked > self.revalidateInterval:
+                try:
+                    stat = os.stat(self._source(path))
+                except OSError:
+                    stat = None
+                if stat is None or not entry.matches(stat):
+                    self._remove(path)
+                    self.misses += 1
+                    return None
+                entry.checked = now
+
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry
+
+    def peek(self, path):
+        """
+        Returns the cached entry of path, or None, without counting
+        a hit or a miss nor revalidating it.
+        """
+        with self.lock:
+            return self.entries.get(path)
+
+    def cacheable(self, size):
+        """
+        Whether a file of the given size is worth caching.
+        """
+        return size <= self.maxFileSize and size <= self.maxBytes
+
+    def put(self, path, body, stat):
+        """
+        Cache the body read from path, whose fstat() result is stat.
+        Returns the entry, which is only kept if cacheable.
+        """
+        entry = self._createEntry(path, body, stat)
+        if not self.cacheable(len(body)):
+            return entry
+
+        with self.lock:
+            if path in self.entries:
+                self._remove(path)
+            self.entries[path] = entry
+            self.bytes += len(body)
+
+            while self.bytes > self.maxBytes:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+        return entry
+
+    def invalidate(self, path):
+        """
+        Drop the cached entry of path, if any.
+        """
+        with self.lock:
+            if path in self.entries:
+                self._remove(path)
+
+    def _source(self, key):
+        """
+        Returns the file the entry of key was read from.
+        """
+        return key
+
+    def _createEntry(self, key, body, stat):
+        return CacheEntry(body, stat)
+
+    def _remove(self, path):
+        entry = self.entries.pop(path)
+        self.bytes -= len(entry.body)
+
+    def stats(self):
+        """
+        Returns cache counters.
+        """
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self.entries),
+                    "bytes": self.bytes}
+
+
+class VariantCache(ResponseCache):
+    """
+    Cache of encoded variants of files (e.g. their gzip compressed
+    body), keyed by (path, encoding). Entries are validated against
+    the file they were made of, like ResponseCache entries; their ETag
+    carries the encoding, so that it never matches the one of the file.
+    """
+
+    def __init__(self, maxBytes=16 * 1024 * 1024, maxFileSize=1024 * 1024, revalidateInterval=1.0,
+                       encodings=("gzip", "deflate")):
+        ResponseCache.__init__(self, maxBytes, maxFileSize, revalidateInterval)
+        self.encodings = encodings
+
+    def _source(self, key):
+        return key[0]
+
+    def _createEntry(self, key, body, stat):
+        entry = CacheEntry(body, stat)
+        entry.etag = '%s-%s"' % (entry.etag[:-1], key[1])
+        return entry
+
+    def invalidate(self, path):
+        """
+        Drop the cached variants of path.
+        """
+        for encoding in self.encodings:
+            ResponseCache.invalidate(self, (path, encoding))
+
+
+class DigestCache(object):
+    """
+    Server-wide SHA-256 digests of files, by path, valid as long as the
+    file keeps the mtime, size and inode it had when hashed, so that
+    files are hashed once rather than on every GET. Files up to
+    maxFileSize bytes are hashed when first served; uploaded files are
+    hashed as they arrive. At most maxEntries digests are kept, the
+    least recently used ones are evicted first.
+    """
+
+    def __init__(self, maxEntries=65536, maxFileSize=16 * 1024 * 1024):
+        self.maxEntries = maxEntries
+        self.maxFileSize = maxFileSize
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path, stat):
+        """
+        Returns the digest of the file at path, whose stat() is stat,
+        or None.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != (stat.st_mtime, stat.st_size, stat.st_ino):
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(path)
+            self.hits += 1
+            return entry[1]
+
+    def peek(self, path, stat):
+        """
+        Returns the digest like get(), without counting a hit or miss.
+        """
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None or entry[0] != (stat.st_mtime, stat.st_size, stat.st_ino):
+                return None
+            return entry[1]
+
+    def hashable(self, size):
+        """
+        Whether a file of the given size is hashed when first served.
+        """
+        return size <= self.maxFileSize
+
+    def put(self, path, stat, digest):
+        """
+        Keep the digest of the file at path, whose stat() is stat.
+        """
+        with self.lock:
+            self.entries[path] = ((stat.st_mtime, stat.st_size, stat.st_ino), digest)
+            self.entries.move_to_end(path)
+            while len(self.entries) > self.maxEntries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """
+        Returns cache counters.
+        """
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self.entries),
+                    "bytes": len(self.entries) * hashlib.sha256().digest_size}
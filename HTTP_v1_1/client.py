@@ -1,13 +1,18 @@
 import os
+import re
 import time
+import hashlib
+import asyncio
 import logging
+import select
 import socket
+import threading
 
+from HTTP_v1_1.parser import ResponseParser, ParseError
+from HTTP_v1_1.digest import WANT_DIGEST, formatDigest, messageDigests, hashFile
 
-# Set logging
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s HTTPClient [%(levelname)s] %(message)s',)
-log = logging.getLogger()
+
+log = logging.getLogger(__name__)
 
 
 class ConnectionError(Exception):
@@ -18,7 +23,154 @@ class RequestError(Exception):
     pass
 
 
-class HTTPClient:
+def persistence(response):
+    """
+    Returns whether the server keeps the connection open after the
+    response, for how many seconds and for how many more requests,
+    None when it does not say.
+    """
+    connection = [option.strip() for option in
+                  response.headers.get('connection', '').lower().split(',')]
+    if response.version == 'HTTP/1.1':
+        keepAlive = 'close' not in connection
+    else:
+        keepAlive = 'keep-alive' in connection
+
+    limits = [re.search(r'%s=(\d+)' % name, response.headers.get('keep-alive', ''))
+              for name in ('timeout', 'max')]
+    return (keepAlive,) + tuple(int(match.group(1)) if match else None for match in limits)
+
+
+class ClientFiles(object):
+    """
+    Layout of the client directory shared by the clients: downloads
+    go to a hidden part file next to the file until complete, and the
+    validators of downloaded files are kept in hidden files next to
+    them, for conditional and resumed requests. Downloads are checked
+    against the SHA-256 Repr-Digest the server sends along.
+    """
+
+    def _conditional(self, method, filename, partFile):
+        """
+        Returns the conditional header lines of a GET of filename, and
+        the offset of the part downloaded so far to resume at, if any.
+        """
+        conditional = ""
+        partValidators = self._loadValidators(partFile)
+        offset = os.path.getsize(partFile) if partValidators else 0
+        if offset:
+            # Resume the interrupted download, unless the file changed meanwhile
+            log.info("[%s] Resuming download of %s at byte %d", method, filename, offset)
+            conditional += "Range: bytes=%d-\r\n" % offset
+            conditional += "If-Range: " + partValidators.get('etag', partValidators.get('last-modified')) + "\r\n"
+        else:
+            # Ask only for a newer version of the file, if we have it already
+            validators = self._loadValidators(filename)
+            if 'etag' in validators:
+                conditional += "If-None-Match: " + validators['etag'] + "\r\n"
+            if 'last-modified' in validators:
+                conditional += "If-Modified-Since: " + validators['last-modified'] + "\r\n"
+        return conditional, offset
+
+    def _fileDigest(self, filename):
+        """
+        Returns the SHA-256 digest of the file.
+        """
+        with open(filename, 'rb') as f:
+            return hashFile(f).digest()
+
+    def _bodyHash(self, headers, partFile, offset):
+        """
+        Returns the SHA-256 hash object to feed a downloaded body to,
+        fed with the first offset bytes of the part file downloaded
+        before, or None when the server sent no Repr-Digest.
+        """
+        if messageDigests(headers)[0] is None:
+            return None
+        if not offset:
+            return hashlib.sha256()
+        with open(partFile, 'rb') as f:
+            return hashFile(f, offset)
+
+    def _verify(self, method, partFile, headers, bodyHash):
+        """
+        Check a download against the Repr-Digest of the response.
+        Raises RequestError, discarding the part file, on a mismatch.
+        """
+        if bodyHash is not None and bodyHash.digest() != messageDigests(headers)[0]:
+            self._discardPart(partFile)
+            raise RequestError("[%s] Downloaded file does not match its Repr-Digest!" % (method,))
+
+    def _partFile(self, filename):
+        """
+        Hidden file next to filename collecting an unfinished download.
+        """
+        directory, name = os.path.split(filename)
+        return os.path.join(directory, "." + name + ".part")
+
+    def _discardPart(self, partFile):
+        """
+        Remove an unusable part file and its validators.
+        """
+        self._saveValidators(partFile, {})
+        if os.path.exists(partFile):
+            os.remove(partFile)
+
+    def _validatorsFile(self, filename):
+        """
+        Hidden file next to filename holding its ETag and Last-Modified.
+        """
+        directory, name = os.path.split(filename)
+        if not name.startswith("."):
+            name = "." + name
+        return os.path.join(directory, name + ".validators")
+
+    def _loadValidators(self, filename):
+        """
+        Returns the validators stored for filename, if the file still exists.
+        """
+        validators = {}
+        if not os.path.isfile(filename):
+            return validators
+
+        try:
+            with open(self._validatorsFile(filename), 'r') as f:
+                for line in f:
+                    name, _, value = line.partition(':')
+                    if value.strip():
+                        validators[name.strip().lower()] = value.strip()
+        except IOError:
+            pass
+
+        return validators
+
+    def _saveValidators(self, filename, headers):
+        """
+        Store the validators the server sent along with filename.
+        """
+        validatorsFile = self._validatorsFile(filename)
+        fields = [(name, headers[name.lower()]) for name in ('ETag', 'Last-Modified')
+                  if name.lower() in headers]
+
+        if fields:
+            with open(validatorsFile, 'w') as f:
+                for name, value in fields:
+                    f.write("%s: %s\n" % (name, value))
+        elif os.path.exists(validatorsFile):
+            os.remove(validatorsFile)
+
+
+class HTTPClient(ClientFiles):
+
+    # Files at least this large are uploaded resumably
+    resumeThreshold = 1024 * 1024
+
+    # Files at least this large are only uploaded if the server's copy
+    # of them has another digest
+    skipThreshold = 64 * 1024
+
+    # Smallest range worth its own connection in getRanges()
+    minRangeSize = 1024 * 1024
 
     def __init__(self, clientIP, 
                        clientPort,
@@ -31,11 +183,26 @@ class HTTPClient:
         log.info("Creating client socket.....")
         self.clientSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
+        # Bytes received past the end of the last parsed message
+        self.buffer = bytearray()
+        self.parser = ResponseParser()
+
+        # Persistence of the connection, as announced by the server
+        self.keepAlive = True
+        self.keepAliveTimeout = None
+        self.responseCount = 0
+        self.lastUsed = time.time()
+
+        # Body bytes sent and received over the connection
+        self.bytesTransferred = 0
+
     def connect(self, serverIP, serverPort):
         """
         Connect to the HTTP server.
         """
         log.info("Connecting with HTTP server %s:%d", serverIP, serverPort)
+        self.serverIP = serverIP
+        self.serverPort = serverPort
 
         try:
             self.clientSocket.connect((serverIP, serverPort)) 
@@ -47,89 +214,355 @@ class HTTPClient:
     def request(self, method, filename):
         """
         Send http request to HTTP server.
+        Returns the status code of the final response.
         """
         if method == "GET":
-            self.get(method, filename)
+            return self.get(method, filename)
         elif method == "PUT":
-            self.put(method, filename)
+            return self.put(method, filename)
+
+        raise RequestError("[%s] Unsupported request method!" % (method,))
     
     def get(self, method, filename):
         """
         GET request.
+        The file is downloaded into a hidden part file next to it, so that
+        an interrupted download resumes where it stopped.
         """
+        name = filename
         filename = os.path.join(self.clientDirectory, filename)
+        partFile = self._partFile(filename)
+        conditional, offset = self._conditional(method, filename, partFile)
 
         # Send a GET request to HTTP server
         log.info("[%s] Sending http request to HTTP server.....", method)
-        request = (method + " /" + filename.rsplit(os.sep, 1)[1] + " HTTP/1.1\n" +
-                   "Host: " + self.clientIP + "\n\n")
-        self.clientSocket.send(request.encode())
+        request = (method + " /" + filename.rsplit(os.sep, 1)[1] + " HTTP/1.1\r\n" +
+                   "Host: " + self.clientIP + "\r\n" +
+                   conditional + "\r\n")
+        self.clientSocket.sendall(request.encode())
         log.debug("[%s] HTTP Request: %s", method, request)
         
         # Receive server response
-        response = self.clientSocket.recv(2048)
-        response = response.decode('utf-8')
+        response = self._recvResponse()
+        headers = response.headers
+        contentLength = int(headers.get('content-length', 0))
         log.info("[%s] HTTP Response: %s", method, response)
+        status = response.code
         
         # Start fetching file, if GET is successful
-        if "HTTP/1.1 200 OK" in response:
+        if status == 304:
+            log.info("[%s] %s is up to date", method, filename)
+        elif status in (200, 206):
+            if status == 200:
+                offset = 0
+            elif not headers.get('content-range', '').startswith("bytes %d-" % offset):
+                self._recvBody(contentLength, lambda data: None)
+                raise RequestError("[%s] Unexpected range in HTTP response!" % (method,))
+
             try:
-                with open(filename, 'wb') as f:
-                    while True:
-                        data = self.clientSocket.recv(1024)
-                    
-                        if data.decode("utf-8").strip() == u"EOF":
-                            break
-                        else:
-                            log.debug("[%s] 1024 bytes received....." % (method,))
-                            f.write(data)
+                # Remember the version being downloaded, for resuming
+                self._saveValidators(partFile, headers)
+                bodyHash = self._bodyHash(headers, partFile, offset)
+                with open(partFile, 'r+b' if offset else 'wb') as f:
+                    f.seek(offset)
+                    f.truncate()
+                    self._recvBody(contentLength, f.write, bodyHash)
+
+                self._verify(method, partFile, headers, bodyHash)
+                os.replace(partFile, filename)
+                self._saveValidators(filename, headers)
+                self._saveValidators(partFile, {})
             except Exception as e:
                 log.error("[%s] HTTP request failed!" % (method,))
                 log.debug(e)
                 raise RequestError("[%s] HTTP request failed!" % (method,))
+        else:
+            self._recvBody(contentLength, lambda data: None)
+
+            # Start over if the part downloaded so far is unusable
+            if status == 416 and offset:
+                self._discardPart(partFile)
+                return self.get(method, name)
+
+        return status
+
+    def getRanges(self, method, filename, connections=4):
+        """
+        GET request, fetching the file as byte ranges in parallel
+        over separate connections.
+        """
+        name = filename
+        filename = os.path.join(self.clientDirectory, filename)
+        partFile = self._partFile(filename)
+
+        # Determine size and version of the file, unless we have it already
+        conditional = ""
+        validators = self._loadValidators(filename)
+        if 'etag' in validators:
+            conditional += "If-None-Match: " + validators['etag'] + "\r\n"
+        if 'last-modified' in validators:
+            conditional += "If-Modified-Since: " + validators['last-modified'] + "\r\n"
+
+        log.info("[%s] Sending http request to HTTP server.....", "HEAD")
+        request = ("HEAD /" + filename.rsplit(os.sep, 1)[1] + " HTTP/1.1\r\n" +
+                   "Host: " + self.clientIP + "\r\n" +
+                   WANT_DIGEST + conditional + "\r\n")
+        self.clientSocket.sendall(request.encode())
+        response = self._recvResponse()
+        headers = response.headers
+        log.info("[%s] HTTP Response: %s", "HEAD", response)
+
+        if response.code == 304:
+            log.info("[%s] %s is up to date", method, filename)
+            return 304
+
+        # A copy of the file without validators may be up to date as well
+        size = int(headers.get('content-length', 0))
+        digest = messageDigests(headers)[0]
+        if (response.code == 200 and digest is not None and os.path.isfile(filename) and
+                os.path.getsize(filename) == size and self._fileDigest(filename) == digest):
+            log.info("[%s] %s is up to date", method, filename)
+            self._saveValidators(filename, headers)
+            return 304
+
+        ifRange = headers.get('etag', headers.get('last-modified'))
+        if (response.code != 200 or headers.get('accept-ranges') != 'bytes' or
+                ifRange is None or size < connections * self.minRangeSize):
+            return self.get(method, name)
+
+        # Split the file into one range per connection
+        rangeSize = size // connections
+        ranges = [(i * rangeSize, (i + 1) * rangeSize - 1) for i in range(connections)]
+        ranges[-1] = (ranges[-1][0], size - 1)
+
+        with open(partFile, 'wb') as f:
+            f.truncate(size)
+
+        errors = []
+        transferred = []
+        def fetch(first, last):
+            httpClient = HTTPClient(self.clientIP, self.clientPort, self.clientDirectory)
+            try:
+                httpClient.connect(self.serverIP, self.serverPort)
+                httpClient._getRange(method, filename, partFile, first, last, ifRange)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                transferred.append(httpClient.bytesTransferred)
+                httpClient.close()
+
+        threads = [threading.Thread(target=fetch, args=r) for r in ranges]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.bytesTransferred += sum(transferred)
+
+        if errors:
+            self._discardPart(partFile)
+            log.debug(errors[0])
+            raise RequestError("[%s] HTTP request failed!" % (method,))
+
+        if digest is not None and self._fileDigest(partFile) != digest:
+            self._discardPart(partFile)
+            raise RequestError("[%s] Downloaded file does not match its Repr-Digest!" % (method,))
+        os.replace(partFile, filename)
+        self._saveValidators(filename, headers)
+        return 200
+
+    def _getRange(self, method, filename, partFile, first, last, ifRange):
+        """
+        GET bytes first to last of the given version of the file
+        into the same position of the part file.
+        """
+        log.info("[%s] Sending http request to HTTP server.....", method)
+        request = (method + " /" + filename.rsplit(os.sep, 1)[1] + " HTTP/1.1\r\n" +
+                   "Host: " + self.clientIP + "\r\n" +
+                   "Range: bytes=%d-%d\r\n" % (first, last) +
+                   "If-Range: " + ifRange + "\r\n\r\n")
+        self.clientSocket.sendall(request.encode())
+
+        response = self._recvResponse()
+        headers = response.headers
+        log.info("[%s] HTTP Response: %s", method, response)
+        contentLength = int(headers.get('content-length', 0))
+        if (response.code != 206 or
+                not headers.get('content-range', '').startswith("bytes %d-%d/" % (first, last))):
+            raise RequestError("[%s] File changed during the download!" % (method,))
+
+        with open(partFile, 'r+b') as f:
+            f.seek(first)
+            self._recvBody(contentLength, f.write)
 
     def put(self, method, filename):
         """
         PUT request.
+        Large files are sent as a byte range continuing whatever part
+        of them the server received before, so that an interrupted
+        upload resumes where it stopped, and not at all if the server
+        has them already (304). The server checks the file against the
+        Repr-Digest sent along.
         """
         filename = os.path.join(self.clientDirectory, filename)
 
         # Checking if the given file is valid
         if not os.path.isfile(filename):
             raise RequestError("[%s] File does not exist!" % (method,))
+
+        size = os.path.getsize(filename)
+        digest = self._fileDigest(filename)
+        if size >= self.skipThreshold and self._remoteDigest(filename) == digest:
+            log.info("[%s] %s is up to date on the server", method, filename)
+            return 304
+
+        resumable = size >= self.resumeThreshold
+        offset = self._uploaded(method, filename, size) if resumable else 0
         
-        # Send a PUT request to HTTP server
-        log.info("[%s] Sending http request to HTTP server.....", method)
-        request = (method + " /" + filename.rsplit(os.sep, 1)[1] + " HTTP/1.1\n" +
-                   "Host: " + self.clientIP + "\n\n")
-        self.clientSocket.send(request.encode())
-        log.debug("[%s] HTTP Request: %s", method, request)
-        
-        # Wait for some time after sending PUT request
-        time.sleep(2)
-        
-        # Send file over TCP connection to the server
+        # Send a PUT request to HTTP server, followed by the file
+        # over TCP connection to the server
         try:
             with open(filename, 'rb') as f:
+                log.info("[%s] Sending http request to HTTP server.....", method)
+                request = (method + " /" + filename.rsplit(os.sep, 1)[1] + " HTTP/1.1\r\n" +
+                           "Host: " + self.clientIP + "\r\n" +
+                           "Repr-Digest: " + formatDigest(digest) + "\r\n" +
+                           "Content-Length: %d\r\n" % (size - offset))
+                if resumable:
+                    request += "Content-Range: bytes %d-%d/%d\r\n" % (offset, size - 1, size)
+                request += "\r\n"
+                self.clientSocket.sendall(request.encode())
+                log.debug("[%s] HTTP Request: %s", method, request)
+
+                f.seek(offset)
                 payload = f.read(1024)
                 while payload:
-                    log.debug("[%s] 1024 bytes were sent....." % (method,))
-                    self.clientSocket.send(payload)
+                    self.clientSocket.sendall(payload)
+                    self.bytesTransferred += len(payload)
                     payload = f.read(1024)
-                
-                time.sleep(2)
-                
-                self.clientSocket.send("EOF".encode())
         except Exception as e:
             log.error("[%s] HTTP request failed!" % (method,))
             log.debug(e)
             raise RequestError("[%s] HTTP request failed!" % (method,))
 
-        time.sleep(2)
-
-        response = self.clientSocket.recv(2048)
-        response = response.decode('utf-8')
+        response = self._recvResponse()
+        headers = response.headers
+        self._recvBody(int(headers.get('content-length', 0)), lambda data: None)
         log.info("[%s] HTTP Response: %s", method, response)
+        return response.code
+
+    def _uploaded(self, method, filename, size):
+        """
+        Ask the server how many bytes of an interrupted upload of
+        the file it has received.
+        """
+        request = (method + " /" + filename.rsplit(os.sep, 1)[1] + " HTTP/1.1\r\n" +
+                   "Host: " + self.clientIP + "\r\n" +
+                   "Content-Range: bytes */%d\r\n" % size +
+                   "Content-Length: 0\r\n\r\n")
+        self.clientSocket.sendall(request.encode())
+
+        response = self._recvResponse()
+        headers = response.headers
+        self._recvBody(int(headers.get('content-length', 0)), lambda data: None)
+
+        received = headers.get('range', '')
+        if response.code != 202 or not received.startswith('bytes=0-'):
+            return 0
+
+        offset = int(received[len('bytes=0-'):]) + 1
+        if offset >= size:
+            return 0
+        log.info("[%s] Resuming upload of %s at byte %d", method, filename, offset)
+        return offset
+
+    def _remoteDigest(self, filename):
+        """
+        Returns the SHA-256 digest of the server's copy of the file,
+        None if it has none or does not tell.
+        """
+        request = ("HEAD /" + filename.rsplit(os.sep, 1)[1] + " HTTP/1.1\r\n" +
+                   "Host: " + self.clientIP + "\r\n" +
+                   WANT_DIGEST + "\r\n")
+        self.clientSocket.sendall(request.encode())
+
+        # Responses to HEAD have no body
+        response = self._recvResponse()
+        if response.code != 200:
+            return None
+        return messageDigests(response.headers)[0]
+
+    def _recvResponse(self):
+        """
+        Receive status line and headers of the server response.
+        Returns the parsed Response.
+        """
+        while True:
+            try:
+                response = self.parser.parse(self.buffer)
+            except ParseError as e:
+                raise RequestError("Malformed HTTP response: %s" % e)
+            if response is not None:
+                self._trackKeepAlive(response)
+                return response
+
+            data = self.clientSocket.recv(65536)
+            if not data:
+                raise RequestError("Connection closed before the response header was complete!")
+            self.buffer += data
+
+    def _recvBody(self, contentLength, write, bodyHash=None):
+        """
+        Receive exactly contentLength bytes of response body,
+        feeding them to the hash object bodyHash, if any.
+        """
+        remaining = contentLength
+
+        data = bytes(self.buffer[:remaining])
+        del self.buffer[:len(data)]
+        while True:
+            write(data)
+            if bodyHash is not None:
+                bodyHash.update(data)
+            self.bytesTransferred += len(data)
+            remaining -= len(data)
+            if remaining <= 0:
+                break
+
+            data = self.clientSocket.recv(min(65536, remaining))
+            if not data:
+                raise RequestError("Connection closed before the response body was complete!")
+
+        self.lastUsed = time.time()
+
+    def _trackKeepAlive(self, response):
+        """
+        Note whether the server keeps the connection open after
+        the response, and for how long.
+        """
+        self.keepAlive, keepAliveTimeout, _ = persistence(response)
+        if keepAliveTimeout is not None:
+            self.keepAliveTimeout = keepAliveTimeout
+
+        self.responseCount += 1
+        self.lastUsed = time.time()
+
+    def reusable(self):
+        """
+        Whether the connection can carry another request: the server
+        keeps it open, it has not been idle for as long as the server
+        waits, and the server has not closed it meanwhile.
+        """
+        if not self.keepAlive or self.buffer:
+            return False
+        if self.keepAliveTimeout is not None and time.time() - self.lastUsed >= self.keepAliveTimeout - 1:
+            return False
+
+        try:
+            readable, _, _ = select.select([self.clientSocket], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        # An idle connection only turns readable when the server closes it
+        return not readable
     
     def close(self):
         """
@@ -143,3 +576,635 @@ class HTTPClient:
             log.error("Could not shut down the socket!")
             log.debug(e)
 
+
+class ConnectionPool(object):
+    """
+    Persistent connections to HTTP servers, kept per (host, port) and
+    reused across requests instead of connecting for every one.
+    Idle connections are checked before reuse and closed once idle
+    for idleTimeout seconds; at most maxSize of them are kept.
+    """
+
+    def __init__(self, clientIP="127.0.0.1", clientPort=0,
+                       clientDirectory=os.path.join(os.getcwd(), "data", "client"),
+                       maxSize=8, idleTimeout=10):
+        self.clientIP = clientIP
+        self.clientPort = clientPort
+        self.clientDirectory = clientDirectory
+        self.maxSize = maxSize
+        self.idleTimeout = idleTimeout
+
+        # Idle connections by (host, port), most recently used last
+        self.idle = {}
+        self.lock = threading.Lock()
+
+        # Body bytes sent and received by requests through the pool
+        self.bytesTransferred = 0
+
+    def acquire(self, serverIP, serverPort):
+        """
+        Returns a connected HTTPClient for the server, reusing an
+        idle connection if one is still usable.
+        """
+        now = time.time()
+        stale = []
+        httpClient = None
+        with self.lock:
+            connections = self.idle.get((serverIP, serverPort), [])
+            while connections:
+                candidate = connections.pop()
+                if now - candidate.lastUsed < self.idleTimeout and candidate.reusable():
+                    httpClient = candidate
+                    break
+                stale.append(candidate)
+
+        for candidate in stale:
+            candidate.close()
+        if httpClient is not None:
+            log.debug("Reusing connection with HTTP server %s:%d", serverIP, serverPort)
+            return httpClient
+
+        httpClient = HTTPClient(self.clientIP, self.clientPort, self.clientDirectory)
+        try:
+            httpClient.connect(serverIP, serverPort)
+        except Exception:
+            httpClient.close()
+            raise
+        return httpClient
+
+    def release(self, httpClient):
+        """
+        Return a connection obtained from acquire() to the pool.
+        """
+        if not httpClient.reusable():
+            httpClient.close()
+            return
+
+        evicted = []
+        with self.lock:
+            self.idle.setdefault((httpClient.serverIP, httpClient.serverPort), []).append(httpClient)
+            evicted = self._evict(time.time())
+
+        for candidate in evicted:
+            candidate.close()
+
+    def _evict(self, now):
+        """
+        Take idle connections past idleTimeout, and the least recently
+        used ones beyond maxSize, out of the pool. Returns them.
+        """
+        evicted = []
+        for key, connections in list(self.idle.items()):
+            while connections and now - connections[0].lastUsed >= self.idleTimeout:
+                evicted.append(connections.pop(0))
+            if not connections:
+                del self.idle[key]
+
+        while sum(len(connections) for connections in self.idle.values()) > self.maxSize:
+            key = min(self.idle, key=lambda key: self.idle[key][0].lastUsed)
+            evicted.append(self.idle[key].pop(0))
+            if not self.idle[key]:
+                del self.idle[key]
+
+        return evicted
+
+    def request(self, serverIP, serverPort, method, filename, connections=1):
+        """
+        Send a request over a pooled connection. A reused connection
+        the server closed in the meantime is replaced by a new one once.
+        With connections > 1, GET fetches byte ranges in parallel.
+        Returns the status code of the final response.
+        """
+        while True:
+            httpClient = self.acquire(serverIP, serverPort)
+            reused = httpClient.responseCount > 0
+            transferred = httpClient.bytesTransferred
+            try:
+                if method == "GET" and connections > 1:
+                    code = httpClient.getRanges(method, filename, connections)
+                else:
+                    code = httpClient.request(method, filename)
+            except Exception as e:
+                httpClient.close()
+                if reused:
+                    log.debug("Retrying on a new connection: %r", e)
+                    continue
+                raise
+            finally:
+                with self.lock:
+                    self.bytesTransferred += httpClient.bytesTransferred - transferred
+
+            self.release(httpClient)
+            return code
+
+    def batch(self, serverIP, serverPort, requests, connections=1):
+        """
+        Send (method, filename) requests one after another over pooled
+        connections. Returns (method, filename, error) for each
+        request, error being None on success.
+        """
+        results = []
+        for method, filename in requests:
+            try:
+                code = self.request(serverIP, serverPort, method, filename, connections)
+                if code >= 400:
+                    raise RequestError("[%s] %s: HTTP status %d" % (method, filename, code))
+                results.append((method, filename, None))
+            except Exception as e:
+                log.error("[%s] %s failed: %s", method, filename, e)
+                results.append((method, filename, e))
+
+        return results
+
+    def close(self):
+        """
+        Close all idle connections.
+        """
+        with self.lock:
+            connections = [httpClient for idle in self.idle.values() for httpClient in idle]
+            self.idle = {}
+
+        for httpClient in connections:
+            httpClient.close()
+
+
+class ConnectionClosed(ConnectionError):
+    """
+    The server closed the connection before responding to a request
+    sent on it, e.g. one pipelined past its last request: the request
+    is worth sending again on another connection.
+    """
+    pass
+
+
+class AsyncConnection(object):
+    """
+    Persistent connection of an AsyncHTTPClient to a server. Requests
+    go out as soon as they are made, before the responses to the
+    previous ones have arrived (pipelining); the responses are read
+    back in the order of the requests.
+    """
+
+    chunkSize = 65536
+
+    def __init__(self, owner, serverIP, serverPort, timeout=30):
+        self.owner = owner
+        self.serverIP = serverIP
+        self.serverPort = serverPort
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.opened = asyncio.Event()
+        self.closed = False
+
+        # Bytes received past the end of the last parsed message
+        self.buffer = bytearray()
+        self.parser = ResponseParser()
+
+        # Persistence of the connection, as announced by the server
+        self.keepAlive = True
+        self.keepAliveTimeout = None
+        self.lastUsed = time.time()
+        # Requests the server serves after the last response read
+        self.maxRequests = None
+
+        # Requests sent and responses read so far, waiting for their
+        # turn on self.turn; requests given the connection and not
+        # done yet, a PUT having it to itself (exclusive)
+        self.sent = 0
+        self.received = 0
+        self.turn = asyncio.Condition()
+        self.pending = 0
+        self.exclusive = False
+
+    async def open(self):
+        """
+        Connect to the HTTP server.
+        """
+        log.info("Connecting with HTTP server %s:%d", self.serverIP, self.serverPort)
+        try:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.serverIP, self.serverPort), self.timeout)
+        except Exception as e:
+            log.error("Could not establish connection with the server!")
+            log.debug(e)
+            self.closed = True
+            raise ConnectionError("[%s:%d] Connection with HTTP server failed!" % (self.serverIP, self.serverPort))
+        finally:
+            self.opened.set()
+
+    def usable(self):
+        """
+        Whether the connection can carry another request: the server
+        keeps it open and, if idle, has not been idle for as long as
+        the server waits.
+        """
+        if self.closed or not self.keepAlive:
+            return False
+        if self.reader is not None and self.reader.at_eof():
+            return False
+        # Requests pipelined past the last one the server serves are lost
+        if self.maxRequests is not None and self.sent - self.received >= self.maxRequests:
+            return False
+        return (self.pending > 0 or self.keepAliveTimeout is None or
+                time.time() - self.lastUsed < self.keepAliveTimeout - 1)
+
+    async def exchange(self, head, receive, sendBody=None):
+        """
+        Send a request, its head and the body sent by sendBody(self),
+        if any, then handle its response with receive(self, response)
+        once the responses to the requests sent before it are read.
+        Returns what receive returns.
+        """
+        await self.opened.wait()
+        if self.closed:
+            raise ConnectionClosed("Connection closed before the request was sent!")
+
+        turn = self.sent
+        self.sent += 1
+        try:
+            try:
+                self.writer.write(head.encode())
+                if sendBody is not None:
+                    await sendBody(self)
+                await asyncio.wait_for(self.writer.drain(), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                raise ConnectionClosed("Connection closed while sending the request: %r" % e)
+
+            async with self.turn:
+                await self.turn.wait_for(lambda: self.received == turn or self.closed)
+            if self.closed:
+                raise ConnectionClosed("Connection closed before the response!")
+
+            response = await self._recvResponse()
+            result = await receive(self, response)
+            if not self.keepAlive:
+                self.close()
+            return result
+        except BaseException:
+            # The responses to the requests sent after this one are lost
+            self.close()
+            raise
+        finally:
+            async with self.turn:
+                if self.received == turn:
+                    self.received += 1
+                self.turn.notify_all()
+
+    async def _recvResponse(self):
+        """
+        Receive status line and headers of the next response.
+        Returns the parsed Response.
+        """
+        while True:
+            try:
+                response = self.parser.parse(self.buffer)
+            except ParseError as e:
+                raise RequestError("Malformed HTTP response: %s" % e)
+            if response is not None:
+                self.keepAlive, keepAliveTimeout, self.maxRequests = persistence(response)
+                if keepAliveTimeout is not None:
+                    self.keepAliveTimeout = keepAliveTimeout
+                self.lastUsed = time.time()
+                return response
+
+            data = await asyncio.wait_for(self.reader.read(self.chunkSize), self.timeout)
+            if not data:
+                if not self.buffer:
+                    raise ConnectionClosed("Connection closed before the response!")
+                raise RequestError("Connection closed before the response header was complete!")
+            self.buffer += data
+
+    async def recvBody(self, contentLength, write, bodyHash=None):
+        """
+        Receive exactly contentLength bytes of response body,
+        handing them to write and to the hash object bodyHash,
+        if any, as they arrive.
+        """
+        remaining = contentLength
+
+        data = bytes(self.buffer[:remaining])
+        del self.buffer[:len(data)]
+        while True:
+            write(data)
+            if bodyHash is not None:
+                bodyHash.update(data)
+            self.owner.bytesTransferred += len(data)
+            remaining -= len(data)
+            if remaining <= 0:
+                break
+
+            data = await asyncio.wait_for(self.reader.read(min(self.chunkSize, remaining)), self.timeout)
+            if not data:
+                raise RequestError("Connection closed before the response body was complete!")
+
+        self.lastUsed = time.time()
+
+    async def sendFile(self, f, length):
+        """
+        Send length bytes of f from its current position as the
+        request body, no faster than the server takes them.
+        """
+        while length > 0:
+            payload = f.read(min(self.chunkSize, length))
+            if not payload:
+                raise RequestError("File shrank while it was being sent!")
+            self.writer.write(payload)
+            self.owner.bytesTransferred += len(payload)
+            length -= len(payload)
+            await asyncio.wait_for(self.writer.drain(), self.timeout)
+
+    def close(self):
+        """
+        Close the TCP connection.
+        """
+        self.closed = True
+        if self.writer is not None:
+            self.writer.close()
+
+
+class AsyncHTTPClient(ClientFiles):
+    """
+    asyncio counterpart of HTTPClient, transferring many files at once
+    from a single thread. Requests to a server share at most
+    maxConnections persistent connections to it, each carrying up to
+    pipeline GET requests sent ahead of their responses; PUT requests
+    have a connection to themselves. Bodies are streamed between the
+    sockets and the files of clientDirectory, laid out as with
+    HTTPClient. Requests the server closed a connection on before
+    responding are sent again on another one, up to attempts times.
+    """
+
+    # Files at least this large are uploaded resumably
+    resumeThreshold = HTTPClient.resumeThreshold
+
+    # Files at least this large are only uploaded if the server's copy
+    # of them has another digest
+    skipThreshold = HTTPClient.skipThreshold
+
+    def __init__(self, clientIP="127.0.0.1",
+                       clientDirectory=os.path.join(os.getcwd(), "data", "client"),
+                       maxConnections=4, pipeline=8, timeout=30, attempts=3):
+        self.clientIP = clientIP
+        self.clientDirectory = clientDirectory
+        self.maxConnections = max(maxConnections, 1)
+        self.pipeline = max(pipeline, 1)
+        self.timeout = timeout
+        self.attempts = attempts
+
+        # Connections by (host, port), and the conditions requests
+        # wait on for room on one of them
+        self.connections = {}
+        self.available = {}
+
+        # Body bytes sent and received over all connections
+        self.bytesTransferred = 0
+
+    async def request(self, serverIP, serverPort, method, filename):
+        """
+        Send http request to HTTP server.
+        Returns the status code of the final response.
+        """
+        if method == "GET":
+            return await self.get(serverIP, serverPort, filename)
+        elif method == "PUT":
+            return await self.put(serverIP, serverPort, filename)
+
+        raise RequestError("[%s] Unsupported request method!" % (method,))
+
+    async def get(self, serverIP, serverPort, filename):
+        """
+        GET request, into the file of the client directory, resuming
+        an interrupted download as HTTPClient.get() does.
+        Returns the status code of the final response.
+        """
+        method = "GET"
+        name = filename
+        filename = os.path.join(self.clientDirectory, filename)
+        partFile = self._partFile(filename)
+        conditional, offset = self._conditional(method, filename, partFile)
+
+        log.info("[%s] Sending http request to HTTP server.....", method)
+        request = (method + " /" + os.path.basename(filename) + " HTTP/1.1\r\n" +
+                   "Host: " + self.clientIP + "\r\n" +
+                   conditional + "\r\n")
+
+        async def receive(connection, response):
+            headers = response.headers
+            contentLength = int(headers.get('content-length', 0))
+            log.info("[%s] HTTP Response: %s", method, response)
+            status = response.code
+
+            if status == 304:
+                log.info("[%s] %s is up to date", method, filename)
+            elif status in (200, 206):
+                start = offset if status == 206 else 0
+                if status == 206 and not headers.get('content-range', '').startswith("bytes %d-" % offset):
+                    await connection.recvBody(contentLength, lambda data: None)
+                    raise RequestError("[%s] Unexpected range in HTTP response!" % (method,))
+
+                try:
+                    # Remember the version being downloaded, for resuming
+                    self._saveValidators(partFile, headers)
+                    bodyHash = await self._offLoop(self._bodyHash, headers, partFile, start)
+                    with open(partFile, 'r+b' if start else 'wb') as f:
+                        f.seek(start)
+                        f.truncate()
+                        await connection.recvBody(contentLength, f.write, bodyHash)
+
+                    self._verify(method, partFile, headers, bodyHash)
+                    os.replace(partFile, filename)
+                    self._saveValidators(filename, headers)
+                    self._saveValidators(partFile, {})
+                except (IOError, OSError, RequestError) as e:
+                    log.error("[%s] HTTP request failed!" % (method,))
+                    log.debug(e)
+                    raise RequestError("[%s] HTTP request failed!" % (method,))
+            else:
+                await connection.recvBody(contentLength, lambda data: None)
+            return status
+
+        status = await self._exchange(serverIP, serverPort, request, receive, pipelined=True)
+
+        # Start over if the part downloaded so far is unusable
+        if status == 416 and offset:
+            self._discardPart(partFile)
+            return await self.get(serverIP, serverPort, name)
+        return status
+
+    async def put(self, serverIP, serverPort, filename):
+        """
+        PUT request of the file of the client directory, resuming an
+        interrupted upload of large files, or skipping it, as
+        HTTPClient.put() does.
+        Returns the status code of the final response.
+        """
+        method = "PUT"
+        filename = os.path.join(self.clientDirectory, filename)
+
+        # Checking if the given file is valid
+        if not os.path.isfile(filename):
+            raise RequestError("[%s] File does not exist!" % (method,))
+
+        size = os.path.getsize(filename)
+        digest = await self._offLoop(self._fileDigest, filename)
+        if size >= self.skipThreshold and await self._remoteDigest(serverIP, serverPort, filename) == digest:
+            log.info("[%s] %s is up to date on the server", method, filename)
+            return 304
+
+        resumable = size >= self.resumeThreshold
+        offset = await self._uploaded(serverIP, serverPort, filename, size) if resumable else 0
+
+        log.info("[%s] Sending http request to HTTP server.....", method)
+        request = (method + " /" + os.path.basename(filename) + " HTTP/1.1\r\n" +
+                   "Host: " + self.clientIP + "\r\n" +
+                   "Repr-Digest: " + formatDigest(digest) + "\r\n" +
+                   "Content-Length: %d\r\n" % (size - offset))
+        if resumable:
+            request += "Content-Range: bytes %d-%d/%d\r\n" % (offset, size - 1, size)
+        request += "\r\n"
+
+        with open(filename, 'rb') as f:
+            async def sendBody(connection):
+                f.seek(offset)
+                await connection.sendFile(f, size - offset)
+
+            async def receive(connection, response):
+                await connection.recvBody(int(response.headers.get('content-length', 0)), lambda data: None)
+                log.info("[%s] HTTP Response: %s", method, response)
+                return response.code
+
+            return await self._exchange(serverIP, serverPort, request, receive, sendBody)
+
+    async def _uploaded(self, serverIP, serverPort, filename, size):
+        """
+        Ask the server how many bytes of an interrupted upload of
+        the file it has received.
+        """
+        request = ("PUT /" + os.path.basename(filename) + " HTTP/1.1\r\n" +
+                   "Host: " + self.clientIP + "\r\n" +
+                   "Content-Range: bytes */%d\r\n" % size +
+                   "Content-Length: 0\r\n\r\n")
+
+        async def receive(connection, response):
+            await connection.recvBody(int(response.headers.get('content-length', 0)), lambda data: None)
+            return response
+
+        response = await self._exchange(serverIP, serverPort, request, receive)
+        received = response.headers.get('range', '')
+        if response.code != 202 or not received.startswith('bytes=0-'):
+            return 0
+
+        offset = int(received[len('bytes=0-'):]) + 1
+        if offset >= size:
+            return 0
+        log.info("[%s] Resuming upload of %s at byte %d", "PUT", filename, offset)
+        return offset
+
+    async def _remoteDigest(self, serverIP, serverPort, filename):
+        """
+        Returns the SHA-256 digest of the server's copy of the file,
+        None if it has none or does not tell.
+        """
+        request = ("HEAD /" + os.path.basename(filename) + " HTTP/1.1\r\n" +
+                   "Host: " + self.clientIP + "\r\n" +
+                   WANT_DIGEST + "\r\n")
+
+        # Responses to HEAD have no body
+        async def receive(connection, response):
+            return messageDigests(response.headers)[0] if response.code == 200 else None
+
+        return await self._exchange(serverIP, serverPort, request, receive, pipelined=True)
+
+    async def _offLoop(self, function, *args):
+        """
+        Run function(*args), hashing files, off the event loop.
+        """
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def _exchange(self, serverIP, serverPort, request, receive, sendBody=None, pipelined=False):
+        """
+        Send a request over a connection to the server and handle its
+        response, see AsyncConnection.exchange(). Only pipelined
+        requests share a connection with other requests.
+        """
+        key = (serverIP, serverPort)
+        attempt = 1
+        while True:
+            connection = await self._acquire(key, pipelined)
+            try:
+                return await connection.exchange(request, receive, sendBody)
+            except ConnectionClosed as e:
+                if attempt >= self.attempts:
+                    raise
+                attempt += 1
+                log.debug("Retrying on another connection: %s", e)
+            finally:
+                await self._release(key, connection)
+
+    async def _acquire(self, key, pipelined):
+        """
+        Returns a connection to the server with room for a request,
+        opening one while fewer than maxConnections are open, or
+        waiting for one otherwise.
+        """
+        available = self.available.setdefault(key, asyncio.Condition())
+        connections = self.connections.setdefault(key, [])
+        opening = False
+        async with available:
+            while True:
+                for connection in [c for c in connections if not c.pending and not c.usable()]:
+                    connection.close()
+                    connections.remove(connection)
+
+                # The least busy connection with room for the request
+                candidates = [c for c in connections if c.usable() and not c.exclusive and
+                              c.pending < (self.pipeline if pipelined else 1)]
+                if candidates:
+                    connection = min(candidates, key=lambda c: c.pending)
+                    break
+                if len(connections) < self.maxConnections:
+                    connection = AsyncConnection(self, key[0], key[1], self.timeout)
+                    connections.append(connection)
+                    opening = True
+                    break
+                await available.wait()
+
+            connection.pending += 1
+            connection.exclusive = not pipelined
+
+        if opening:
+            try:
+                await connection.open()
+            except BaseException:
+                await self._release(key, connection)
+                raise
+        return connection
+
+    async def _release(self, key, connection):
+        """
+        Give back the room a request took on a connection.
+        """
+        available = self.available[key]
+        async with available:
+            connection.pending -= 1
+            if connection.pending:
+                available.notify()
+                return
+
+            connection.exclusive = False
+            connections = self.connections.get(key, [])
+            if not connection.usable() and connection in connections:
+                connection.close()
+                connections.remove(connection)
+            available.notify_all()
+
+    def close(self):
+        """
+        Close all connections.
+        """
+        for connections in self.connections.values():
+            for connection in connections:
+                connection.close()
+        self.connections = {}
+        self.available = {}
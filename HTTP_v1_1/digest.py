@@ -0,0 +1,66 @@
+import base64
+import hashlib
+
+
+# Bytes read at a time when hashing files
+CHUNK_SIZE = 262144
+
+# Request header asking for the Repr-Digest of the response
+WANT_DIGEST = "Want-Repr-Digest: sha-256=10\r\n"
+
+
+def formatDigest(digest):
+    """
+    Returns the Repr-Digest or Content-Digest field value (RFC 9530)
+    of a SHA-256 digest.
+    """
+    return "sha-256=:%s:" % base64.b64encode(digest).decode()
+
+
+def parseDigest(value):
+    """
+    Returns the SHA-256 digest in a Repr-Digest or Content-Digest field
+    value (RFC 9530), or in a Digest one (RFC 3230), or None.
+    """
+    for member in (value or "").split(","):
+        algorithm, _, encoded = member.partition("=")
+        if algorithm.strip().lower() != "sha-256":
+            continue
+
+        encoded = encoded.strip()
+        if len(encoded) > 1 and encoded[0] == encoded[-1] == ":":
+            encoded = encoded[1:-1]
+        try:
+            digest = base64.b64decode(encoded, validate=True)
+        except ValueError:
+            return None
+        return digest if len(digest) == hashlib.sha256().digest_size else None
+
+    return None
+
+
+def messageDigests(headers):
+    """
+    Returns the SHA-256 digests sent along with a message, of its
+    representation (Repr-Digest, or the older Digest) and of its
+    content (Content-Digest), None when absent.
+    """
+    reprDigest = parseDigest(headers.get('repr-digest')) or parseDigest(headers.get('digest'))
+    return reprDigest, parseDigest(headers.get('content-digest'))
+
+
+def hashFile(f, length=None):
+    """
+    Returns a SHA-256 hash object fed with the first length bytes of
+    the opened file f, or all of it.
+    """
+    sha256 = hashlib.sha256()
+    f.seek(0)
+    while length is None or length > 0:
+        data = f.read(CHUNK_SIZE if length is None else min(CHUNK_SIZE, length))
+        if not data:
+            break
+        sha256.update(data)
+        if length is not None:
+            length -= len(data)
+    return sha256
@@ -0,0 +1,143 @@
+import os
+import zlib
+import mimetypes
+
+from HTTP_v1_1.cache import VariantCache
+
+
+# Content codings the server produces, most preferred first
+ENCODINGS = ("gzip", "deflate")
+
+# Media types worth compressing, besides text/*
+COMPRESSIBLE_TYPES = frozenset(("application/javascript", "application/json", "application/xml",
+                                "application/xhtml+xml", "application/rss+xml", "application/atom+xml",
+                                "application/wasm", "application/x-javascript", "image/svg+xml",
+                                "image/x-icon", "image/bmp", "font/ttf", "font/otf"))
+
+
+def acceptedEncodings(acceptEncoding):
+    """
+    Returns the quality values of the content codings listed in an
+    Accept-Encoding header value (RFC 7231 5.3.4), by lowercase name.
+    """
+    accepted = {}
+    for item in acceptEncoding.split(","):
+        coding, _, parameters = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+
+        quality = 1.0
+        parameter, _, value = parameters.partition("=")
+        if parameter.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        if coding == "x-gzip":
+            coding = "gzip"
+        accepted[coding] = quality
+    return accepted
+
+
+def negotiate(acceptEncoding, available=ENCODINGS):
+    """
+    Returns the available content coding the client prefers,
+    or None if it accepts none of them.
+    """
+    if not acceptEncoding:
+        return None
+
+    accepted = acceptedEncodings(acceptEncoding)
+    anything = accepted.get("*", 0.0)
+    best, bestQuality = None, 0.0
+    for encoding in available:
+        quality = accepted.get(encoding, anything)
+        if quality > bestQuality:
+            best, bestQuality = encoding, quality
+    return best
+
+
+class Compressor(object):
+    """
+    Server-wide source of compressed file variants: precompressed
+    ".gz" siblings of files, and files of compressible types between
+    minSize and maxSize bytes compressed on the fly. Compressed bodies
+    are kept in a VariantCache of at most cacheSize bytes.
+    """
+
+    def __init__(self, minSize=1024, maxSize=1024 * 1024, cacheSize=16 * 1024 * 1024, level=6):
+        self.minSize = minSize
+        self.maxSize = maxSize
+        self.level = level
+        self.cache = VariantCache(cacheSize, maxSize, encodings=ENCODINGS)
+
+        # Whether files are compressible, by extension
+        self.compressibleTypes = {}
+
+        # Load the type map now rather than on the first request
+        mimetypes.init()
+
+    def compressible(self, path):
+        """
+        Whether the type of the file is worth compressing.
+        """
+        extension = os.path.splitext(path)[1].lower()
+        compressible = self.compressibleTypes.get(extension)
+        if compressible is not None:
+            return compressible
+
+        mimeType, encoding = mimetypes.guess_type("file" + extension)
+        compressible = (mimeType is not None and encoding is None and
+                        (mimeType.startswith("text/") or mimeType in COMPRESSIBLE_TYPES))
+        # Bounded, as extensions come from request paths
+        if len(self.compressibleTypes) < 1024:
+            self.compressibleTypes[extension] = compressible
+        return compressible
+
+    def worthCompressing(self, size):
+        """
+        Whether a file of size bytes is compressed on the fly.
+        """
+        return self.minSize <= size <= self.maxSize
+
+    def precompressed(self, stat, siblingStat):
+        """
+        Whether the ".gz" sibling of a file is to be served in its place,
+        given their stat(), None for a missing sibling: when it is at
+        least as recent as the file.
+        """
+        return siblingStat is not None and siblingStat.st_mtime >= stat.st_mtime
+
+    def compress(self, body, encoding):
+        """
+        Returns body compressed with the gzip or deflate (zlib) coding.
+        """
+        # wbits 31 writes a gzip header and trailer, 15 a zlib one
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31 if encoding == "gzip" else 15)
+        return compressor.compress(body) + compressor.flush()
+
+    def variant(self, path, encoding, size):
+        """
+        Compress the file at path, of size bytes, with encoding and
+        cache it; look it up in self.cache first, as this takes a while.
+        Returns the cache entry, or None if it is not worth compressing.
+        Raises IOError.
+        """
+        if not self.worthCompressing(size):
+            return None
+
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            body = f.read(self.maxSize + 1)
+        if len(body) > self.maxSize:
+            return None
+
+        compressed = self.compress(body, encoding)
+        if len(compressed) >= len(body):
+            return None
+        # Entries too large for the cache are still served
+        return self.cache.put((path, encoding), compressed, stat)
+
+    def invalidate(self, path):
+        self.cache.invalidate(path)
@@ -0,0 +1,125 @@
+import sys
+import os
+import atexit
+import logging
+import logging.handlers
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+# Logger of the package; modules log through children of it
+LOGGER = "HTTP_v1_1"
+
+# Structured access log, one line per served request
+ACCESS_LOGGER = "HTTP_v1_1.access"
+
+
+_queueHandler = None
+_handlers = []
+_listener = None
+
+
+def configureLogging(level=logging.INFO, accessLog=None, name="HTTPServer"):
+    """
+    Log the records of the package at level (a level or its name)
+    to standard error, and access log lines to the accessLog file
+    ("-" for standard output, None to disable the access log).
+    Records are only put on a queue by the logging thread; a listener
+    thread formats and writes them. The root logger is left alone.
+    """
+    global _queueHandler, _handlers, _listener
+
+    _removeHandlers()
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter('%(asctime)s ' + name + ' [%(levelname)s] %(message)s'))
+    console.addFilter(lambda record: record.name != ACCESS_LOGGER)
+    _handlers = [console]
+
+    access = logging.getLogger(ACCESS_LOGGER)
+    if accessLog:
+        if accessLog == "-":
+            handler = logging.StreamHandler(sys.stdout)
+        else:
+            handler = logging.FileHandler(accessLog)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        handler.addFilter(logging.Filter(ACCESS_LOGGER))
+        _handlers.append(handler)
+        access.setLevel(logging.INFO)
+    else:
+        access.setLevel(logging.CRITICAL)
+
+    logger = logging.getLogger(LOGGER)
+    logger.setLevel(level.upper() if isinstance(level, str) else level)
+    logger.propagate = False
+
+    _queueHandler = logging.handlers.QueueHandler(queue.SimpleQueue())
+    logger.addHandler(_queueHandler)
+    _startListener()
+    return _listener
+
+
+def stopLogging():
+    """
+    Write out the queued records and stop the listener thread.
+    Records logged afterwards (e.g. while exiting) are written directly.
+    """
+    global _listener
+
+    if _listener is None:
+        return
+
+    _listener.stop()
+    _listener = None
+
+    logger = logging.getLogger(LOGGER)
+    logger.removeHandler(_queueHandler)
+    for handler in _handlers:
+        logger.addHandler(handler)
+
+
+def _startListener():
+    global _listener
+
+    _listener = logging.handlers.QueueListener(_queueHandler.queue, *_handlers,
+                                               respect_handler_level=True)
+    _listener.start()
+
+
+def _removeHandlers():
+    """
+    Undo a previous configureLogging().
+    """
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    logger = logging.getLogger(LOGGER)
+    for handler in [_queueHandler] + _handlers:
+        if handler is not None:
+            logger.removeHandler(handler)
+            handler.close()
+    del _handlers[:]
+
+
+def _restartAfterFork():
+    """
+    The listener thread does not survive fork(): a child process
+    gets a queue and a listener of its own.
+    """
+    if _listener is None:
+        return
+
+    _queueHandler.queue = queue.SimpleQueue()
+    _startListener()
+
+
+atexit.register(stopLogging)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restartAfterFork)
@@ -0,0 +1,351 @@
+import sys
+import os
+import time
+import socket
+import logging
+import threading
+
+from bisect import bisect_left
+
+from HTTP_v1_1.parser import RequestParser, ParseError
+
+
+log = logging.getLogger(__name__)
+
+
+# Content type of the Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Methods counted under a label of their own; any other is "other",
+# so that clients can not grow the number of series at will
+METHODS = ("GET", "HEAD", "PUT")
+
+
+class Metrics(object):
+    """
+    Request counters, latency histograms and gauges of a server,
+    rendered in the Prometheus text format. Counters are updated by
+    the request handlers; gauges are read from callables registered
+    by the server when the metrics are rendered.
+    """
+
+    # Upper bounds (seconds) of the request duration histogram buckets
+    durationBuckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                       0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, prefix="httpserver", profile=False, profileInterval=0.01):
+        self.prefix = prefix
+        self.started = time.time()
+        self.lock = threading.Lock()
+
+        # Requests by (method, status) and durations by method
+        self.requests = {}
+        self.durations = {}
+
+        self.counters = {"received_bytes": 0,
+                         "sent_bytes": 0,
+                         "connections": 0,
+                         "rejected_connections": 0,
+                         "reaped_connections": 0}
+        self.activeConnections = 0
+        self.gauges = []
+
+        # Opt-in sampling profiler
+        self.profiler = None
+        if profile:
+            self.profiler = StackSampler(profileInterval)
+            self.profiler.start()
+
+    def connectionOpened(self):
+        with self.lock:
+            self.counters["connections"] += 1
+            self.activeConnections += 1
+
+    def connectionClosed(self, bytesReceived=0):
+        with self.lock:
+            self.activeConnections -= 1
+            self.counters["received_bytes"] += bytesReceived
+
+    def connectionRejected(self):
+        with self.lock:
+            self.counters["rejected_connections"] += 1
+
+    def connectionReaped(self):
+        with self.lock:
+            self.counters["reaped_connections"] += 1
+
+    def requestServed(self, method, status, bytesReceived, bytesSent, duration):
+        """
+        Count a served request.
+        """
+        if method not in METHODS:
+            method = "other" if method else "none"
+        # No status when the connection failed before the response
+        status = status or 0
+        bucket = bisect_left(self.durationBuckets, duration)
+
+        with self.lock:
+            key = (method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+
+            histogram = self.durations.get(method)
+            if histogram is None:
+                # Bucket counts, then +Inf, then the sum of durations
+                histogram = self.durations[method] = [0] * (len(self.durationBuckets) + 2)
+            histogram[bucket] += 1
+            histogram[-1] += duration
+
+            self.counters["received_bytes"] += bytesReceived
+            self.counters["sent_bytes"] += bytesSent
+
+    def register(self, name, kind, description, function):
+        """
+        Report the value returned by function as the metric
+        <prefix>_<name> of kind "gauge" or "counter".
+        """
+        self.gauges.append((name, kind, description, function))
+
+    def registerCache(self, cache, name="cache"):
+        """
+        Report the counters of a ResponseCache or DigestCache, if any,
+        as <prefix>_<name>_hits_total and so on.
+        """
+        if cache is None:
+            return
+
+        for stat, kind, description in (("hits", "counter", "Lookups served from the %s."),
+                                        ("misses", "counter", "Lookups that missed the %s."),
+                                        ("evictions", "counter", "Entries evicted from the %s."),
+                                        ("entries", "gauge", "Entries in the %s."),
+                                        ("bytes", "gauge", "Bytes of the entries in the %s.")):
+            self.register("%s_%s%s" % (name, stat, "_total" if kind == "counter" else ""), kind,
+                          description % name.replace("_", " "),
+                          lambda stat=stat: cache.stats()[stat])
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text format.
+        """
+        prefix = self.prefix
+        with self.lock:
+            requests = sorted(self.requests.items())
+            durations = sorted((method, list(histogram)) for method, histogram in self.durations.items())
+            counters = dict(self.counters)
+            activeConnections = self.activeConnections
+
+        lines = []
+
+        def metric(name, kind, description, samples):
+            lines.append("# HELP %s_%s %s" % (prefix, name, description))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for labels, value in samples:
+                lines.append("%s_%s%s %s" % (prefix, name, labels, _number(value)))
+
+        metric("requests_total", "counter", "Requests served, by method and status code.",
+               [('{method="%s",code="%d"}' % (method, status), count)
+                for (method, status), count in requests])
+
+        samples = []
+        for method, histogram in durations:
+            cumulative = 0
+            for bound, count in zip(self.durationBuckets + ("+Inf",), histogram):
+                cumulative += count
+                samples.append(('_bucket{method="%s",le="%s"}' % (method, bound), cumulative))
+            samples.append(('_sum{method="%s"}' % method, histogram[-1]))
+            samples.append(('_count{method="%s"}' % method, cumulative))
+        metric("request_duration_seconds", "histogram",
+               "Time from receiving the request head to sending the response.", samples)
+
+        metric("received_bytes_total", "counter", "Bytes received from clients.",
+               [("", counters["received_bytes"])])
+        metric("sent_bytes_total", "counter", "Bytes sent to clients.",
+               [("", counters["sent_bytes"])])
+        metric("connections_total", "counter", "Client connections accepted.",
+               [("", counters["connections"])])
+        metric("rejected_connections_total", "counter", "Client connections turned away with 503.",
+               [("", counters["rejected_connections"])])
+        metric("reaped_connections_total", "counter", "Client connections aborted for missing a deadline.",
+               [("", counters["reaped_connections"])])
+        metric("active_connections", "gauge", "Client connections being served.",
+               [("", activeConnections)])
+
+        for name, kind, description, function in self.gauges:
+            try:
+                value = function()
+            except Exception as e:
+                log.debug("Metric %s failed: %r", name, e)
+                continue
+            metric(name, kind, description, [("", value)])
+
+        metric("start_time_seconds", "gauge", "Start time of the server since the epoch.",
+               [("", self.started)])
+
+        return "\n".join(lines) + "\n"
+
+    def page(self, path, metricsPath):
+        """
+        Returns the body and content type answering a GET of path,
+        or None if path is not one of the metrics pages: the metrics
+        at metricsPath, the profile at <metricsPath>/profile.
+        """
+        if path == metricsPath:
+            return self.render().encode(), CONTENT_TYPE
+        if path == metricsPath.rstrip("/") + "/profile":
+            if self.profiler is None:
+                return b"Profiler disabled\n", "text/plain; charset=utf-8"
+            return self.profiler.dump().encode(), "text/plain; charset=utf-8"
+        return None
+
+    def close(self):
+        if self.profiler is not None:
+            self.profiler.stop()
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return "%d" % value
+
+
+class StackSampler(object):
+    """
+    Wall clock sampling profiler. Every interval seconds, records the
+    stack of every other thread; dump() lists the recorded stacks in
+    collapsed form ("outer;...;inner count"), the input of flame graph
+    tools. Threads blocked in accept() or recv() show up as well.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = {}
+        self.samples = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self._sample, name="stack-sampler")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def _sample(self):
+        current = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            frames = sys._current_frames()
+            stacks = [self._collapse(frame) for ident, frame in frames.items() if ident != current]
+            del frames
+
+            with self.lock:
+                self.samples += 1
+                for stack in stacks:
+                    self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def _collapse(self, frame):
+        """
+        Returns the stack of frame as "outer;...;inner".
+        """
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("%s (%s:%d)" % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno))
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def dump(self, top=None):
+        """
+        Returns the top most frequent stacks, most frequent first.
+        """
+        with self.lock:
+            stacks = sorted(self.stacks.items(), key=lambda item: -item[1])
+        return "".join("%s %d\n" % item for item in stacks[:top])
+
+
+class MetricsServer(threading.Thread):
+    """
+    Serves the metrics pages on a port of their own, so that they are
+    reachable on a separate interface and even when every worker is busy.
+    """
+
+    timeout = 5
+
+    def __init__(self, metrics, hostname="127.0.0.1", port=9100, metricsPath="/__metrics", reusePort=False):
+        threading.Thread.__init__(self, name="%d-metrics" % port)
+        self.daemon = True
+        self.metrics = metrics
+        self.hostname = hostname
+        self.port = port
+        self.metricsPath = metricsPath
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if os.name == "posix":
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if reusePort:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        self.socket.bind((hostname, port))
+        self.socket.listen(16)
+
+    def run(self):
+        log.info("Serving metrics at http://%s:%d%s", self.hostname, self.port, self.metricsPath)
+        while True:
+            try:
+                connection, address = self.socket.accept()
+            except OSError:
+                # Socket closed by stop()
+                return
+
+            try:
+                self._serve(connection)
+            except Exception as e:
+                log.debug("Metrics request failed: %r", e)
+            finally:
+                connection.close()
+
+    def _serve(self, connection):
+        """
+        Answer a single request, then close the connection.
+        """
+        connection.settimeout(self.timeout)
+        parser = RequestParser()
+        buffer = bytearray()
+        request = None
+        while request is None:
+            data = connection.recv(4096)
+            if not data:
+                return
+            buffer += data
+            try:
+                request = parser.parse(buffer)
+            except ParseError as e:
+                connection.sendall(self._response(e.code, "Bad Request", str(e).encode() + b"\n"))
+                return
+
+        page = None
+        if request.method in ("GET", "HEAD"):
+            page = self.metrics.page(request.path, self.metricsPath)
+        if page is None:
+            connection.sendall(self._response(404, "Not Found", b"Not found\n"))
+            return
+
+        body, contentType = page
+        connection.sendall(self._response(200, "OK", body, contentType, request.method == "HEAD"))
+
+    def _response(self, code, reason, body, contentType="text/plain; charset=utf-8", head=False):
+        header = ("HTTP/1.1 %d %s\r\n"
+                  "Content-Type: %s\r\n"
+                  "Content-Length: %d\r\n"
+                  "Connection: close\r\n\r\n" % (code, reason, contentType, len(body)))
+        return header.encode() + (b"" if head else body)
+
+    def stop(self):
+        try:
+            # Wakes up accept()
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        try:
+            self.socket.close()
+        except OSError:
+            pass
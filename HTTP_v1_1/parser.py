@@ -0,0 +1,303 @@
+import re
+
+from urllib.parse import unquote
+
+
+# Request methods (RFC 7230 token)
+TOKEN = re.compile("[!#$%&'*+.^_`|~0-9A-Za-z-]+$")
+
+# Header field "name: value" on a line of its own
+HEADER_FIELD = re.compile("^([!#$%&'*+.^_`|~0-9A-Za-z-]+):[ \t]*([^\r\n]*)", re.M)
+
+# Characters never valid in a message head
+INVALID = re.compile("\r(?!\n)|\0")
+
+# End of a message head, tolerating bare LF line endings
+HEAD_END = re.compile(b"\r?\n\r?\n")
+
+HTTP_VERSION = re.compile("HTTP/([0-9])\\.([0-9])$")
+
+
+class ParseError(Exception):
+    """
+    Malformed or oversized message, along with the response code
+    telling the client why.
+    """
+
+    def __init__(self, code, message):
+        Exception.__init__(self, message)
+        self.code = code
+
+
+class Request(object):
+    """
+    Request line and headers of a parsed request.
+    Header names are lowercase; repeated headers are joined with ", ".
+    path is percent-decoded, query is left as sent.
+    """
+
+    __slots__ = ("method", "target", "path", "query", "version", "headers")
+
+    def __init__(self, method, target, path, query, version, headers):
+        self.method = method
+        self.target = target
+        self.path = path
+        self.query = query
+        self.version = version
+        self.headers = headers
+
+    def __str__(self):
+        return "%s %s %s" % (self.method, self.target, self.version)
+
+
+class Response(object):
+    """
+    Status line and headers of a parsed response.
+    Header names are lowercase; repeated headers are joined with ", ".
+    """
+
+    __slots__ = ("version", "code", "reason", "headers")
+
+    def __init__(self, version, code, reason, headers):
+        self.version = version
+        self.code = code
+        self.reason = reason
+        self.headers = headers
+
+    def __str__(self):
+        return "%s %d %s" % (self.version, self.code, self.reason)
+
+
+class HeadParser(object):
+    """
+    Incremental parser of message heads (start line and headers).
+    Works on a bytearray receive buffer that the caller keeps
+    appending to; parse() takes a complete head out of it, leaving
+    any body or pipelined messages behind. Partial heads are not
+    scanned again from the start on every read.
+    createMessage(startLine, headers) returns the parsed message;
+    lineTooLong is the (code, reason) of overlong start lines.
+    """
+
+    # Longest start line accepted
+    maxLineSize = 8192
+
+    # Longest head and most header fields accepted
+    maxHeadSize = 65536
+    maxHeaders = 100
+
+    def __init__(self, createMessage, lineTooLong=(400, "Start line too long")):
+        self.createMessage = createMessage
+        self.lineTooLong = lineTooLong
+        self.scanned = 0
+
+    def parse(self, buffer):
+        """
+        Take the next complete message head out of buffer.
+        Returns the parsed message, or None if buffer does not
+        hold a complete head yet. Raises ParseError.
+        """
+        # Empty lines between pipelined messages are ignored
+        if buffer[:1] in (b"\r", b"\n"):
+            skip = len(buffer) - len(buffer.lstrip(b"\r\n"))
+            del buffer[:skip]
+            self.scanned = max(self.scanned - skip, 0)
+
+        match = HEAD_END.search(buffer, max(self.scanned - 3, 0))
+        if match is None:
+            self.scanned = len(buffer)
+            if len(buffer) > self.maxLineSize and buffer.find(b"\n", 0, self.maxLineSize) == -1:
+                raise ParseError(*self.lineTooLong)
+            if len(buffer) > self.maxHeadSize:
+                raise ParseError(431, "Header fields too large")
+            return None
+
+        if match.start() > self.maxHeadSize:
+            raise ParseError(431, "Header fields too large")
+
+        # Header field values are ISO-8859-1 (RFC 7230 3.2.4)
+        head = buffer[:match.start()].decode('latin-1')
+        del buffer[:match.end()]
+        self.scanned = 0
+
+        startLine, _, fields = head.partition("\n")
+        startLine = startLine.rstrip("\r")
+        if len(startLine) > self.maxLineSize:
+            raise ParseError(*self.lineTooLong)
+        return self.createMessage(startLine, self._parseHeaders(fields))
+
+    def _parseHeaders(self, fields):
+        """
+        Returns the header fields, one per line, by lowercase name.
+        """
+        if not fields:
+            return {}
+
+        matches = HEADER_FIELD.findall(fields)
+        if len(matches) > self.maxHeaders:
+            raise ParseError(431, "Too many header fields")
+        # Every line has to be a field; this also rejects obsolete line folding
+        if len(matches) != fields.count("\n") + 1 or INVALID.search(fields):
+            raise ParseError(400, "Malformed header field")
+
+        headers = {}
+        for name, value in matches:
+            name = name.lower()
+            if value[-1:] in (" ", "\t"):
+                value = value.rstrip(" \t")
+            if name not in headers:
+                headers[name] = value
+            elif name == 'content-length':
+                # Conflicting lengths allow request smuggling
+                if value != headers[name]:
+                    raise ParseError(400, "Conflicting Content-Length")
+            elif name == 'host':
+                raise ParseError(400, "Repeated Host")
+            else:
+                headers[name] += ", " + value
+
+        if not headers.get('content-length', '0').isdigit():
+            raise ParseError(400, "Invalid Content-Length")
+
+        return headers
+
+
+def parseRequestLine(requestLine, headers):
+    """
+    Returns the Request of requestLine and headers.
+    Raises ParseError.
+    """
+    parts = requestLine.split(" ")
+    if len(parts) != 3:
+        raise ParseError(400, "Malformed request line")
+
+    method, target, version = parts
+    match = HTTP_VERSION.match(version)
+    if not TOKEN.match(method) or match is None:
+        raise ParseError(400, "Malformed request line")
+    if match.group(1) != "1":
+        raise ParseError(505, "Unsupported HTTP version")
+
+    if not target.isascii():
+        raise ParseError(400, "Malformed request target")
+
+    # Absolute form, as sent to proxies
+    path = target
+    if path.startswith(("http://", "https://")):
+        path = path.split("//", 1)[1]
+        path = path[path.find("/"):] if "/" in path else "/"
+
+    path, _, query = path.partition("#")[0].partition("?")
+    if not path.startswith("/") and path != "*":
+        raise ParseError(400, "Malformed request target")
+
+    if "%" in path:
+        try:
+            path = unquote(path, errors='strict')
+        except UnicodeDecodeError:
+            raise ParseError(400, "Malformed request target")
+        if "\0" in path:
+            raise ParseError(400, "Malformed request target")
+
+    if version == "HTTP/1.1" and "host" not in headers:
+        raise ParseError(400, "Missing Host")
+
+    return Request(method, target, path, query, version, headers)
+
+
+def parseStatusLine(statusLine, headers):
+    """
+    Returns the Response of statusLine and headers.
+    Raises ParseError.
+    """
+    version, _, rest = statusLine.partition(" ")
+    code, _, reason = rest.partition(" ")
+    if HTTP_VERSION.match(version) is None or len(code) != 3 or not code.isdigit():
+        raise ParseError(400, "Malformed status line")
+
+    return Response(version, int(code), reason, headers)
+
+
+class RequestParser(HeadParser):
+    """
+    Incremental parser of request heads.
+    """
+
+    def __init__(self):
+        HeadParser.__init__(self, parseRequestLine, lineTooLong=(414, "Request line too long"))
+
+
+class ResponseParser(HeadParser):
+    """
+    Incremental parser of response heads.
+    """
+
+    def __init__(self):
+        HeadParser.__init__(self, parseStatusLine)
+
+
+class ChunkedDecoder(object):
+    """
+    Incremental decoder of a "Transfer-Encoding: chunked" body.
+    Fed with the bytes received, in pieces of any size; returns the
+    body bytes decoded from them. Once done, unused holds the bytes
+    following the body (pipelined messages).
+    """
+
+    # Longest chunk size or trailer line accepted
+    maxLineSize = 4096
+
+    def __init__(self):
+        self.state = "size"
+        self.chunkRemaining = 0
+        self.pending = b""
+        self.unused = b""
+        self.done = False
+
+    def feed(self, data):
+        """
+        Decode received bytes.
+        Raises ParseError on malformed chunked encoding.
+        """
+        if self.pending:
+            data = self.pending + data
+            self.pending = b""
+
+        body = []
+        position = 0
+        while position < len(data) and not self.done:
+            if self.state == "data":
+                length = min(self.chunkRemaining, len(data) - position)
+                body.append(data[position:position + length])
+                position += length
+                self.chunkRemaining -= length
+                if not self.chunkRemaining:
+                    self.state = "dataEnd"
+                continue
+
+            index = data.find(b"\n", position)
+            if index == -1:
+                if len(data) - position > self.maxLineSize:
+                    raise ParseError(400, "Chunk size line too long")
+                self.pending = data[position:]
+                break
+            line = data[position:index].rstrip(b"\r")
+            position = index + 1
+
+            if self.state == "size":
+                size = line.split(b";", 1)[0].strip()
+                if not re.match(b"[0-9a-fA-F]{1,16}$", size):
+                    raise ParseError(400, "Invalid chunk size")
+                self.chunkRemaining = int(size, 16)
+                self.state = "data" if self.chunkRemaining else "trailer"
+            elif self.state == "dataEnd":
+                if line:
+                    raise ParseError(400, "Missing CRLF after chunk data")
+                self.state = "size"
+            elif not line:
+                # Empty line ends the trailer, and so the body
+                self.done = True
+
+        if self.done:
+            self.unused = data[position:]
+        return b"".join(body)
@@ -0,0 +1,166 @@
+import sys
+import os
+import logging
+import time
+import signal
+import socket
+
+from HTTP_v1_1.server import HTTPServer
+from HTTP_v1_1.logger import stopLogging
+
+
+log = logging.getLogger(__name__)
+
+
+class PreforkHTTPServer(object):
+    """
+    Supervisor of several HTTP server processes listening on the
+    same port through SO_REUSEPORT, so that requests are served on
+    all cores. Crashed servers are restarted; on stop(), every server
+    stops accepting and finishes its connections before it exits.
+    """
+
+    def __init__(self, hostname="127.0.0.1", port=8080, www=os.getcwd(), processes=None,
+                       engine="thread", drainTimeout=30, restartDelay=1, **serverOptions):
+        self.hostname = hostname
+        self.port = port
+        self.www = www
+        self.processes = processes or os.cpu_count() or 1
+        self.engine = engine
+        self.drainTimeout = drainTimeout
+        self.restartDelay = restartDelay
+        self.serverOptions = serverOptions
+
+        self.children = {}
+        self.stopping = False
+        self.server = None
+
+    def start(self):
+        """
+        Start the server processes and supervise them.
+        """
+        log.info("Launching %d HTTP server processes on %s:%d", self.processes, self.hostname, self.port)
+
+        if not hasattr(os, "fork") or not hasattr(socket, "SO_REUSEPORT"):
+            log.error("Multi-process HTTP server needs fork() and SO_REUSEPORT!")
+            sys.exit(1)
+
+        # Fail early, rather than restarting servers that can not bind
+        try:
+            probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            probe.bind((self.hostname, self.port))
+            probe.close()
+        except Exception as e:
+            log.error("Failed to launch HTTP server!")
+            log.debug(e)
+            sys.exit(1)
+
+        for i in range(self.processes):
+            self._spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+
+            if self.children.pop(pid, None) is None or self.stopping:
+                continue
+
+            log.warn("HTTP server process %d exited with status %d, restarting", pid, status)
+            time.sleep(self.restartDelay)
+            if not self.stopping:
+                self._spawn()
+
+    def _spawn(self):
+        """
+        Fork a new HTTP server process.
+        """
+        pid = os.fork()
+        if pid:
+            log.info("Started HTTP server process %d", pid)
+            self.children[pid] = time.time()
+            return
+
+        # Server process: never return into the supervisor
+        code = 1
+        try:
+            self.children = {}
+
+            # Ctrl+C reaches the whole process group; the supervisor
+            # decides when the servers stop
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, self._drain)
+
+            self.server = self._createServer()
+            self.server.start()
+            code = 0
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException as e:
+            log.error("HTTP server process %d failed!", os.getpid())
+            log.debug(e)
+        finally:
+            # os._exit() skips atexit handlers: write out queued records first
+            stopLogging()
+            logging.shutdown()
+            os._exit(code)
+
+    def _createServer(self):
+        """
+        Create the HTTP server run by a server process.
+        """
+        if self.engine == "async":
+            from HTTP_v1_1.asyncserver import AsyncHTTPServer
+            return AsyncHTTPServer(self.hostname, self.port, www=self.www, reusePort=True,
+                                   **self.serverOptions)
+
+        return HTTPServer(self.hostname, self.port, www=self.www, reusePort=True,
+                          **self.serverOptions)
+
+    def _drain(self, signum=None, frame=None):
+        """
+        SIGTERM handler of a server process.
+        """
+        if self.server:
+            self.server.stop()
+        sys.exit(0)
+
+    def stop(self):
+        """
+        Stop the server processes, killing those that
+        do not finish within drainTimeout.
+        """
+        log.info("Shutting down HTTP server %s:%d", self.hostname, self.port)
+        self.stopping = True
+
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:
+                self.children.pop(pid, None)
+
+        deadline = time.time() + self.drainTimeout
+        while self.children and time.time() < deadline:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in list(self.children):
+            log.warn("HTTP server process %d did not finish in time, killing it", pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except OSError:
+                pass
+        self.children = {}
@@ -0,0 +1,115 @@
+import time
+import logging
+import threading
+
+
+log = logging.getLogger(__name__)
+
+
+class Reaper(threading.Thread):
+    """
+    Registry of the open client connections of a server.
+    Every interval seconds, aborts the connections that missed a
+    deadline (see RequestHandler.expired()): clients sending their
+    request head too slowly, stalling a request body or response, or
+    idling past the keep-alive timeout. While pressure() is true
+    (e.g. connections wait for a worker), idle persistent connections
+    are closed after pressureIdleTimeout seconds already.
+    """
+
+    def __init__(self, interval=1.0, pressure=None, pressureIdleTimeout=1.0, name="reaper"):
+        threading.Thread.__init__(self, name=name)
+        self.daemon = True
+        self.interval = interval
+        self.pressure = pressure
+        self.pressureIdleTimeout = pressureIdleTimeout
+
+        self.connections = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+        # Set on shutdown: connections close after their current request
+        self.closing = False
+
+    def add(self, connection):
+        with self.lock:
+            self.connections.add(connection)
+            if self.closing:
+                connection.closing = True
+
+    def discard(self, connection):
+        with self.lock:
+            self.connections.discard(connection)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def active(self):
+        """
+        Returns the registered connections.
+        """
+        with self.lock:
+            return list(self.connections)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.reap()
+            except Exception as e:
+                log.error("Reaping client connections failed!")
+                log.debug(e)
+
+    def reap(self):
+        """
+        Abort the connections past their deadline.
+        Returns how many were aborted.
+        """
+        idleTimeout = None
+        if self.pressure is not None and self.pressure():
+            idleTimeout = self.pressureIdleTimeout
+
+        now = time.time()
+        expired = []
+        for connection in self.active():
+            reason = connection.expired(now, idleTimeout)
+            if reason is not None:
+                expired.append((connection, reason))
+
+        for connection, reason in expired:
+            self._reap(connection, reason)
+        return len(expired)
+
+    def _reap(self, connection, reason):
+        """
+        Unregister and abort a connection, once.
+        """
+        with self.lock:
+            if connection not in self.connections:
+                return False
+            self.connections.discard(connection)
+        connection.reap(reason)
+        return True
+
+    def closeIdle(self):
+        """
+        Start a graceful shutdown: close the idle connections now,
+        the others once their current request is served.
+        """
+        with self.lock:
+            self.closing = True
+            connections = list(self.connections)
+
+        for connection in connections:
+            connection.closing = True
+            if connection.phase == "idle":
+                self._reap(connection, "server shutting down")
+
+    def abortAll(self):
+        """
+        Abort every connection left.
+        Returns how many there were.
+        """
+        return sum(self._reap(connection, "server shutting down") for connection in self.active())
+
+    def stop(self):
+        self.stopped.set()
@@ -0,0 +1,158 @@
+import os
+import time
+import threading
+import mimetypes
+
+from collections import OrderedDict
+from stat import S_ISDIR
+
+
+# Served files of an unknown type
+DEFAULT_TYPE = "application/octet-stream"
+
+# Types of files stored with a content coding, e.g. "a.tar.gz"
+ENCODED_TYPES = {"gzip": "application/gzip", "bzip2": "application/x-bzip2", "xz": "application/x-xz"}
+
+
+def contentType(path):
+    """
+    Returns the Content-Type of the file at path, guessed from its name.
+    """
+    mimeType, encoding = mimetypes.guess_type(path)
+    if encoding is not None:
+        return ENCODED_TYPES.get(encoding, DEFAULT_TYPE)
+    return mimeType or DEFAULT_TYPE
+
+
+class Resolution(object):
+    """
+    A request path resolved to a file of the web server directory:
+    its name relative to the directory, its path, its stat() or None
+    if it does not exist, and its Content-Type. path is None for paths
+    leading out of the directory.
+    """
+
+    __slots__ = ("name", "path", "stat", "contentType", "expires")
+
+    def __init__(self, name, path, stat, expires):
+        self.name = name
+        self.path = path
+        self.stat = stat
+        self.contentType = contentType(name) if path is not None else None
+        self.expires = expires
+
+    def isDirectory(self):
+        return self.stat is not None and S_ISDIR(self.stat.st_mode)
+
+
+class PathResolver(object):
+    """
+    Server-wide mapping of request paths to files of the web server
+    directory www. Paths are normalised and confined to the directory,
+    symbolic links included; directories map to their index file.
+    The stat() results of the last maxEntries files looked up, missing
+    ones included, are kept for ttl seconds, so that requests for hot
+    paths, or floods of requests for missing ones, skip the syscalls.
+    """
+
+    def __init__(self, www, maxEntries=4096, ttl=1.0, index="index.html"):
+        self.www = os.path.realpath(www)
+        self.maxEntries = maxEntries
+        self.ttl = ttl
+        self.index = index
+
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def resolve(self, requestPath):
+        """
+        Returns the Resolution of a percent-decoded request path, or
+        None if it leads out of the web server directory.
+        """
+        name = self.normalise(requestPath)
+        if name is None:
+            return None
+
+        resolution = self.lookup(name)
+        if resolution.isDirectory():
+            resolution = self.lookup(name + "/" + self.index if name else self.index)
+        if resolution.path is None:
+            return None
+        return resolution
+
+    def normalise(self, requestPath):
+        """
+        Returns the name of the file a request path refers to, relative
+        to the web server directory, with "." and ".." segments and
+        repeated slashes removed, or None if it leads out of it.
+        """
+        segments = []
+        for segment in requestPath.split("/"):
+            if segment in ("", "."):
+                continue
+            if segment == "..":
+                if not segments:
+                    return None
+                segments.pop()
+                continue
+            # e.g. "\" on Windows
+            if os.sep in segment or (os.altsep and os.altsep in segment):
+                return None
+            segments.append(segment)
+        return "/".join(segments)
+
+    def lookup(self, name):
+        """
+        Returns the Resolution of a normalised name, from the cache
+        when looked up less than ttl seconds ago.
+        """
+        now = time.time()
+        with self.lock:
+            resolution = self.entries.get(name)
+            if resolution is not None and resolution.expires > now:
+                self.entries.move_to_end(name)
+                self.hits += 1
+                return resolution
+            self.misses += 1
+
+        path = os.path.join(self.www, *name.split("/")) if name else self.www
+        # Symbolic links must not lead out of the directory either
+        realPath = os.path.realpath(path)
+        if realPath != self.www and not realPath.startswith(self.www + os.sep):
+            path, stat = None, None
+        else:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+        resolution = Resolution(name, path, stat, now + self.ttl)
+
+        if self.maxEntries:
+            with self.lock:
+                self.entries[name] = resolution
+                self.entries.move_to_end(name)
+                while len(self.entries) > self.maxEntries:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return resolution
+
+    def invalidate(self, name):
+        """
+        Drop the cached stat() of the file name, e.g. once written.
+        """
+        with self.lock:
+            self.entries.pop(name, None)
+
+    def stats(self):
+        """
+        Returns cache counters.
+        """
+        with self.lock:
+            return {"hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "entries": len(self.entries)}
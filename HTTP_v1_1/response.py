@@ -0,0 +1,80 @@
+import time
+
+from email.utils import formatdate
+
+
+# Reason phrases of the response codes the server sends
+REASONS = {200: "OK",
+           202: "Accepted",
+           206: "Partial Content",
+           304: "Not Modified",
+           400: "Bad Request",
+           404: "Not Found",
+           411: "Length Required",
+           413: "Payload Too Large",
+           414: "URI Too Long",
+           416: "Range Not Satisfiable",
+           431: "Request Header Fields Too Large",
+           500: "Internal Server Error",
+           501: "Not Implemented",
+           503: "Service Unavailable",
+           505: "HTTP Version Not Supported"}
+
+# Status lines, encoded once
+STATUS_LINES = dict((code, ("HTTP/1.1 %d %s\r\n" % (code, reason)).encode())
+                    for code, reason in REASONS.items())
+
+# Status line of a successful PUT
+PUT_CREATED = b"HTTP/1.1 200 OK File Created\r\n"
+
+# Body of the responses without content of their own
+HTML_PAGES = {200: b"<html><body><p>Status Code 200: OK!</p></body></html>",
+              400: b"<html><body><p>ERROR 400: Bad request!</p></body></html>",
+              404: b"<html><body><p>ERROR 404: File not found!</p></body></html>",
+              411: b"<html><body><p>ERROR 411: Length required!</p></body></html>",
+              413: b"<html><body><p>ERROR 413: Payload too large!</p></body></html>",
+              414: b"<html><body><p>ERROR 414: URI too long!</p></body></html>",
+              416: b"<html><body><p>ERROR 416: Range not satisfiable!</p></body></html>",
+              431: b"<html><body><p>ERROR 431: Request header fields too large!</p></body></html>",
+              500: b"<html><body><p>ERROR 500: Internal server error!</p></body></html>",
+              501: b"<html><body><p>ERROR 501: Not implemented!</p></body></html>",
+              503: b"<html><body><p>ERROR 503: Service unavailable!</p></body></html>",
+              505: b"<html><body><p>ERROR 505: HTTP version not supported!</p></body></html>"}
+
+
+# (second, "Date" header line) of the last response
+_date = (0, b"")
+
+
+def dateHeader():
+    """
+    Returns the "Date" header line, an RFC 7231 IMF-fixdate in GMT.
+    It only changes once per second, so it is formatted at most once
+    per second rather than for every response.
+    """
+    global _date
+
+    now = int(time.time())
+    second, header = _date
+    if second != now:
+        header = b"Date: " + formatdate(now, usegmt=True).encode() + b"\r\n"
+        # A single assignment, so that threads never see a torn pair
+        _date = (now, header)
+    return header
+
+
+def statusLine(code, method='GET'):
+    """
+    Returns the status line of a response.
+    """
+    if code == 200 and method == 'PUT':
+        return PUT_CREATED
+    return STATUS_LINES.get(code) or ("HTTP/1.1 %d Unknown\r\n" % code).encode()
+
+
+def headerLines(headers):
+    """
+    Returns header fields given as (name, value) pairs as header lines.
+    Header values are ISO-8859-1 (RFC 7230 3.2.4).
+    """
+    return "".join("%s: %s\r\n" % field for field in headers).encode('latin-1')
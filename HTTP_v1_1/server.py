@@ -1,31 +1,975 @@
 import sys
 import os
+import re
+import uuid
+import json
 import logging
 import time
 import socket
+import struct
+import hashlib
 import threading
 
+from email.utils import parsedate_tz, mktime_tz
 
-# Set logging
-logging.basicConfig(level=logging.DEBUG,
-                    format='%(asctime)s HTTPServer [%(levelname)s] %(message)s',)
-log = logging.getLogger()
+from HTTP_v1_1.cache import ResponseCache, DigestCache, fileValidators
+from HTTP_v1_1.parser import RequestParser, ChunkedDecoder, ParseError
+from HTTP_v1_1.logger import ACCESS_LOGGER
+from HTTP_v1_1.metrics import Metrics, MetricsServer
+from HTTP_v1_1.response import HTML_PAGES, statusLine, dateHeader, headerLines
+from HTTP_v1_1.encoding import Compressor, ENCODINGS, negotiate
+from HTTP_v1_1.reaper import Reaper
+from HTTP_v1_1.resolver import PathResolver
+from HTTP_v1_1.digest import formatDigest, messageDigests, hashFile
 
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
-class ClientThread(threading.Thread): 
+
+# Tells the kernel more data follows (Linux), so that a response header
+# goes out in the same segment as the file data sent after it
+MSG_MORE = getattr(socket, 'MSG_MORE', 0)
+
+# SO_LINGER value making close() reset the connection at once, dropping
+# unsent data, instead of sending it to a client that may never read it
+LINGER_RESET = struct.pack('ii', 1, 0)
+
+
+log = logging.getLogger(__name__)
+accessLog = logging.getLogger(ACCESS_LOGGER)
+
+
+class RequestHandler(object):
+    """
+    Engine independent part of serving a client connection:
+    request parsing, GET/PUT semantics and response generation.
+    Server engines subclass it and own the socket I/O.
+    """
+
+    # More ranges in a single request are answered with the whole file
+    maxRanges = 16
+
+    # Seconds spent discarding unread request data before closing a
+    # connection, so that the client still gets the last response
+    lingerTimeout = 2
+
+    # Seconds a request body or response may take before minRate applies
+    rateGrace = 10
+
+    def __init__(self, clientIP, 
+                       clientPort, 
+                       serverIP,
+                       serverPort,
+                       bufferSize=16384,
+                       threadName=None,
+                       www=os.getcwd(),
+                       keepAliveTimeout=15,
+                       maxRequests=100,
+                       chunkSize=262144,
+                       sendfile=True,
+                       cache=None,
+                       maxBodySize=0,
+                       metrics=None,
+                       metricsPath=None,
+                       compressor=None,
+                       headerTimeout=10,
+                       bodyTimeout=30,
+                       writeTimeout=30,
+                       minRate=1024,
+                       reaper=None,
+                       resolver=None,
+                       digests=None):
+        self.clientIP = clientIP
+        self.clientPort = clientPort
+        self.serverIP = serverIP
+        self.serverPort = serverPort
+        self.bufferSize = bufferSize
+        self.threadName = threadName
+        self.serverHeader = ("Server: HTTPServer [%s:%d]\r\n" % (serverIP, serverPort)).encode()
+        self.www = www
+        self.keepAliveTimeout = keepAliveTimeout
+        self.maxRequests = maxRequests
+
+        # File bodies are sent with zero-copy sendfile() where the platform
+        # supports it, otherwise read and sent chunkSize bytes at a time
+        self.chunkSize = chunkSize
+        self.sendfile = sendfile and hasattr(os, 'sendfile')
+
+        # Server-wide ResponseCache of small files, or None
+        self.cache = cache
+
+        # Server-wide Compressor, or None to send files as they are
+        self.compressor = compressor
+
+        # Server-wide PathResolver of request paths to files of www
+        self.resolver = resolver if resolver is not None else PathResolver(www)
+
+        # Server-wide DigestCache of the SHA-256 digests of files, sent
+        # as Repr-Digest, or None
+        self.digests = digests
+
+        # Deadlines, in seconds, of each phase of a connection: waiting
+        # for a request (idle), receiving its head (head, in total),
+        # receiving its body and sending the response (body and write,
+        # without progress). Request bodies and responses also have to
+        # move at least minRate bytes/s on average, 0 for no limit.
+        # The server-wide Reaper, if any, enforces them.
+        self.timeouts = {"idle": keepAliveTimeout,
+                         "head": headerTimeout,
+                         "body": bodyTimeout,
+                         "write": writeTimeout}
+        self.minRate = minRate
+        self.reaper = reaper
+        self.closing = False
+        self.aborted = False
+        self.phase = None
+        self.phaseTimeout = None
+        self.phaseStarted = self.lastProgress = time.time()
+        self.phaseBytes = 0
+
+        # Largest PUT request body accepted, 0 for no limit
+        self.maxBodySize = maxBodySize
+
+        # Server-wide Metrics, or None; GET metricsPath serves them
+        self.metrics = metrics
+        self.metricsPath = metricsPath
+
+        # Bytes received past the end of the last parsed request
+        # (request body or pipelined requests)
+        self.buffer = bytearray()
+        self.parser = RequestParser()
+        self.requestCount = 0
+        self.keepAlive = False
+
+        # Access log fields of the request being served
+        self.request = None
+        self.requestStarted = 0
+        self.responseCode = None
+        self.bytesSent = 0
+        self.bytesReceived = 0
+
+    def _nextRequest(self):
+        """
+        Take the next complete request head out of the buffer.
+        Returns the parsed Request, or None if the buffer does not
+        hold one yet. Raises ParseError.
+        """
+        return self.parser.parse(self.buffer)
+
+    def _takeBuffered(self, limit):
+        """
+        Take at most limit already received body bytes out of the buffer.
+        """
+        data = bytes(self.buffer[:limit])
+        del self.buffer[:len(data)]
+        return data
+
+    def _parseRequest(self, request):
+        """
+        Take in the parsed request line and headers.
+        Returns the request method.
+        """
+        self.requestCount += 1
+        self._startRequest(request)
+        self.requestHeaders = request.headers
+        self.requestPath = request.path
+
+        # Determine request method (GET, HEAD and PUT are supported)
+        requestMethod = self.requestMethod = request.method
+        log.debug("[%s] Request Method: %s", self.threadName, requestMethod)
+
+        # Determine whether the connection persists after this request.
+        # HTTP/1.1 connections are persistent unless told otherwise,
+        # HTTP/1.0 ones only on explicit request.
+        connection = [option.strip() for option in
+                      self.requestHeaders.get('connection', '').lower().split(',')]
+        if request.version == 'HTTP/1.1':
+            self.keepAlive = 'close' not in connection
+        else:
+            self.keepAlive = 'keep-alive' in connection
+        if self.requestCount >= self.maxRequests or self.closing:
+            self.keepAlive = False
+
+        # Only PUT request bodies are read. The connection of any other
+        # request with a body closes after the response, so that the body
+        # is never parsed as the next pipelined request.
+        if requestMethod != 'PUT' and ('transfer-encoding' in self.requestHeaders or
+                                       self.requestHeaders.get('content-length', '0') != '0'):
+            log.warn("[%s] Unexpected %s request body, closing the connection", self.threadName, requestMethod)
+            self.keepAlive = False
+
+        # Determine requested File and Arguments.
+        # The file is confined to the web server directory, None for
+        # paths leading out of it; directories (e.g. "/") load their
+        # index.html.
+        requestedArgs = request.query or None
+        self.resolution = self.resolver.resolve(request.path)
+        self.requestedFile = self.resolution.path if self.resolution is not None else None
+        log.debug("[%s] Requested File: %s", self.threadName, self.requestedFile)
+        log.debug("[%s] Requested Arguments: %s", self.threadName, requestedArgs)
+
+        return requestMethod
+
+    def _badRequest(self, error):
+        """
+        Prepare the response to a request that could not be parsed.
+        """
+        log.warn("[%s] Malformed client request: %s", self.threadName, error)
+        self._startRequest(None)
+        self.keepAlive = False
+        payload = self._generateHTML(error.code)
+        header = self._generateHeader(error.code, contentLength=len(payload))
+        return self._createHTTPResponse(header, payload)
+
+    def _enterPhase(self, phase):
+        """
+        Start the idle, head, body or write phase of the connection,
+        or None for no deadline (e.g. while the server prepares a response).
+        """
+        now = time.time()
+        self.phaseTimeout = self.timeouts.get(phase)
+        self.phaseStarted = self.lastProgress = now
+        self.phaseBytes = 0
+        # Set last: the Reaper reads it first, from another thread
+        self.phase = phase
+
+    def _progress(self, count):
+        """
+        Count bytes received or sent in the current phase.
+        """
+        self.phaseBytes += count
+        self.lastProgress = time.time()
+
+    def expired(self, now, idleTimeout=None):
+        """
+        Returns why the connection missed its deadline, or None.
+        idleTimeout shortens the keep-alive timeout.
+        """
+        phase = self.phase
+        if phase == "idle":
+            timeout = self.phaseTimeout
+            if idleTimeout is not None and (not timeout or idleTimeout < timeout):
+                timeout = idleTimeout
+            if timeout and now - self.phaseStarted > timeout:
+                return "idle for %ds" % (now - self.phaseStarted)
+        elif phase == "head":
+            if self.phaseTimeout and now - self.phaseStarted > self.phaseTimeout:
+                return "request head not received within %ds" % self.phaseTimeout
+        elif phase in ("body", "write"):
+            if self.phaseTimeout and now - self.lastProgress > self.phaseTimeout:
+                return "%s stalled for %ds" % (phase, now - self.lastProgress)
+            elapsed = now - self.phaseStarted
+            if self.minRate and elapsed > self.rateGrace and self.phaseBytes < self.minRate * elapsed:
+                return "%s slower than %d bytes/s" % (phase, self.minRate)
+        return None
+
+    def reap(self, reason):
+        """
+        Abort the connection, from another thread, with the abort()
+        of the server engine.
+        """
+        if self.aborted:
+            return
+        log.info("[%s] Aborting client connection: %s", self.threadName, reason)
+        if self.metrics is not None:
+            self.metrics.connectionReaped()
+        self.aborted = True
+        self.abort()
+
+    def _startRequest(self, request):
+        """
+        Reset the access log fields for a new request.
+        """
+        self.request = request
+        self.requestStarted = time.time()
+        self.responseCode = None
+        self.bytesSent = 0
+
+    def _requestDone(self):
+        """
+        Account for the request just served in the metrics
+        and the access log.
+        """
+        request = self.request
+        if self.metrics is not None:
+            self.metrics.requestServed(request.method if request else None, self.responseCode,
+                                       self.bytesReceived, self.bytesSent,
+                                       time.time() - self.requestStarted)
+            self.bytesReceived = 0
+
+        if not accessLog.isEnabledFor(logging.INFO):
+            return
+
+        accessLog.info(json.dumps({
+            "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(self.requestStarted)),
+            "client": "%s:%d" % (self.clientIP, self.clientPort),
+            "method": request.method if request else None,
+            "target": request.target if request else None,
+            "version": request.version if request else None,
+            "status": self.responseCode,
+            "bytes": self.bytesSent,
+            "duration": round((time.time() - self.requestStarted) * 1000, 3)}))
+
+    def _openGET(self):
+        """
+        Prepare the response to GET or HEAD.
+        Returns the response header buffers, the opened file and the parts
+        of it to send after the header as (prefix, offset, length) tuples,
+        or the complete response buffers, None and no parts.
+        """
+        log.debug("[%s] Serving web page: %s", self.threadName, self.requestedFile)
+
+        if self.metrics is not None and self.metricsPath:
+            page = self.metrics.page(self.requestPath, self.metricsPath)
+            if page is not None:
+                return self._pageResponse(*page), None, ()
+
+        # Files known to be missing are answered without a syscall
+        if self.resolution is None or self.resolution.stat is None:
+            log.warn("[%s] %s: File not found!", self.threadName, self.requestPath)
+            return self._notFound(), None, ()
+
+        # Hot files are served from memory
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.get(self.requestedFile)
+
+        # Serve a compressed variant when the client accepts one
+        encoding = self._acceptedEncoding(entry)
+        if encoding is not None:
+            response = self._openEncoded(encoding)
+            if response is not None:
+                return response
+
+        if entry is not None:
+            log.debug("[%s] Sending HTTP response from cache!", self.threadName)
+            return self._fileResponse(entry.body, len(entry.body),
+                                      entry.etag, entry.lastModified, entry.mtime, digest=entry.digest)
+
+        try:
+            f = open(self.requestedFile, 'rb')
+            stat = os.fstat(f.fileno())
+            fileSize = stat.st_size
+        except Exception as e:
+            log.warn("[%s] %s: File not found!", self.threadName, self.requestedFile)
+            log.debug("[%s] %r", self.threadName, e)
+            return self._notFound(), None, ()
+
+        etag, lastModified = fileValidators(stat)
+
+        # Small files are read whole and kept for the next request
+        if self.cache is not None and self.cache.cacheable(fileSize):
+            with f:
+                body = f.read(fileSize)
+            entry = self.cache.put(self.requestedFile, body, stat)
+            return self._fileResponse(body, len(body), etag, lastModified, stat.st_mtime, digest=entry.digest)
+
+        digest = self._fileDigest(self.requestedFile, f, stat, etag)
+        return self._fileResponse(f, fileSize, etag, lastModified, stat.st_mtime, digest=digest)
+
+    def _notFound(self):
+        """
+        Prepare the response to GET or HEAD of a missing file.
+        """
+        log.debug("[%s] Sending HTTP response!", self.threadName)
+        payload = self._generateHTML(404)
+        header = self._generateHeader(404, contentLength=len(payload))
+        if self.requestMethod == 'HEAD':
+            payload = b""
+        return self._createHTTPResponse(header, payload)
+
+    def _acceptedEncoding(self, entry=None):
+        """
+        Returns the content coding to send the requested file with, or
+        None to send it as is. entry is the cache entry of the file, if
+        any. Only looks at the request, the file name and entry, so that
+        cache hits do not go to the filesystem. Sets self.vary.
+        """
+        self.vary = False
+        if self.compressor is None or not self.compressor.compressible(self.requestedFile):
+            return None
+
+        # From now on, the response depends on Accept-Encoding.
+        # Ranges are only served from the file as is.
+        self.vary = True
+        if 'range' in self.requestHeaders:
+            return None
+        if entry is not None and not self.compressor.worthCompressing(entry.size):
+            return None
+        return negotiate(self.requestHeaders.get('accept-encoding'), ENCODINGS)
+
+    def _compressing(self):
+        """
+        Whether serving the GET compresses the requested file on the fly,
+        or otherwise goes to the filesystem for a compressed variant of
+        it, which takes a while.
+        """
+        if self.resolution is None or self.resolution.stat is None:
+            return False
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.peek(self.requestedFile)
+        encoding = self._acceptedEncoding(entry)
+        return encoding is not None and self.compressor.cache.peek((self.requestedFile, encoding)) is None
+
+    def _hashing(self):
+        """
+        Whether serving the GET hashes the requested file first, which
+        takes a while for large ones.
+        """
+        if self.digests is None or self.resolution is None or self.resolution.stat is None:
+            return False
+        if self.cache is not None and self.cache.peek(self.requestedFile) is not None:
+            return False
+        stat = self.resolution.stat
+        return (self.digests.peek(self.requestedFile, stat) is None and
+                (self.digests.hashable(stat.st_size) or 'want-repr-digest' in self.requestHeaders))
+
+    def _fileDigest(self, path, f, stat, etag):
+        """
+        Returns the SHA-256 digest of the opened file f at path, whose
+        stat() is stat, or None. Files are hashed once per version, if
+        not too large or the client asks for it with Want-Repr-Digest.
+        Nothing is hashed for a 304 response.
+        """
+        if self.digests is None or self._notModified(etag, stat.st_mtime):
+            return None
+
+        digest = self.digests.get(path, stat)
+        if digest is None and (self.digests.hashable(stat.st_size) or 'want-repr-digest' in self.requestHeaders):
+            digest = hashFile(f, stat.st_size).digest()
+            self.digests.put(path, stat, digest)
+        return digest
+
+    def _openEncoded(self, encoding):
+        """
+        Prepare the response serving the requested file compressed with
+        encoding: a cached compressed variant, the precompressed ".gz"
+        sibling of the file, or the file compressed on the fly.
+        Returns the same as _openGET(), or None to send the file as is.
+        """
+        path = self.requestedFile
+        entry = self.compressor.cache.get((path, encoding))
+        if entry is None:
+            stat = self.resolution.stat
+            try:
+                if encoding == "gzip":
+                    sibling = self.resolver.lookup(self.resolution.name + ".gz")
+                    if self.compressor.precompressed(stat, sibling.stat):
+                        f = open(sibling.path, 'rb')
+                        stat = os.fstat(f.fileno())
+                        etag, lastModified = fileValidators(stat)
+                        digest = self._fileDigest(sibling.path, f, stat, etag)
+                        log.debug("[%s] Sending precompressed %s", self.threadName, sibling.path)
+                        return self._fileResponse(f, stat.st_size, etag, lastModified, stat.st_mtime, encoding,
+                                                  digest)
+
+                entry = self.compressor.variant(path, encoding, stat.st_size)
+            except (IOError, OSError) as e:
+                log.debug("[%s] %r", self.threadName, e)
+                return None
+
+        if entry is None:
+            return None
+        return self._fileResponse(entry.body, len(entry.body),
+                                  entry.etag, entry.lastModified, entry.mtime, encoding, entry.digest)
+
+    def _fileResponse(self, source, size, etag, lastModified, mtime, encoding=None, digest=None):
+        """
+        Prepare the response serving a file, or the requested ranges of it.
+        source is either the opened file or its content, encoded with
+        the content coding encoding, if any; digest is its SHA-256
+        digest, if known.
+        Returns the same as _openGET().
+        """
+        headers = [('ETag', etag), ('Last-Modified', lastModified), ('Accept-Ranges', 'bytes')]
+        if encoding is not None:
+            headers.append(('Content-Encoding', encoding))
+        if self.vary:
+            headers.append(('Vary', 'Accept-Encoding'))
+        inMemory = not hasattr(source, 'read')
+
+        # Answer conditional requests for unchanged files without a body
+        if self._notModified(etag, mtime):
+            code, contentLength, parts = 304, None, []
+        else:
+            # Of the whole file, also in 206 responses
+            if digest is not None:
+                headers.append(('Repr-Digest', formatDigest(digest)))
+            ranges = self._requestedRanges(size, etag, lastModified)
+            if ranges is None:
+                code, contentLength, parts = 200, size, [(b"", 0, size)]
+                headers.append(('Content-Type', self.resolution.contentType))
+            elif not ranges:
+                code, contentLength, parts = 416, 0, []
+                headers.append(('Content-Range', 'bytes */%d' % size))
+            elif len(ranges) == 1:
+                first, last = ranges[0]
+                code, contentLength, parts = 206, last - first + 1, [(b"", first, last - first + 1)]
+                headers.append(('Content-Range', 'bytes %d-%d/%d' % (first, last, size)))
+                headers.append(('Content-Type', self.resolution.contentType))
+            else:
+                # Several ranges go out as a multipart/byteranges body
+                boundary = uuid.uuid4().hex
+                parts = [(("\r\n--%s\r\nContent-Type: %s\r\nContent-Range: bytes %d-%d/%d\r\n\r\n" %
+                           (boundary, self.resolution.contentType, first, last, size)).encode(),
+                          first, last - first + 1)
+                         for first, last in ranges]
+                parts.append((("\r\n--%s--\r\n" % boundary).encode(), 0, 0))
+                code = 206
+                contentLength = sum(len(prefix) + length for prefix, _, length in parts)
+                headers.append(('Content-Type', 'multipart/byteranges; boundary=%s' % boundary))
+
+        log.debug("[%s] Sending HTTP response!", self.threadName)
+        header = self._generateHeader(code, contentLength=contentLength, headers=headers)
+        httpResponse = [header]
+
+        if self.requestMethod == 'HEAD' or not parts:
+            if not inMemory:
+                source.close()
+            return httpResponse, None, ()
+
+        if inMemory:
+            # Slices of a memoryview do not copy the cached body
+            body = memoryview(source)
+            for prefix, offset, length in parts:
+                httpResponse += [prefix, body[offset:offset + length]]
+            return httpResponse, None, ()
+
+        return httpResponse, source, parts
+
+    def _requestedRanges(self, size, etag, lastModified):
+        """
+        Determine the byte ranges requested with Range.
+        Returns a list of (first, last) byte positions, an empty list
+        if none of them can be satisfied, or None to serve the whole file.
+        """
+        value = self.requestHeaders.get('range')
+        if value is None or not value.startswith('bytes='):
+            return None
+
+        # Serve the whole file if it changed since the client got a part of it
+        ifRange = self.requestHeaders.get('if-range')
+        if ifRange is not None and ifRange not in (etag, lastModified):
+            return None
+
+        specs = value[len('bytes='):].split(',')
+        if len(specs) > self.maxRanges:
+            return None
+
+        ranges = []
+        for spec in specs:
+            first, sep, last = spec.strip().partition('-')
+            if (not sep or not (first or last) or
+                    (first and not first.isdigit()) or (last and not last.isdigit())):
+                return None
+
+            if not first:
+                # Suffix range: the last bytes of the file
+                if int(last) == 0:
+                    continue
+                first, last = max(size - int(last), 0), size - 1
+            else:
+                if last and int(last) < int(first):
+                    return None
+                first, last = int(first), int(last) if last else size - 1
+
+            if first < size:
+                ranges.append((first, min(last, size - 1)))
+
+        return ranges
+
+    def _notModified(self, etag, mtime):
+        """
+        Whether the conditional GET is satisfied by the client's copy
+        of the file. If-None-Match takes precedence over If-Modified-Since.
+        """
+        ifNoneMatch = self.requestHeaders.get('if-none-match')
+        if ifNoneMatch is not None:
+            tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+            return '*' in tags or etag in tags or 'W/' + etag in tags
+
+        ifModifiedSince = self.requestHeaders.get('if-modified-since')
+        if ifModifiedSince is not None:
+            since = parsedate_tz(ifModifiedSince)
+            return since is not None and int(mtime) <= mktime_tz(since)
+
+        return False
+
+    def _readChunks(self, f, length):
+        """
+        Read length bytes of the file, chunkSize bytes at a time.
+        """
+        while length > 0:
+            payload = f.read(min(self.chunkSize, length))
+            if not payload:
+                raise IOError("File shrank while it was being sent")
+            length -= len(payload)
+            yield payload
+
+    def _openPUT(self):
+        """
+        Prepare to receive the PUT request body.
+        Returns None and the opened file the body goes to,
+        or the complete response and None.
+        """
+        log.debug("[%s] Writing to web server: %s", self.threadName, self.requestedFile)
+        self.partialPUT = None
+        self.tempFile = None
+        self.bodyRemaining = 0
+        self.bodyReceived = 0
+        self.bodyDecoder = None
+
+        # The body is hashed as it arrives, to check it against the
+        # Repr-Digest or Content-Digest the client sent along, if any
+        self.bodyHash = hashlib.sha256()
+        self.expectedDigests = messageDigests(self.requestHeaders)
+
+        # Paths leading out of the web server directory
+        if self.resolution is None:
+            log.warn("[%s] %s: Outside of the web server directory!", self.threadName, self.requestPath)
+            self.keepAlive = False
+            payload = self._generateHTML(404)
+            header = self._generateHeader(404, 'PUT', contentLength=len(payload))
+            return self._createHTTPResponse(header, payload), None
+
+        # Request body is framed by chunked encoding or Content-Length
+        transferEncoding = self.requestHeaders.get('transfer-encoding', '').lower()
+        contentLength = self.requestHeaders.get('content-length', '')
+        if transferEncoding and transferEncoding != 'chunked':
+            log.warn("[%s] Unsupported Transfer-Encoding: %s", self.threadName, transferEncoding)
+            self.keepAlive = False
+            payload = self._generateHTML(501)
+            header = self._generateHeader(501, 'PUT', contentLength=len(payload))
+            return self._createHTTPResponse(header, payload), None
+        if transferEncoding:
+            self.bodyDecoder = ChunkedDecoder()
+        elif not contentLength.isdigit():
+            log.warn("[%s] %s: Missing Content-Length!", self.threadName, self.requestedFile)
+            self.keepAlive = False
+            payload = self._generateHTML(411)
+            header = self._generateHeader(411, 'PUT', contentLength=len(payload))
+            return self._createHTTPResponse(header, payload), None
+        else:
+            self.bodyRemaining = int(contentLength)
+            if self.maxBodySize and self.bodyRemaining > self.maxBodySize:
+                return self._closePUT(None, ParseError(413, "Content-Length exceeds %d bytes" %
+                                                            self.maxBodySize)), None
+
+        # Resumable upload of a part of the file
+        contentRange = self.requestHeaders.get('content-range')
+        if contentRange is not None:
+            if self.bodyDecoder is not None:
+                log.warn("[%s] %s: Content-Range needs Content-Length!", self.threadName, self.requestedFile)
+                self.keepAlive = False
+                payload = self._generateHTML(411)
+                header = self._generateHeader(411, 'PUT', contentLength=len(payload))
+                return self._createHTTPResponse(header, payload), None
+            return self._openPartialPUT(contentRange, self.bodyRemaining)
+
+        try:
+            # Writing to a temporary file next to the requested file, which
+            # replaces it once the body is complete, so that GET never sees
+            # a partially written file and a failed upload leaves it intact
+            self.tempFile = self._tempFile()
+            fd = os.open(self.tempFile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            return None, os.fdopen(fd, 'wb', self.chunkSize)
+        except Exception as e:
+            return self._closePUT(None, e), None
+
+    def _openPartialPUT(self, contentRange, contentLength):
+        """
+        Prepare to receive a byte range of the file, "Content-Range:
+        bytes <first>-<last>/<total>". Ranges are collected in a hidden
+        part file next to the target, which replaces it once the last
+        byte has arrived. "Content-Range: bytes */<total>" with an empty
+        body asks how much of the file has arrived so far.
+        Returns the same as _openPUT().
+        """
+        partFile = self._partFile()
+        try:
+            partSize = os.path.getsize(partFile)
+        except OSError:
+            partSize = 0
+        received = [('Range', 'bytes=0-%d' % (partSize - 1))] if partSize else []
+
+        match = re.match(r'bytes (?:(\d+)-(\d+)|\*)/(\d+)$', contentRange.strip())
+        if match is not None and match.group(1) is not None:
+            first, last, total = [int(value) for value in match.groups()]
+            valid = first <= last < total and last - first + 1 == contentLength
+        else:
+            valid = match is not None and contentLength == 0
+
+        if not valid:
+            log.warn("[%s] %s: Invalid Content-Range!", self.threadName, self.requestedFile)
+            self.keepAlive = False
+            payload = self._generateHTML(400)
+            header = self._generateHeader(400, 'PUT', contentLength=len(payload))
+            return self._createHTTPResponse(header, payload), None
+
+        if match.group(1) is None:
+            header = self._generateHeader(202, 'PUT', headers=received)
+            return [header], None
+
+        # Ranges have to continue the part received so far
+        if first > partSize:
+            log.warn("[%s] %s: Range starts past the received part!", self.threadName, self.requestedFile)
+            self.keepAlive = False
+            payload = self._generateHTML(416)
+            header = self._generateHeader(416, 'PUT', contentLength=len(payload),
+                                          headers=received + [('Content-Range', 'bytes */%d' % partSize)])
+            return self._createHTTPResponse(header, payload), None
+
+        try:
+            f = open(partFile, 'r+b' if os.path.exists(partFile) else 'wb')
+            f.seek(first)
+        except Exception as e:
+            return self._closePUT(None, e), None
+
+        self.partialPUT = (partFile, first, last, total)
+        return None, f
+
+    def _partFile(self):
+        """
+        Hidden file collecting the ranges of a resumable upload.
+        """
+        directory, name = os.path.split(self.requestedFile)
+        return os.path.join(directory, "." + name + ".part")
+
+    def _tempFile(self):
+        """
+        Hidden, uniquely named file receiving the body of a PUT.
+        """
+        directory, name = os.path.split(self.requestedFile)
+        return os.path.join(directory, ".%s.%s.tmp" % (name, uuid.uuid4().hex))
+
+    def _bodyRecvSize(self):
+        """
+        Number of request body bytes to receive next.
+        """
+        if self.bodyDecoder is not None:
+            return self.chunkSize
+        return min(self.chunkSize, self.bodyRemaining)
+
+    def _takeBufferedBody(self):
+        """
+        Take the request body bytes received along with the header
+        out of the buffer.
+        """
+        if self.bodyDecoder is not None:
+            return self._takeBuffered(len(self.buffer))
+        return self._takeBuffered(self.bodyRemaining)
+
+    def _writeBody(self, f, data):
+        """
+        Write received request body bytes to f.
+        Returns True once the whole body has been written.
+        """
+        if self.bodyDecoder is None:
+            f.write(data)
+            self.bodyHash.update(data)
+            self.bodyReceived += len(data)
+            self.bodyRemaining -= len(data)
+            return self.bodyRemaining <= 0
+
+        data = self.bodyDecoder.feed(data)
+        self.bodyReceived += len(data)
+        if self.maxBodySize and self.bodyReceived > self.maxBodySize:
+            raise ParseError(413, "Request body exceeds %d bytes" % self.maxBodySize)
+        f.write(data)
+        self.bodyHash.update(data)
+
+        if self.bodyDecoder.done:
+            # Hand pipelined requests back to the request parser
+            self.buffer[:0] = self.bodyDecoder.unused
+            return True
+        return False
+
+    def _closePUT(self, f, error=None):
+        """
+        Finish writing the PUT request body.
+        A body not matching the digests sent along with it is rejected.
+        Returns the response to send.
+        """
+        stat = digest = None
+        if f is not None:
+            try:
+                with f:
+                    f.flush()
+                    stat = os.fstat(f.fileno())
+            except Exception as e:
+                error = error or e
+
+        if error is None and self.partialPUT is not None:
+            partFile, first, last, total = self.partialPUT
+            reprDigest, contentDigest = self.expectedDigests
+            try:
+                if contentDigest not in (None, self.bodyHash.digest()):
+                    # Drop the corrupted range, so that the client sends it again
+                    os.truncate(partFile, first)
+                    raise ParseError(400, "Content-Digest does not match the range received")
+
+                if last + 1 < total:
+                    log.debug("[%s] Sending HTTP response!", self.threadName)
+                    header = self._generateHeader(202, 'PUT', headers=[('Range', 'bytes=0-%d' % last)])
+                    return [header]
+
+                # Last range arrived: the part file becomes the file
+                os.truncate(partFile, total)
+                if reprDigest is not None:
+                    with open(partFile, 'rb') as part:
+                        digest = hashFile(part, total).digest()
+                        stat = os.fstat(part.fileno())
+                    if digest != reprDigest:
+                        os.remove(partFile)
+                        raise ParseError(400, "Repr-Digest does not match the file received")
+                os.replace(partFile, self.requestedFile)
+            except Exception as e:
+                error = e
+        elif self.tempFile is not None:
+            try:
+                if error is None:
+                    digest = self.bodyHash.digest()
+                    if any(expected not in (None, digest) for expected in self.expectedDigests):
+                        raise ParseError(400, "Digest does not match the body received")
+                    os.replace(self.tempFile, self.requestedFile)
+            except Exception as e:
+                error = e
+            finally:
+                if error is not None and os.path.exists(self.tempFile):
+                    os.remove(self.tempFile)
+
+        self.resolver.invalidate(self.resolution.name)
+        if self.cache is not None:
+            self.cache.invalidate(self.requestedFile)
+        if self.compressor is not None:
+            self.compressor.invalidate(self.requestedFile)
+
+        if error is None:
+            log.debug("[%s] %s: %d bytes written", self.threadName, self.requestedFile, self.bodyReceived)
+            log.debug("[%s] Sending HTTP response!", self.threadName)
+            headers = None
+            if digest is not None:
+                # Known without reading the file again on the next GET
+                if self.digests is not None:
+                    self.digests.put(self.requestedFile, stat, digest)
+                headers = [('Repr-Digest', formatDigest(digest))]
+            header = self._generateHeader(200, 'PUT', headers=headers)
+            return [header]
+
+        # Rest of the request body is unread, so the connection can not be reused
+        self.keepAlive = False
+        if isinstance(error, ParseError):
+            log.warn("[%s] %s: %s", self.threadName, self.requestedFile, error)
+            payload = self._generateHTML(error.code)
+            header = self._generateHeader(error.code, 'PUT', contentLength=len(payload))
+            return self._createHTTPResponse(header, payload)
+
+        # The file could not be written: a server side failure
+        log.warn("[%s] %s: IOError!", self.threadName, self.requestedFile)
+        log.debug("[%s] %s", self.threadName, error)
+        payload = self._generateHTML(500)
+        header = self._generateHeader(500, 'PUT', contentLength=len(payload))
+        return self._createHTTPResponse(header, payload)
+
+    def _pageResponse(self, body, contentType):
+        """
+        Prepare the response serving a generated page.
+        """
+        header = self._generateHeader(200, contentLength=len(body),
+                                      headers=[('Content-Type', contentType), ('Cache-Control', 'no-store')])
+        if self.requestMethod == 'HEAD':
+            return [header]
+        return [header, body]
+
+    def _notImplemented(self, requestMethod):
+        """
+        Prepare the response to an unsupported request method.
+        """
+        log.warn("[%s] Unknown HTTP request method: %s", self.threadName, requestMethod)
+        self.keepAlive = False
+        payload = self._generateHTML(501)
+        header = self._generateHeader(501, contentLength=len(payload))
+        return self._createHTTPResponse(header, payload)
+
+    def _serviceUnavailable(self, retryAfter):
+        """
+        Prepare the response turning an overloaded client away.
+        """
+        log.debug("[%s] Sending HTTP response!", self.threadName)
+        self.keepAlive = False
+        payload = self._generateHTML(503)
+        header = self._generateHeader(503, contentLength=len(payload),
+                                      headers=[('Retry-After', '%d' % retryAfter)])
+        return self._createHTTPResponse(header, payload)
+
+    def _createHTTPResponse(self, header, payload):
+        """
+        Returns the response as the list of buffers to send,
+        gathered into a single sendmsg() by the server engines.
+        """
+        log.debug("[%s] Creating HTTP server response", self.threadName)
+        return [header, payload]
+
+    def _generateHeader(self, code, method='GET', contentLength=0, headers=None):
+        """
+        Generates HTTP response headers.
+        """
+        self.responseCode = code
+
+        # Status line, Date and Server header lines are prepared in advance
+        header = [statusLine(code, method), dateHeader(), self.serverHeader]
+        if contentLength is not None:
+            header.append(b"Content-Length: %d\r\n" % contentLength)
+        if headers:
+            header.append(headerLines(headers))
+        if self.keepAlive:
+            header.append(b"Connection: keep-alive\r\nKeep-Alive: timeout=%d, max=%d\r\n\r\n" %
+                          (self.keepAliveTimeout, self.maxRequests - self.requestCount))
+        else:
+            header.append(b"Connection: close\r\n\r\n")
+
+        return b"".join(header)
+
+    def _generateHTML(self, code):
+        """
+        Generates HTML page as a payload for a HTTP response.
+        """
+        return HTML_PAGES.get(code, b"")
+
+
+class ClientThread(RequestHandler, threading.Thread): 
 
     def __init__(self, clientConnection, 
                        clientIP, 
                        clientPort, 
                        serverIP,
                        serverPort,
-                       bufferSize=1024,
+                       bufferSize=16384,
                        threadGroup=None,
                        threadTarget=None,
                        threadName=None,
                        verbose=None,
-                       www=os.getcwd()):
-        if os.name == "posix":
+                       www=os.getcwd(),
+                       keepAliveTimeout=15,
+                       maxRequests=100,
+                       chunkSize=262144,
+                       sendfile=True,
+                       cache=None,
+                       maxBodySize=0,
+                       metrics=None,
+                       metricsPath=None,
+                       compressor=None,
+                       headerTimeout=10,
+                       bodyTimeout=30,
+                       writeTimeout=30,
+                       minRate=1024,
+                       reaper=None,
+                       resolver=None,
+                       digests=None):
+        if os.name == "posix" and sys.version_info[0] < 3:
             threading.Thread.__init__(self, group=threadGroup,
                                             target=threadTarget,
                                             name=threadName,
@@ -34,195 +978,378 @@ class ClientThread(threading.Thread):
             threading.Thread.__init__(self, group=threadGroup,
                                       target=threadTarget,
                                       name=threadName)
+        RequestHandler.__init__(self, clientIP,
+                                      clientPort,
+                                      serverIP,
+                                      serverPort,
+                                      bufferSize=bufferSize,
+                                      threadName=threadName,
+                                      www=www,
+                                      keepAliveTimeout=keepAliveTimeout,
+                                      maxRequests=maxRequests,
+                                      chunkSize=chunkSize,
+                                      sendfile=sendfile,
+                                      cache=cache,
+                                      maxBodySize=maxBodySize,
+                                      metrics=metrics,
+                                      metricsPath=metricsPath,
+                                      compressor=compressor,
+                                      headerTimeout=headerTimeout,
+                                      bodyTimeout=bodyTimeout,
+                                      writeTimeout=writeTimeout,
+                                      minRate=minRate,
+                                      reaper=reaper,
+                                      resolver=resolver,
+                                      digests=digests)
         self.clientConnection = clientConnection
-        self.clientIP = clientIP
-        self.clientPort = clientPort
-        self.serverIP = serverIP
-        self.serverPort = serverPort
-        self.bufferSize = bufferSize
-        self.threadName = threadName
-        self.www = www
+        self.scatterGather = hasattr(clientConnection, 'sendmsg')
 
     def run(self):
         """
         Request handler.
+        Serves requests on the persistent connection, in order,
+        until the client closes it, asks for "Connection: close",
+        stays idle longer than keepAliveTimeout, misses a deadline
+        or maxRequests have been served.
         """
         try:
-            # Receive request from client
-            log.info("[%s] Receiving client request", self.threadName)
-            clientRequest = self.clientConnection.recv(self.bufferSize)
+            # Responses are written in as few sends as possible, so
+            # Nagle's algorithm would only hold back their last segment
+            # until the client's delayed ACK
+            self.clientConnection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except (OSError, AttributeError):
+            pass
+        if self.metrics is not None:
+            self.metrics.connectionOpened()
+        if self.reaper is not None:
+            self.reaper.add(self)
 
-            # Decode client request to string
-            clientRequest = bytes.decode(clientRequest)
-            
-            # Determine request method (GET, PUT and TERMINATE are supported)
-#            serverIP = clientRequest.split(' ')[0]
-#            serverPort = int(clientRequest.split(' ')[1])
-            requestMethod = clientRequest.split(' ')[0]
-            log.debug("[%s] Request Method: %s", self.threadName, requestMethod)
-
-            # Determine requested URL
-            requestedURL = clientRequest.split(' ')[1]
-            
-            # Determine requested File and Arguments.
-            # If no file is specified by the browser,
-            # load index.html by default.
-            if '?' in requestedURL:
-                requestedFile = requestedURL.split('?', 1)[0]
-                requestedFile = requestedFile.split('/', 1)[1]
-                requestedArgs = requestedURL.split('?', 1)[1]
-            else:
-                requestedFile = requestedURL.split('/', 1)[1]
-                requestedArgs = None
-            if requestedFile == '':
-                requestedFile = 'index.html'
-            self.requestedFile = os.path.join(self.www, requestedFile)
-            log.debug("[%s] Requested File: %s", self.threadName, requestedFile)
-            log.debug("[%s] Requested Arguments: %s", self.threadName, requestedArgs)
-
-            if requestMethod == 'GET':
-                self._handleGET()
-            elif requestMethod == 'PUT':
-                self._handlePUT()
+        linger = True
+        try:
+            while self._handleRequest() and not self.closing:
+                pass
+        except socket.timeout:
+            if self.phase == "idle":
+                log.debug("[%s] Client connection idle for %ds", self.threadName, self.keepAliveTimeout)
             else:
-                log.warn("[%s] Unknown HTTP request method: %s", self.threadName, requestMethod)
-        except:
-            log.error("[%s] Problem handling client request [%s]", self.threadName, clientRequest)
+                log.info("[%s] Client connection timed out (%s)", self.threadName, self.phase)
+                self.abort()
+            linger = False
+        except Exception as e:
+            # Failing I/O is expected once the reaper aborted the connection
+            if not self.aborted:
+                log.error("[%s] Problem handling client request", self.threadName)
+            log.debug("[%s] %r", self.threadName, e)
         
         # Close client connection
-        log.info("[%s] Closing client connection", self.threadName)
+        log.debug("[%s] Closing client connection", self.threadName)
+        if self.reaper is not None:
+            self.reaper.discard(self)
+        self._enterPhase(None)
+        if linger and not self.aborted:
+            self._linger()
         self.clientConnection.close()
+        if self.metrics is not None:
+            self.metrics.connectionClosed(self.bytesReceived)
 
-    def _handleGET(self):
+    def _linger(self):
         """
-        Handle GET.
+        Closing a socket with unread data (e.g. the body of a rejected
+        PUT) resets the connection, which may discard the response
+        before the client reads it. Signal the end of the responses
+        and discard whatever the client still sends for a while.
         """
-        header = ""
-        payload = ""
-        
-        log.info("[%s] Serving web page: %s", self.threadName, self.requestedFile)
+        try:
+            self.clientConnection.shutdown(socket.SHUT_WR)
+            deadline = time.time() + self.lingerTimeout
+            while time.time() < deadline:
+                self.clientConnection.settimeout(max(deadline - time.time(), 0.01))
+                if not self.clientConnection.recv(self.chunkSize):
+                    break
+        except Exception:
+            pass
 
-        if not os.path.exists(self.requestedFile):
-            log.warn("[%s] %s: File not found!", self.threadName, self.requestedFile)
-            log.debug("[%s] Sending HTTP response!", self.threadName)
-            header = self._generateHeader(404)
-            payload = self._generateHTML(404)
-            httpResponse = self._createHTTPResponse(header, payload)
-            self.clientConnection.send(httpResponse)
-        else:
-            try:
-                log.debug("[%s] Sending HTTP response!", self.threadName)
-                header = self._generateHeader(200)
-                httpResponse = self._createHTTPResponse(header, payload)
-                self.clientConnection.send(httpResponse)
-                
-                # Send requested file over TCP connection to the client
-                with open(self.requestedFile, 'rb') as f:
-                    payload = f.read(self.bufferSize)
-                    while payload:
-                        log.debug("[%s] 1024 bytes were sent.....", self.threadName)
-                        self.clientConnection.send(payload)
-                        payload = f.read(self.bufferSize)
-                    
-                    time.sleep(2)
-                    
-                    self.clientConnection.send("EOF".encode())
-            except Exception as e:
-                log.warn("[%s] %s: IOError!", self.threadName, self.requestedFile)
-                log.debug("[%s] %r", self.threadName, e)
-                log.debug("[%s] Sending HTTP response!", self.threadName)
-                header = self._generateHeader(404)
-                payload = self._generateHTML(404)
-                httpResponse = self._createHTTPResponse(header, payload)
-                self.clientConnection.send(httpResponse)
+    def _enterPhase(self, phase):
+        """
+        Start a phase of the connection, each blocking socket
+        operation of which times out after the phase deadline.
+        """
+        RequestHandler._enterPhase(self, phase)
+        self.clientConnection.settimeout(self.phaseTimeout)
 
-    def _handlePUT(self):
+    def abort(self):
         """
-        Handle PUT.
+        Make the pending and future I/O of the connection fail,
+        and closing it reset the connection.
         """
-        log.info("[%s] Writing to web server: %s", self.threadName, self.requestedFile)
+        try:
+            self.clientConnection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, LINGER_RESET)
+            self.clientConnection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
-        if not os.path.exists(self.requestedFile):
-            open(self.requestedFile, 'wb').close()
+    def _handleRequest(self):
+        """
+        Receive and serve a single request.
+        Returns True if the connection should be kept open.
+        """
+        # Receive request from client
+        log.debug("[%s] Receiving client request", self.threadName)
+        try:
+            clientRequest = self._recvRequest()
+        except ParseError as e:
+            try:
+                self._send(*self._badRequest(e))
+            finally:
+                self._requestDone()
+            return False
+        if clientRequest is None:
+            return False
 
+        requestMethod = self._parseRequest(clientRequest)
         try:
-            # Writing to requested file at the server
-            with open(self.requestedFile, 'wb') as f:
-                while True:
-                    data = self.clientConnection.recv(self.bufferSize)
+            if requestMethod in ('GET', 'HEAD'):
+                self._handleGET()
+            elif requestMethod == 'PUT':
+                self._handlePUT()
+            else:
+                self._send(*self._notImplemented(requestMethod))
+        finally:
+            self._requestDone()
 
-                    if data.decode("utf-8").strip() == u"EOF":
-                        break
-                    else:
-                        log.debug("[%s] 1024 bytes were written.....", self.threadName)
-                        f.write(data)
+        return self.keepAlive
 
-            log.debug("[%s] Sending HTTP response!", self.threadName)
-            header = self._generateHeader(200, 'PUT')
-            httpResponse = self._createHTTPResponse(header, "")
-            self.clientConnection.send(httpResponse)
-        except Exception as e:
-            log.warn("[%s] %s: IOError!", self.threadName, self.requestedFile)
-            log.debug("[%s] %s", self.threadName, e)
-            header = self._generateHeader(204, 'PUT')
-            payload = self._generateHTML(204)
-            httpResponse = self._createHTTPResponse(header, payload)
-            self.clientConnection.send(httpResponse)
-    
-    def _createHTTPResponse(self, header, payload):
-        log.debug("[%s] Creating HTTP server response", self.threadName)
-        httpResponse = header
-        httpResponse += payload
-        return httpResponse.encode()
+    def _send(self, *buffers, more=False):
+        """
+        Send buffers, gathered into as few sendmsg() calls as possible
+        instead of being joined, counting them for the access log.
+        more holds the data back until more follows (MSG_MORE).
+        """
+        if self.phase != "write":
+            self._enterPhase("write")
+        flags = MSG_MORE if more else 0
+        buffers = [memoryview(buffer) for buffer in buffers if buffer]
+        while buffers:
+            if self.scatterGather:
+                sent = self.clientConnection.sendmsg(buffers, (), flags)
+            else:
+                sent = self.clientConnection.send(buffers[0], flags)
+            self.bytesSent += sent
+            self._progress(sent)
+
+            # Drop what has been sent, resume partial sends
+            while sent:
+                if sent < len(buffers[0]):
+                    buffers[0] = buffers[0][sent:]
+                    break
+                sent -= len(buffers[0])
+                del buffers[0]
 
-    def _generateHeader(self, code, method='GET'):
+    def _recvRequest(self):
         """
-        Generates HTTP response headers.
+        Receive request line and headers.
+        Returns the parsed Request, or None if the client
+        closed the connection between requests.
         """
-        header = ""
-
-        # Determine response code
-        if code == 200 and method == 'GET':
-            header = 'HTTP/1.1 200 OK\n'
-        elif code == 200 and method == 'PUT':
-            header = 'HTTP/1.1 200 OK File Created\n'
-        elif code == 204:
-            header = 'HTTP/1.1 204 No Content\n'
-        elif code == 404:
-            header = 'HTTP/1.1 404 Not Found\n'
-    
-        # Add more header fields
-        date = time.strftime("%a, %d %b %Y %H:%M:%S", time.localtime())
-        header += 'Date: %r\n' % date
-        header += 'Server: HTTPServer [%s:%d]\n' % (self.serverIP, self.serverPort)
-        header += 'Connection: keep-alive\n\n'
-    
-        return header
+        self._enterPhase("head" if self.buffer.strip() else "idle")
+        while True:
+            clientRequest = self._nextRequest()
+            if clientRequest is not None:
+                self._enterPhase(None)
+                return clientRequest
 
-    def _generateHTML(self, code):
+            data = self.clientConnection.recv(self.bufferSize)
+            self.bytesReceived += len(data)
+            if not data:
+                if self.buffer.strip():
+                    raise IOError("Connection closed before the request header was complete")
+                return None
+            self.buffer += data
+            if self.phase == "idle" and self.buffer.strip():
+                self._enterPhase("head")
+
+    def _handleGET(self):
         """
-        Generates HTML page as a payload for a HTTP response.
+        Handle GET.
         """
-        html = ""
+        httpResponse, f, parts = self._openGET()
+        if f is None:
+            self._send(*httpResponse)
+            return
+
+        # Send requested file over TCP connection to the client.
+        # The header and part prefixes go out along with the file data.
+        pending = httpResponse
+        with f:
+            for prefix, offset, length in parts:
+                pending.append(prefix)
+                if not length:
+                    continue
 
-        # Create HTML based on response code
-        if code == 200:
-            html += "<html><body><p>Status Code 200: OK!</p></body></html>"
-        elif code == 204:
-            html += "<html><body><p>Status Code 204: No Content!</p></body></html>"
-        elif code == 404:
-            html += "<html><body><p>ERROR 404: File not found!</p></body></html>"
+                if self.sendfile:
+                    self._send(*pending, more=True)
+                    self._sendFile(f, offset, length)
+                else:
+                    f.seek(offset)
+                    for payload in self._readChunks(f, length):
+                        self._send(*pending + [payload])
+                        pending = []
+                pending = []
+        self._send(*pending)
+
+    def _sendFile(self, f, offset, length):
+        """
+        Send length bytes of f from offset with sendfile(), chunkSize
+        bytes at a time so that the write deadlines see the progress.
+        """
+        end = offset + length
+        while offset < end:
+            sent = self.clientConnection.sendfile(f, offset, min(self.chunkSize, end - offset))
+            if not sent:
+                raise IOError("File shrank while it was being sent")
+            offset += sent
+            self.bytesSent += sent
+            self._progress(sent)
+
+    def _handlePUT(self):
+        """
+        Handle PUT.
+        """
+        httpResponse, f = self._openPUT()
+        if f is None:
+            self._send(*httpResponse)
+            return
+
+        error = None
+        try:
+            self._enterPhase("body")
+            data = self._takeBufferedBody()
+            while not self._writeBody(f, data):
+                data = self.clientConnection.recv(self._bodyRecvSize())
+                self.bytesReceived += len(data)
+                self._progress(len(data))
+                if not data:
+                    raise IOError("Connection closed before the request body was complete")
+        except Exception as e:
+            error = e
+
+        self._send(*self._closePUT(f, error))
     
-        return html
+    def reject(self, retryAfter):
+        """
+        Turn the client away with 503 without reading its request.
+        """
+        httpResponse = self._serviceUnavailable(retryAfter)
+        if self.metrics is not None:
+            self.metrics.connectionRejected()
+
+        # Never let a slow client block the caller
+        try:
+            self.clientConnection.setblocking(False)
+            self.clientConnection.send(b"".join(httpResponse))
+        except Exception as e:
+            log.debug("[%s] %r", self.threadName, e)
+
+        log.debug("[%s] Closing client connection", self.threadName)
+        self.clientConnection.close()
 
 
 class HTTPServer(object):
     
-    def __init__(self, hostname="127.0.0.1", port=8080, www=os.getcwd(), capacity=10):
+    def __init__(self, hostname="127.0.0.1", port=8080, www=os.getcwd(), capacity=10,
+                       keepAliveTimeout=15, maxRequests=100,
+                       workers=0, queueSize=64, overload="reject", retryAfter=1,
+                       reusePort=False, chunkSize=262144, sendfile=True,
+                       cacheSize=0, cacheMaxFileSize=1024 * 1024, maxBodySize=0,
+                       metricsPath=None, metricsPort=0, profile=False,
+                       compression=True, compressMinSize=1024, compressMaxSize=1024 * 1024,
+                       compressCacheSize=16 * 1024 * 1024,
+                       headerTimeout=10, bodyTimeout=30, writeTimeout=30, minRate=1024,
+                       shutdownTimeout=10, statCacheSize=4096):
         self.hostname = hostname
         self.port = port
         self.www = www
         self.capacity = capacity
+        # Let several server processes listen on the same port
+        self.reusePort = reusePort
+        self.chunkSize = chunkSize
+        self.sendfile = sendfile
+        # Largest PUT request body accepted, 0 for no limit
+        self.maxBodySize = maxBodySize
+        self.keepAliveTimeout = keepAliveTimeout
+        self.maxRequests = maxRequests
+
+        # Slow client protection: deadlines of the request head, body
+        # and response, the minimum transfer rate (bytes/s) of bodies
+        # and responses, enforced by the reaper. With a worker pool,
+        # idle persistent connections are also closed early while other
+        # connections wait for a worker. On shutdown, connections get
+        # shutdownTimeout seconds to finish their current request.
+        self.headerTimeout = headerTimeout
+        self.bodyTimeout = bodyTimeout
+        self.writeTimeout = writeTimeout
+        self.minRate = minRate
+        self.shutdownTimeout = shutdownTimeout
+        self.reaper = Reaper(pressure=lambda: self.workers and self.connectionQueue.qsize() > 0,
+                             name="%d-reaper" % port)
+        self.stopped = False
+
+        # Cache of small files, shared by all connections
+        self.cache = None
+        if cacheSize:
+            self.cache = ResponseCache(cacheSize, cacheMaxFileSize)
+
+        # Request paths confined to www, with the stat() results of the
+        # last statCacheSize files looked up
+        self.resolver = PathResolver(www, statCacheSize)
+
+        # SHA-256 digests of files, hashed once per version of them
+        self.digests = DigestCache()
+
+        # gzip/deflate encoding of files, for clients accepting it
+        self.compressor = None
+        if compression:
+            self.compressor = Compressor(compressMinSize, compressMaxSize, compressCacheSize)
+
+        # Worker pool: with workers > 0, accepted connections are queued
+        # (at most queueSize of them) for a fixed set of worker threads
+        # instead of getting a thread each. When the queue is full, clients
+        # are either rejected with 503 (overload="reject") or accepting
+        # is deferred until a worker frees up (overload="defer").
+        if overload not in ("reject", "defer"):
+            raise ValueError("Unknown overload behaviour: %s" % overload)
+        if workers and queueSize < 1:
+            raise ValueError("Accept queue size must be positive")
+        self.workers = workers
+        self.queueSize = queueSize
+        self.overload = overload
+        self.retryAfter = retryAfter
+        self.workerThreads = []
+        self.busyWorkers = 0
+        self.workerLock = threading.Lock()
+
+        # Metrics, served at metricsPath on the server port, or on
+        # metricsPort of their own; disabled when neither is set.
+        # profile also samples the stacks of the server threads.
+        self.metrics = None
+        self.metricsServer = None
+        self.metricsPath = metricsPath or "/__metrics"
+        self.metricsPort = metricsPort
+        if metricsPath or metricsPort:
+            self.metrics = Metrics(profile=profile)
+            self.metrics.registerCache(self.cache)
+            if self.compressor is not None:
+                self.metrics.registerCache(self.compressor.cache, "compressed_cache")
+            self.metrics.registerCache(self.digests, "digest_cache")
+            self.metrics.register("threads", "gauge", "Live threads of the server process.",
+                                  threading.active_count)
+            if workers:
+                self.metrics.register("workers", "gauge", "Worker pool size.",
+                                      lambda: self.workers)
+                self.metrics.register("busy_workers", "gauge", "Workers serving a connection.",
+                                      lambda: self.busyWorkers)
+                self.metrics.register("accept_queue_length", "gauge", "Connections waiting for a free worker.",
+                                      lambda: self.connectionQueue.qsize())
 
     def start(self):
         """ 
@@ -232,7 +1359,10 @@ class HTTPServer(object):
 
         try:
             self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            #self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if os.name == "posix":
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.reusePort:
+                self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             self.socket.bind((self.hostname, self.port))
         except Exception as e:
             log.warn("Could not aquire port %d", self.port)
@@ -253,45 +1383,175 @@ class HTTPServer(object):
         log.info("HTTP server is listening at port %d", self.port)
         self.socket.listen(self.capacity)
 
+        if self.metrics is not None:
+            self._startMetricsServer()
+
+        # Start the worker pool
+        if self.workers:
+            log.info("Starting %d worker threads, accept queue size %d", self.workers, self.queueSize)
+            self.connectionQueue = queue.Queue(self.queueSize)
+            for i in range(self.workers):
+                worker = threading.Thread(target=self._worker, name="%d-worker-%d" % (self.port, i))
+                self.workerThreads.append(worker)
+                worker.start()
+        self.reaper.start()
+
         while True:
             # Established client connection
             clientConnection, (clientIP, clientPort) = self.socket.accept()
-            log.info("Established client connection with %s:%d", clientIP, clientPort)
+            log.debug("Established client connection with %s:%d", clientIP, clientPort)
+
+            if self.workers:
+                self._dispatch(clientConnection, clientIP, clientPort)
+                continue
 
             # Start a new HTTP server socket thread for the new connection
-            threadName = "%d->%s:%d" % (self.port, clientIP, clientPort)
-            newConnection = ClientThread(clientConnection, 
-                                         clientIP, 
-                                         clientPort,
-                                         self.hostname,
-                                         self.port,
-                                         threadName=threadName,
-                                         www=self.www)
+            newConnection = self._createClientThread(clientConnection, clientIP, clientPort)
             #newConnection.daemon = True
             log.debug("New HTTP server socket thread started for the client %s:%d", clientIP, clientPort)
             
             newConnection.start()
+
+    def _createClientThread(self, clientConnection, clientIP, clientPort):
+        """
+        Create the request handler for a client connection.
+        """
+        threadName = "%d->%s:%d" % (self.port, clientIP, clientPort)
+        return ClientThread(clientConnection, 
+                            clientIP, 
+                            clientPort,
+                            self.hostname,
+                            self.port,
+                            threadName=threadName,
+                            www=self.www,
+                            keepAliveTimeout=self.keepAliveTimeout,
+                            maxRequests=self.maxRequests,
+                            chunkSize=self.chunkSize,
+                            sendfile=self.sendfile,
+                            cache=self.cache,
+                            maxBodySize=self.maxBodySize,
+                            metrics=self.metrics,
+                            metricsPath=None if self.metricsPort else self.metricsPath,
+                            compressor=self.compressor,
+                            headerTimeout=self.headerTimeout,
+                            bodyTimeout=self.bodyTimeout,
+                            writeTimeout=self.writeTimeout,
+                            minRate=self.minRate,
+                            reaper=self.reaper,
+                            resolver=self.resolver,
+                            digests=self.digests)
+
+    def _startMetricsServer(self):
+        """
+        Serve the metrics on metricsPort, if set.
+        """
+        if not self.metricsPort:
+            log.info("Serving metrics at %s", self.metricsPath)
+            return
+
+        try:
+            self.metricsServer = MetricsServer(self.metrics, self.hostname, self.metricsPort,
+                                               self.metricsPath, reusePort=self.reusePort)
+            self.metricsServer.start()
+        except Exception as e:
+            log.error("Could not serve metrics on port %d!", self.metricsPort)
+            log.debug(e)
+
+    def _dispatch(self, clientConnection, clientIP, clientPort):
+        """
+        Queue a client connection for the worker pool.
+        """
+        connection = (clientConnection, clientIP, clientPort)
+
+        if self.overload == "defer":
+            # Stop accepting until a worker frees up a slot;
+            # new clients wait in the listen backlog meanwhile.
+            self.connectionQueue.put(connection)
+            return
+
+        try:
+            self.connectionQueue.put_nowait(connection)
+        except queue.Full:
+            log.warn("Accept queue is full, rejecting client %s:%d", clientIP, clientPort)
+            self._createClientThread(*connection).reject(self.retryAfter)
+
+    def _worker(self):
+        """
+        Worker pool thread.
+        Serves queued client connections one at a time until it
+        receives None.
+        """
+        while True:
+            connection = self.connectionQueue.get()
+            if connection is None:
+                break
+
+            # Serve the connection on this worker thread
+            with self.workerLock:
+                self.busyWorkers += 1
+            try:
+                self._createClientThread(*connection).run()
+            finally:
+                with self.workerLock:
+                    self.busyWorkers -= 1
             
     def stop(self):
         """ 
         Stop the server.
+        Idle connections are closed at once, the others after their
+        current request; those still open after shutdownTimeout are
+        aborted. Connections waiting for a worker are turned away.
         """
+        if self.stopped:
+            return
+        self.stopped = True
         log.info("Shutting down HTTP server %s:%d", self.hostname, self.port)
 
         try:
-            # Wait for completion
-            for t in threading.enumerate():
-                if t is threading.current_thread():
-                    continue
-                
-                logging.debug('Joining %s', t.getName())
-                t.join()
-            
-            # Shutdown the socket
+            # Shutdown the socket, so that no new connections are accepted
+            # (with reusePort, the kernel hands them to the other servers)
             self.socket.shutdown(socket.SHUT_RDWR)
-            
-            # Give some time to the server
-            time.sleep(10)
         except Exception as e:
             log.error("Could not shut down the socket!")
             log.debug(e)
+
+        if self.metricsServer is not None:
+            self.metricsServer.stop()
+        if self.metrics is not None:
+            self.metrics.close()
+
+        deadline = time.time() + self.shutdownTimeout
+        self.reaper.closeIdle()
+
+        # Let the workers finish their connection and exit
+        stopping = 0
+        if self.workerThreads:
+            while True:
+                try:
+                    connection = self.connectionQueue.get_nowait()
+                except queue.Empty:
+                    break
+                if connection is not None:
+                    self._createClientThread(*connection).reject(self.retryAfter)
+            try:
+                for worker in self.workerThreads:
+                    self.connectionQueue.put(None, timeout=max(deadline - time.time(), 0))
+                    stopping += 1
+            except queue.Full:
+                pass
+
+        # Wait for the workers and the connection threads
+        threads = self.workerThreads + [connection for connection in self.reaper.active()
+                                        if isinstance(connection, threading.Thread) and connection.is_alive()]
+        for t in threads:
+            log.debug('Joining %s', t.getName())
+            t.join(max(deadline - time.time(), 0))
+
+        aborted = self.reaper.abortAll()
+        if aborted:
+            log.warn("Aborted %d client connections still open after %ds", aborted, self.shutdownTimeout)
+        for worker in self.workerThreads[stopping:]:
+            self.connectionQueue.put(None)
+        for t in threads:
+            t.join(RequestHandler.lingerTimeout + 1)
+        self.reaper.stop()
@@ -0,0 +1,278 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+
+from HTTP_v1_1.client import ConnectionPool, AsyncHTTPClient, ConnectionError, RequestError
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+
+log = logging.getLogger(__name__)
+
+
+class BulkTransfer(object):
+    """
+    Transfers a set of files between the client directory and the
+    server, concurrency requests at a time over pooled persistent
+    connections. Failed transfers are retried with exponential
+    backoff; progress and throughput are logged every
+    progressInterval seconds.
+
+    The thread engine runs a thread per concurrent request, each GET
+    fetching byte ranges over connections connections. The async
+    engine runs the requests as coroutines of an AsyncHTTPClient, on
+    at most connections connections to the server, with up to pipeline
+    GET requests in flight on each.
+    """
+
+    def __init__(self, serverIP, serverPort, clientIP="127.0.0.1", clientPort=0,
+                       clientDirectory=os.path.join(os.getcwd(), "data", "client"),
+                       concurrency=4, retries=3, backoff=0.5, maxBackoff=10,
+                       connections=1, progressInterval=1.0, engine="thread", pipeline=8):
+        self.serverIP = serverIP
+        self.serverPort = serverPort
+        self.clientDirectory = clientDirectory
+        self.concurrency = max(concurrency, 1)
+
+        # A failed transfer is retried up to retries times, waiting
+        # backoff * 2^attempt seconds (at most maxBackoff), jittered
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+
+        # Parallel range connections per GET
+        self.connections = connections
+        self.progressInterval = progressInterval
+
+        if engine not in ("thread", "async"):
+            raise ValueError("Unknown transfer engine: %s" % engine)
+        self.engine = engine
+        if engine == "async":
+            self.client = AsyncHTTPClient(clientIP, clientDirectory,
+                                          maxConnections=connections, pipeline=pipeline)
+        else:
+            self.client = self.pool = ConnectionPool(clientIP, clientPort, clientDirectory,
+                                                     maxSize=self.concurrency)
+
+    def localFiles(self):
+        """
+        Names of the files in the client directory, skipping the hidden
+        part and validator files of the client.
+        """
+        return sorted(name for name in os.listdir(self.clientDirectory)
+                      if not name.startswith(".") and
+                      os.path.isfile(os.path.join(self.clientDirectory, name)))
+
+    def upload(self, filenames=None):
+        """
+        PUT the given files, or every file of the client directory.
+        """
+        if filenames is None:
+            filenames = self.localFiles()
+        return self.run([("PUT", filename) for filename in filenames])
+
+    def download(self, filenames=None):
+        """
+        GET the given files, or refresh every file of the client directory.
+        """
+        if filenames is None:
+            filenames = self.localFiles()
+        return self.run([("GET", filename) for filename in filenames])
+
+    def run(self, requests):
+        """
+        Send (method, filename) requests concurrently.
+        Returns a report of the transfer.
+        """
+        self.lock = threading.Lock()
+        self.total = len(requests)
+        self.completed = 0
+        self.retried = 0
+        self.failed = []
+        self.startBytes = self.client.bytesTransferred
+        self.started = time.time()
+        self.finished = threading.Event()
+
+        reporter = threading.Thread(target=self._reporter)
+        reporter.daemon = True
+        reporter.start()
+
+        try:
+            if self.engine == "async":
+                asyncio.run(self._runAsync(requests))
+            else:
+                self._runThreads(requests)
+        finally:
+            self.finished.set()
+            self.client.close()
+
+        report = self._report()
+        log.info("Transferred %d of %d files, %d failed, %d retries, %.1f MB in %.1fs (%.1f MB/s)",
+                 report["completed"], report["files"], len(report["failed"]), report["retries"],
+                 report["bytes"] / 1e6, report["elapsed"], report["throughput"] / 1e6)
+        return report
+
+    def _runThreads(self, requests):
+        """
+        Transfer the files from concurrency threads.
+        """
+        self.pending = queue.Queue()
+        for request in requests:
+            self.pending.put(request)
+
+        workers = [threading.Thread(target=self._worker) for i in range(min(self.concurrency, self.total))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def _worker(self):
+        """
+        Transfer files until none is left.
+        """
+        while True:
+            try:
+                method, filename = self.pending.get_nowait()
+            except queue.Empty:
+                return
+
+            self._finish(method, filename, self._transfer(method, filename))
+
+    async def _runAsync(self, requests):
+        """
+        Transfer the files as coroutines, concurrency at a time.
+        """
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def transfer(method, filename):
+            async with slots:
+                self._finish(method, filename, await self._transferAsync(method, filename))
+
+        try:
+            await asyncio.gather(*[transfer(method, filename) for method, filename in requests])
+        finally:
+            # Connections are closed on the event loop they belong to
+            self.client.close()
+
+    def _finish(self, method, filename, error):
+        """
+        Count a transfer done, failed if error is not None.
+        """
+        with self.lock:
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed.append((method, filename, error))
+
+    def _transfer(self, method, filename):
+        """
+        Transfer a file, retrying failures worth retrying.
+        Returns None on success, otherwise the last error.
+        """
+        error = self._missing(method, filename)
+        if error is not None:
+            return error
+
+        attempt = 0
+        while True:
+            code, error = None, None
+            try:
+                code = self.pool.request(self.serverIP, self.serverPort, method, filename, self.connections)
+            except (ConnectionError, RequestError, IOError) as e:
+                error = e
+
+            error, delay = self._judge(method, filename, code, error, attempt)
+            if delay is None:
+                return error
+            attempt += 1
+            time.sleep(delay)
+
+    async def _transferAsync(self, method, filename):
+        """
+        Coroutine of _transfer() with the async engine.
+        """
+        error = self._missing(method, filename)
+        if error is not None:
+            return error
+
+        attempt = 0
+        while True:
+            code, error = None, None
+            try:
+                code = await self.client.request(self.serverIP, self.serverPort, method, filename)
+            except (ConnectionError, RequestError, IOError, asyncio.TimeoutError) as e:
+                error = e
+
+            error, delay = self._judge(method, filename, code, error, attempt)
+            if delay is None:
+                return error
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    def _missing(self, method, filename):
+        """
+        Returns the error of a PUT of a file missing from the client
+        directory, otherwise None.
+        """
+        if method == "PUT" and not os.path.isfile(os.path.join(self.clientDirectory, filename)):
+            log.error("[%s] %s does not exist", method, filename)
+            return RequestError("[%s] File does not exist!" % (method,))
+        return None
+
+    def _judge(self, method, filename, code, error, attempt):
+        """
+        Judge an attempt at a transfer, which ended with the status
+        code, or with error. Returns the error of the transfer, None
+        on success, and the seconds to wait before retrying it, None
+        not to retry.
+        """
+        if error is None:
+            if code < 400:
+                return None, None
+
+            error = RequestError("[%s] %s: HTTP status %d" % (method, filename, code))
+            # Client errors (e.g. 404) do not go away by retrying
+            if code < 500:
+                log.error("%s", error)
+                return error, None
+
+        if attempt >= self.retries:
+            log.error("[%s] %s failed after %d attempts: %s", method, filename, attempt + 1, error)
+            return error, None
+
+        delay = min(self.backoff * 2 ** attempt, self.maxBackoff) * random.uniform(0.5, 1.5)
+        with self.lock:
+            self.retried += 1
+        log.warn("[%s] %s failed (%s), retrying in %.1fs", method, filename, error, delay)
+        return error, delay
+
+    def _reporter(self):
+        """
+        Log progress and throughput until the transfer finishes.
+        """
+        while not self.finished.wait(self.progressInterval):
+            report = self._report()
+            log.info("Progress: %d/%d files, %d failed, %.1f MB, %.1f MB/s",
+                     report["completed"], report["files"], len(report["failed"]),
+                     report["bytes"] / 1e6, report["throughput"] / 1e6)
+
+    def _report(self):
+        """
+        Returns the counters of the transfer so far.
+        """
+        elapsed = time.time() - self.started
+        transferred = self.client.bytesTransferred - self.startBytes
+        with self.lock:
+            return {"files": self.total,
+                    "completed": self.completed,
+                    "failed": list(self.failed),
+                    "retries": self.retried,
+                    "bytes": transferred,
+                    "elapsed": elapsed,
+                    "throughput": transferred / elapsed if elapsed else 0.0}
@@ -5,6 +5,7 @@ import atexit
 import argparse
 
 from HTTP_v1_1.server import HTTPServer
+from HTTP_v1_1.logger import configureLogging
 
 
 # Global variables
@@ -17,6 +18,7 @@ def shutdown(signal=None, frame=None):
         httpServer.stop()
         sys.exit(1)
 signal.signal(signal.SIGINT, shutdown)
+signal.signal(signal.SIGTERM, shutdown)
 atexit.register(shutdown)
 
 
@@ -26,8 +28,71 @@ def ServerApp(**args):
     serverIP = args["hostname"]
     serverPort = args["port"]
     www = args["web_server_directory"]
+    keepAliveTimeout = args["keep_alive_timeout"]
+    maxRequests = args["max_requests"]
+    workers = args["workers"]
+    queueSize = args["queue_size"]
+    overload = args["overload"]
+    engine = args["engine"]
+    capacity = args["backlog"]
+    processes = args["processes"]
+    chunkSize = args["chunk_size"]
+    sendfile = not args["no_sendfile"]
+    cacheSize = args["cache_size"]
+    cacheMaxFileSize = args["cache_max_file_size"]
+    maxBodySize = args["max_body_size"]
+    metricsPath = args["metrics_path"]
+    metricsPort = args["metrics_port"]
+    profile = args["profile"]
+    compression = not args["no_compression"]
+    compressCacheSize = args["compress_cache_size"]
+    headerTimeout = args["header_timeout"]
+    bodyTimeout = args["body_timeout"]
+    writeTimeout = args["write_timeout"]
+    minRate = args["min_rate"]
+    shutdownTimeout = args["shutdown_timeout"]
+    statCacheSize = args["stat_cache_size"]
+
+    # Log records are written by a background thread, off the request path
+    configureLogging(args["log_level"], accessLog=args["access_log"])
     
-    httpServer = HTTPServer(serverIP, serverPort, www=www)
+    # Server options shared by both engines
+    serverOptions = dict(www=www,
+                         capacity=capacity,
+                         keepAliveTimeout=keepAliveTimeout,
+                         maxRequests=maxRequests,
+                         chunkSize=chunkSize,
+                         sendfile=sendfile,
+                         cacheSize=cacheSize,
+                         cacheMaxFileSize=cacheMaxFileSize,
+                         maxBodySize=maxBodySize,
+                         metricsPath=metricsPath,
+                         metricsPort=metricsPort,
+                         profile=profile,
+                         compression=compression,
+                         compressCacheSize=compressCacheSize,
+                         headerTimeout=headerTimeout,
+                         bodyTimeout=bodyTimeout,
+                         writeTimeout=writeTimeout,
+                         minRate=minRate,
+                         shutdownTimeout=shutdownTimeout,
+                         statCacheSize=statCacheSize)
+    if engine == "thread":
+        serverOptions.update(workers=workers,
+                             queueSize=queueSize,
+                             overload=overload)
+
+    if processes:
+        from HTTP_v1_1.prefork import PreforkHTTPServer
+        httpServer = PreforkHTTPServer(serverIP, serverPort,
+                                       processes=processes,
+                                       engine=engine,
+                                       **serverOptions)
+    elif engine == "async":
+        from HTTP_v1_1.asyncserver import AsyncHTTPServer
+        httpServer = AsyncHTTPServer(serverIP, serverPort, **serverOptions)
+    else:
+        httpServer = HTTPServer(serverIP, serverPort, **serverOptions)
     
     try:
         httpServer.start()
@@ -46,7 +111,33 @@ if __name__ == "__main__":
                                            ServerApp.py \
                                            -t <hostname> \
                                            -p <port> \
-                                           -w <web_server_directory>')
+                                           -w <web_server_directory> \
+                                           -k <keep_alive_timeout> \
+                                           -r <max_requests> \
+                                           -n <workers> \
+                                           -q <queue_size> \
+                                           -o <overload> \
+                                           -e <engine> \
+                                           -b <backlog> \
+                                           -P <processes> \
+                                           -c <chunk_size> \
+                                           -z \
+                                           -m <cache_size> \
+                                           -M <cache_max_file_size> \
+                                           -L <max_body_size> \
+                                           -l <log_level> \
+                                           -A <access_log> \
+                                           -x <metrics_path> \
+                                           -X <metrics_port> \
+                                           -S \
+                                           -C \
+                                           -Z <compress_cache_size> \
+                                           -H <header_timeout> \
+                                           -B <body_timeout> \
+                                           -W <write_timeout> \
+                                           -R <min_rate> \
+                                           -D <shutdown_timeout> \
+                                           -T <stat_cache_size>')
 
     parser.add_argument("-t", "--hostname", type=str, default="127.0.0.1",
                         help="Server hostname, default: 127.0.0.1")
@@ -54,6 +145,59 @@ if __name__ == "__main__":
                         help="Server port, default: 8080")
     parser.add_argument("-w", "--web_server_directory", type=str, default=os.path.join(os.getcwd(), "data", "server"),
                         help="Web server directory, default: /<Current Working Directory>/data/server/")
+    parser.add_argument("-k", "--keep_alive_timeout", type=int, default=15,
+                        help="Seconds an idle persistent connection is kept open, default: 15")
+    parser.add_argument("-r", "--max_requests", type=int, default=100,
+                        help="Maximum requests served per connection, default: 100")
+    parser.add_argument("-n", "--workers", type=int, default=0,
+                        help="Worker pool size, 0 starts a thread per connection, default: 0")
+    parser.add_argument("-q", "--queue_size", type=int, default=64,
+                        help="Connections waiting for a free worker, default: 64")
+    parser.add_argument("-o", "--overload", type=str, default="reject", choices=["reject", "defer"],
+                        help="When the queue is full, reply 503 (reject) or stop accepting (defer), default: reject")
+    parser.add_argument("-e", "--engine", type=str, default="thread", choices=["thread", "async"],
+                        help="Server engine, threads or a single event loop, default: thread")
+    parser.add_argument("-b", "--backlog", type=int, default=10,
+                        help="Listen backlog for connections not yet accepted, default: 10")
+    parser.add_argument("-P", "--processes", type=int, default=0,
+                        help="Server processes sharing the port, 0 runs a single process, default: 0")
+    parser.add_argument("-c", "--chunk_size", type=int, default=262144,
+                        help="Bytes per read or write of file and request body data not sent with sendfile(), default: 262144")
+    parser.add_argument("-z", "--no_sendfile", action="store_true",
+                        help="Send files through buffered reads instead of zero-copy sendfile()")
+    parser.add_argument("-m", "--cache_size", type=int, default=0,
+                        help="Bytes of small files kept in memory, 0 disables the cache, default: 0")
+    parser.add_argument("-M", "--cache_max_file_size", type=int, default=1024 * 1024,
+                        help="Largest file kept in the cache, default: 1048576")
+    parser.add_argument("-L", "--max_body_size", type=int, default=0,
+                        help="Largest PUT request body accepted, 0 for no limit, default: 0")
+    parser.add_argument("-l", "--log_level", type=str, default="info",
+                        choices=["debug", "info", "warning", "error", "critical"],
+                        help="Server log level, default: info")
+    parser.add_argument("-A", "--access_log", type=str, default=None,
+                        help="File receiving a JSON line per request, \"-\" for standard output, default: none")
+    parser.add_argument("-x", "--metrics_path", type=str, default=None,
+                        help="Path serving Prometheus metrics, e.g. /__metrics, default: none")
+    parser.add_argument("-X", "--metrics_port", type=int, default=0,
+                        help="Serve the metrics on this port instead of the server port, default: 0")
+    parser.add_argument("-S", "--profile", action="store_true",
+                        help="Sample the stacks of the server threads, served at <metrics_path>/profile")
+    parser.add_argument("-C", "--no_compression", action="store_true",
+                        help="Never send files gzip or deflate encoded")
+    parser.add_argument("-Z", "--compress_cache_size", type=int, default=16 * 1024 * 1024,
+                        help="Bytes of files compressed on the fly kept in memory, default: 16777216")
+    parser.add_argument("-H", "--header_timeout", type=int, default=10,
+                        help="Seconds a client has to send a request line and headers, default: 10")
+    parser.add_argument("-B", "--body_timeout", type=int, default=30,
+                        help="Seconds a request body may stall, default: 30")
+    parser.add_argument("-W", "--write_timeout", type=int, default=30,
+                        help="Seconds a response may stall, default: 30")
+    parser.add_argument("-R", "--min_rate", type=int, default=1024,
+                        help="Slowest request body or response transfer allowed, in bytes/s, 0 for no limit, default: 1024")
+    parser.add_argument("-D", "--shutdown_timeout", type=int, default=10,
+                        help="Seconds connections get to finish on shut down before being aborted, default: 10")
+    parser.add_argument("-T", "--stat_cache_size", type=int, default=4096,
+                        help="Files whose stat() is kept for a second, missing ones included, 0 disables the cache, default: 4096")
 
     # Read user inputs
     args = vars(parser.parse_args())
@@ -0,0 +1,402 @@
+"""
+Load generator and benchmark suite for the HTTP server.
+
+    python benchmarks/loadbench.py -s <scenario> [-e <engine>] [-c <concurrency>]
+                                   [-d <duration>] [-o <results.json>] ...
+
+Starts the server on loopback in a separate process, drives it from
+concurrent client threads for a while and prints the results as JSON
+(requests/sec, throughput, latency percentiles), so that runs can be
+compared across commits. Options given on the command line override
+those of the scenario.
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from HTTP_v1_1.parser import ResponseParser
+from HTTP_v1_1.logger import configureLogging
+
+
+# sizes: file sizes and their weights; putRatio: share of PUT requests;
+# slowClients: connections trickling requests in byte by byte
+SCENARIOS = {
+    "small": dict(sizes="1k", concurrency=32, keepAlive=True, putRatio=0.0, slowClients=0),
+    "large": dict(sizes="8m", concurrency=4, keepAlive=True, putRatio=0.0, slowClients=0),
+    "mixed": dict(sizes="1k:70,64k:25,1m:5", concurrency=16, keepAlive=True, putRatio=0.2, slowClients=0),
+    "storm": dict(sizes="1k", concurrency=64, keepAlive=False, putRatio=0.0, slowClients=0),
+    "slow": dict(sizes="1k", concurrency=8, keepAlive=True, putRatio=0.0, slowClients=64),
+}
+
+# Files served per size
+FILES_PER_SIZE = 8
+
+# Seconds between the bytes a slow client sends
+SLOW_CLIENT_DELAY = 0.1
+
+
+def parseSize(size):
+    """
+    Bytes of "512", "64k", "8m" or "1g".
+    """
+    units = {"k": 1024, "m": 1024 ** 2, "g": 1024 ** 3}
+    size = size.strip().lower()
+    if size[-1:] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def parseSizes(sizes):
+    """
+    [(bytes, weight)] of "1k:70,64k:25,1m:5"; weights default to 1.
+    """
+    distribution = []
+    for item in sizes.split(","):
+        size, _, weight = item.partition(":")
+        distribution.append((parseSize(size), float(weight or 1)))
+    return distribution
+
+
+def percentile(latencies, p):
+    """
+    Nearest-rank percentile of sorted latencies.
+    """
+    if not latencies:
+        return 0.0
+    index = min(int(round(p / 100.0 * len(latencies) + 0.5)) - 1, len(latencies) - 1)
+    return latencies[max(index, 0)]
+
+
+def createFiles(www, distribution):
+    """
+    Create FILES_PER_SIZE files of each size. Returns their names by size.
+    """
+    files = {}
+    for size, weight in distribution:
+        files[size] = []
+        for i in range(FILES_PER_SIZE):
+            name = "bench-%d-%d.bin" % (size, i)
+            with open(os.path.join(www, name), "wb") as f:
+                f.write(os.urandom(size))
+            files[size].append(name)
+    return files
+
+
+def runServer(port, www, engine, serverOptions, logLevel):
+    """
+    Server process.
+    """
+    if engine == "async":
+        from HTTP_v1_1.asyncserver import AsyncHTTPServer
+        server = AsyncHTTPServer("127.0.0.1", port, www=www, **serverOptions)
+    else:
+        from HTTP_v1_1.server import HTTPServer
+        server = HTTPServer("127.0.0.1", port, www=www, **serverOptions)
+
+    configureLogging(logLevel)
+    server.start()
+
+
+def freePort():
+    """
+    A currently unused loopback port.
+    """
+    probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    probe.bind(("127.0.0.1", 0))
+    port = probe.getsockname()[1]
+    probe.close()
+    return port
+
+
+def waitForServer(port, timeout=10):
+    """
+    Wait until the server accepts connections.
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except socket.error:
+            time.sleep(0.05)
+    raise RuntimeError("Server did not start on port %d" % port)
+
+
+class LoadClient(threading.Thread):
+    """
+    Sends requests back to back until the deadline, recording the
+    latency of each one.
+    """
+
+    def __init__(self, port, files, distribution, bodies, keepAlive, putRatio, deadline, index):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.files = files
+        self.sizes = [size for size, weight in distribution]
+        self.weights = [weight for size, weight in distribution]
+        self.bodies = bodies
+        self.keepAlive = keepAlive
+        self.putRatio = putRatio
+        self.deadline = deadline
+        self.index = index
+
+        self.latencies = []
+        self.bytes = 0
+        self.errors = 0
+        self.connections = 0
+        self.random = random.Random(index)
+
+        self.sock = None
+        self.buffer = bytearray()
+        self.parser = ResponseParser()
+
+    def run(self):
+        count = 0
+        while time.time() < self.deadline:
+            size = self.random.choices(self.sizes, self.weights)[0]
+            if self.random.random() < self.putRatio:
+                name = "bench-put-%d-%d.bin" % (self.index, count % FILES_PER_SIZE)
+                body = self.bodies[size]
+            else:
+                name = self.random.choice(self.files[size])
+                body = None
+            count += 1
+
+            started = time.time()
+            try:
+                code, transferred = self._request(name, body)
+            except (socket.error, IOError, ValueError):
+                self.errors += 1
+                self._close()
+                continue
+
+            self.latencies.append(time.time() - started)
+            self.bytes += transferred
+            if code >= 400:
+                self.errors += 1
+
+        self._close()
+
+    def _request(self, name, body):
+        """
+        Send a GET (or a PUT of body) and receive the response.
+        Returns the status code and the body bytes transferred.
+        """
+        if self.sock is None:
+            self.sock = socket.create_connection(("127.0.0.1", self.port))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections += 1
+
+        request = "%s /%s HTTP/1.1\r\nHost: 127.0.0.1\r\n" % ("GET" if body is None else "PUT", name)
+        if body is not None:
+            request += "Content-Length: %d\r\n" % len(body)
+        if not self.keepAlive:
+            request += "Connection: close\r\n"
+        self.sock.sendall(request.encode() + b"\r\n")
+        if body is not None:
+            self.sock.sendall(body)
+
+        response = None
+        while response is None:
+            response = self.parser.parse(self.buffer)
+            if response is None:
+                self._recv()
+
+        length = int(response.headers.get("content-length", 0))
+        while len(self.buffer) < length:
+            self._recv()
+        del self.buffer[:length]
+
+        if not self.keepAlive or response.headers.get("connection", "").lower() == "close":
+            self._close()
+        return response.code, length + (len(body) if body is not None else 0)
+
+    def _recv(self):
+        data = self.sock.recv(262144)
+        if not data:
+            raise IOError("Connection closed by the server")
+        self.buffer += data
+
+    def _close(self):
+        if self.sock is not None:
+            self.sock.close()
+        self.sock = None
+        self.buffer = bytearray()
+        self.parser = ResponseParser()
+
+
+class SlowClient(threading.Thread):
+    """
+    Occupies a connection by trickling requests in, one byte every
+    SLOW_CLIENT_DELAY seconds, until the deadline.
+    """
+
+    def __init__(self, port, name, deadline):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.port = port
+        self.request = ("GET /%s HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n" % name).encode()
+        self.deadline = deadline
+
+    def run(self):
+        while time.time() < self.deadline:
+            try:
+                sock = socket.create_connection(("127.0.0.1", self.port))
+                sock.settimeout(max(self.deadline - time.time(), 0.1))
+                for i in range(len(self.request)):
+                    if time.time() >= self.deadline:
+                        break
+                    sock.sendall(self.request[i:i + 1])
+                    time.sleep(SLOW_CLIENT_DELAY)
+                sock.close()
+            except (socket.error, IOError):
+                time.sleep(SLOW_CLIENT_DELAY)
+
+
+def gitCommit():
+    """
+    Commit of the working tree, if it is a git checkout.
+    """
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark(scenario, engine="thread", duration=5.0, warmup=1.0, serverOptions=None,
+              logLevel=logging.CRITICAL, **overrides):
+    """
+    Run a scenario against a freshly started server.
+    Returns the results.
+    """
+    config = dict(SCENARIOS[scenario])
+    config.update((name, value) for name, value in overrides.items() if value is not None)
+    serverOptions = serverOptions or {}
+    distribution = parseSizes(config["sizes"])
+
+    www = tempfile.mkdtemp(prefix="loadbench-")
+    files = createFiles(www, distribution)
+    bodies = dict((size, os.urandom(size)) for size, weight in distribution)
+
+    port = freePort()
+    server = multiprocessing.Process(target=runServer, args=(port, www, engine, serverOptions, logLevel))
+    server.daemon = True
+    server.start()
+
+    try:
+        waitForServer(port)
+
+        # Warm up, then measure
+        for measure in (False, True):
+            deadline = time.time() + (duration if measure else warmup)
+            slowName = files[distribution[0][0]][0]
+            slowClients = [SlowClient(port, slowName, deadline) for i in range(config["slowClients"])]
+            clients = [LoadClient(port, files, distribution, bodies, config["keepAlive"],
+                                  config["putRatio"], deadline, i) for i in range(config["concurrency"])]
+
+            started = time.time()
+            for client in slowClients + clients:
+                client.start()
+            for client in clients:
+                client.join()
+            elapsed = time.time() - started
+            for client in slowClients:
+                client.join()
+    finally:
+        server.terminate()
+        server.join()
+        for name in os.listdir(www):
+            os.remove(os.path.join(www, name))
+        os.rmdir(www)
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    requests = len(latencies)
+    transferred = sum(client.bytes for client in clients)
+    return {"scenario": scenario,
+            "commit": gitCommit(),
+            "engine": engine,
+            "serverOptions": serverOptions,
+            "config": config,
+            "duration": elapsed,
+            "requests": requests,
+            "errors": sum(client.errors for client in clients),
+            "connections": sum(client.connections for client in clients),
+            "requestsPerSecond": requests / elapsed,
+            "throughput": transferred / elapsed,
+            "latency": {"mean": sum(latencies) / requests * 1000 if requests else 0.0,
+                        "p50": percentile(latencies, 50) * 1000,
+                        "p95": percentile(latencies, 95) * 1000,
+                        "p99": percentile(latencies, 99) * 1000,
+                        "p999": percentile(latencies, 99.9) * 1000,
+                        "max": latencies[-1] * 1000 if latencies else 0.0}}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='HTTP server load generator and benchmark suite')
+    parser.add_argument("-s", "--scenario", type=str, nargs="+", default=["small"],
+                        choices=sorted(SCENARIOS) + ["all"],
+                        help="Scenarios to run, default: small")
+    parser.add_argument("-e", "--engine", type=str, default="thread", choices=["thread", "async"],
+                        help="Server engine, default: thread")
+    parser.add_argument("-d", "--duration", type=float, default=5.0,
+                        help="Seconds measured per scenario, after 1s of warm-up, default: 5")
+    parser.add_argument("-c", "--concurrency", type=int,
+                        help="Concurrent clients, default: per scenario")
+    parser.add_argument("-k", "--keep_alive", type=str, choices=["on", "off"],
+                        help="Persistent connections, default: per scenario")
+    parser.add_argument("-u", "--put_ratio", type=float,
+                        help="Share of PUT requests, 0 to 1, default: per scenario")
+    parser.add_argument("-z", "--sizes", type=str,
+                        help="File sizes and weights, e.g. 1k:70,64k:25,1m:5, default: per scenario")
+    parser.add_argument("-l", "--slow_clients", type=int,
+                        help="Connections trickling requests in byte by byte, default: per scenario")
+    parser.add_argument("-n", "--workers", type=int, default=0,
+                        help="Worker pool size of the thread engine, default: 0")
+    parser.add_argument("-m", "--cache_size", type=int, default=0,
+                        help="Server cache size in bytes, default: 0")
+    parser.add_argument("-r", "--max_requests", type=int, default=100000,
+                        help="Maximum requests served per connection, default: 100000")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="Let the server log warnings and errors")
+    parser.add_argument("-o", "--output", type=str,
+                        help="Write the JSON results to this file as well")
+
+    args = parser.parse_args()
+
+    serverOptions = dict(cacheSize=args.cache_size, maxRequests=args.max_requests, capacity=1024)
+    if args.engine == "thread":
+        serverOptions["workers"] = args.workers
+
+    scenarios = sorted(SCENARIOS) if "all" in args.scenario else args.scenario
+    results = []
+    for scenario in scenarios:
+        keepAlive = None if args.keep_alive is None else args.keep_alive == "on"
+        results.append(benchmark(scenario, args.engine, args.duration, serverOptions=serverOptions,
+                                 logLevel=logging.WARNING if args.verbose else logging.CRITICAL,
+                                 concurrency=args.concurrency, keepAlive=keepAlive,
+                                 putRatio=args.put_ratio, sizes=args.sizes,
+                                 slowClients=args.slow_clients))
+        print("%-6s %8.0f req/s %8.1f MB/s  p50 %7.2fms  p99 %7.2fms  errors %d" %
+              (scenario, results[-1]["requestsPerSecond"], results[-1]["throughput"] / 1e6,
+               results[-1]["latency"]["p50"], results[-1]["latency"]["p99"], results[-1]["errors"]),
+              file=sys.stderr)
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
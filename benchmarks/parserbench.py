@@ -0,0 +1,102 @@
+"""
+Microbenchmarks of the HTTP message parsers.
+
+    python benchmarks/parserbench.py [-n <repeat>]
+
+Prints the time per operation of each case, best of repeat runs.
+"""
+import os
+import sys
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+from HTTP_v1_1.parser import RequestParser, ResponseParser, ChunkedDecoder
+
+
+SMALL_REQUEST = b"GET /index.html HTTP/1.1\r\nHost: 127.0.0.1\r\n\r\n"
+
+BROWSER_REQUEST = (b"GET /static/images/logo%20large.png?v=3 HTTP/1.1\r\n"
+                   b"Host: www.example.com\r\n"
+                   b"User-Agent: Mozilla/5.0 (X11; Linux x86_64; rv:109.0) Gecko/20100101 Firefox/115.0\r\n"
+                   b"Accept: image/avif,image/webp,*/*\r\n"
+                   b"Accept-Language: en-US,en;q=0.5\r\n"
+                   b"Accept-Encoding: gzip, deflate, br\r\n"
+                   b"Referer: https://www.example.com/\r\n"
+                   b"Connection: keep-alive\r\n"
+                   b"Cookie: session=8d0f7a3b2c1e4f5a6b7c8d9e0f1a2b3c; theme=dark; lang=en\r\n"
+                   b"If-None-Match: \"4f2a-1c80-5e3b2a1f0c4d8\"\r\n"
+                   b"If-Modified-Since: Tue, 10 Oct 2023 08:00:00 GMT\r\n"
+                   b"Sec-Fetch-Dest: image\r\n"
+                   b"Sec-Fetch-Mode: no-cors\r\n"
+                   b"Sec-Fetch-Site: same-origin\r\n"
+                   b"\r\n")
+
+RESPONSE = (b"HTTP/1.1 200 OK\r\n"
+            b"Date: Tue, 10 Oct 2023 08:00:00 GMT\r\n"
+            b"Server: HTTPServer [127.0.0.1:8080]\r\n"
+            b"Content-Length: 1024\r\n"
+            b"ETag: \"4f2a-400-5e3b2a1f0c4d8\"\r\n"
+            b"Last-Modified: Tue, 10 Oct 2023 08:00:00 GMT\r\n"
+            b"Accept-Ranges: bytes\r\n"
+            b"Connection: keep-alive\r\n"
+            b"Keep-Alive: timeout=15, max=100\r\n"
+            b"\r\n")
+
+CHUNKED_BODY = b"".join(b"2000\r\n" + b"x" * 0x2000 + b"\r\n" for i in range(128)) + b"0\r\n\r\n"
+
+
+def parseWhole(parserClass, message, count=1):
+    """
+    Parse count messages received in a single read.
+    """
+    parser = parserClass()
+    buffer = bytearray(message * count)
+    while parser.parse(buffer) is not None:
+        pass
+
+
+def parseSegments(parserClass, message, segmentSize):
+    """
+    Parse a message received segmentSize bytes per read.
+    """
+    parser = parserClass()
+    buffer = bytearray()
+    for i in range(0, len(message), segmentSize):
+        buffer += message[i:i + segmentSize]
+        if parser.parse(buffer) is not None:
+            return
+
+
+def decodeChunked(body, segmentSize):
+    """
+    Decode a chunked body received segmentSize bytes per read.
+    """
+    decoder = ChunkedDecoder()
+    for i in range(0, len(body), segmentSize):
+        decoder.feed(body[i:i + segmentSize])
+
+
+CASES = [
+    ("small request", lambda: parseWhole(RequestParser, SMALL_REQUEST)),
+    ("browser request", lambda: parseWhole(RequestParser, BROWSER_REQUEST)),
+    ("10 pipelined browser requests", lambda: parseWhole(RequestParser, BROWSER_REQUEST, 10)),
+    ("browser request, 64-byte reads", lambda: parseSegments(RequestParser, BROWSER_REQUEST, 64)),
+    ("browser request, 1-byte reads", lambda: parseSegments(RequestParser, BROWSER_REQUEST, 1)),
+    ("response", lambda: parseWhole(ResponseParser, RESPONSE)),
+    ("1 MiB chunked body, 64 KiB reads", lambda: decodeChunked(CHUNKED_BODY, 65536)),
+]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='HTTP parser microbenchmarks')
+    parser.add_argument("-n", "--repeat", type=int, default=5,
+                        help="Runs per case, the best one is reported, default: 5")
+    args = parser.parse_args()
+
+    for name, case in CASES:
+        # Scale the loop count so that a run takes about 0.2s
+        number, elapsed = timeit.Timer(case).autorange()
+        best = min(timeit.repeat(case, number=number, repeat=args.repeat))
+        print("%-36s %10.2f us" % (name, best / number * 1e6))
@@ -0,0 +1,99 @@
+"""
+Fixtures starting servers of both engines for the tests.
+"""
+import sys
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+# Tests import HTTP_v1_1 from the repository, however pytest is run
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HTTP_v1_1.server import HTTPServer
+from HTTP_v1_1.asyncserver import AsyncHTTPServer
+
+
+ENGINES = {"thread": HTTPServer, "async": AsyncHTTPServer}
+
+INDEX = b"<html><body><p>Hello!</p></body></html>"
+
+
+class Server(object):
+    """
+    A running server and its web server directory.
+    """
+
+    def __init__(self, httpServer, www, port):
+        self.httpServer = httpServer
+        self.www = www
+        self.port = port
+
+    def path(self, name):
+        return os.path.join(self.www, name)
+
+
+def freePort():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _serve(httpServer):
+    try:
+        httpServer.start()
+    except OSError:
+        # The listening socket is shut down by stop()
+        pass
+
+
+@pytest.fixture(params=sorted(ENGINES))
+def engine(request):
+    return request.param
+
+
+@pytest.fixture
+def serve(engine, tmp_path):
+    """
+    Returns a function starting a server of the engine under test,
+    with the given server options, on a web server directory holding
+    index.html. Servers are stopped after the test.
+    """
+    servers = []
+
+    def start(**options):
+        www = tmp_path / ("www%d" % len(servers))
+        www.mkdir()
+        (www / "index.html").write_bytes(INDEX)
+
+        options.setdefault("compression", False)
+        options.setdefault("shutdownTimeout", 1)
+        port = freePort()
+        httpServer = ENGINES[engine]("127.0.0.1", port, www=str(www), **options)
+        threading.Thread(target=_serve, args=(httpServer,), daemon=True).start()
+
+        deadline = time.time() + 5
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.02)
+
+        server = Server(httpServer, str(www), port)
+        servers.append(server)
+        return server
+
+    yield start
+
+    for server in servers:
+        server.httpServer.stop()
+
+
+@pytest.fixture
+def server(serve):
+    return serve()
@@ -0,0 +1,188 @@
+"""
+Tests of the clients against both server engines.
+"""
+import os
+import asyncio
+
+import pytest
+
+from HTTP_v1_1.client import HTTPClient, AsyncHTTPClient, RequestError
+from HTTP_v1_1.transfer import BulkTransfer
+
+
+def client(server, directory):
+    httpClient = HTTPClient("127.0.0.1", 0, str(directory))
+    httpClient.connect("127.0.0.1", server.port)
+    return httpClient
+
+
+def testGetRangesSkipsUnchangedFile(server, tmp_path):
+    data = os.urandom(64 * 1024)
+    with open(server.path("big.bin"), "wb") as f:
+        f.write(data)
+    directory = tmp_path / "client"
+    directory.mkdir()
+
+    httpClient = client(server, directory)
+    httpClient.minRangeSize = 1024
+    try:
+        assert httpClient.getRanges("GET", "big.bin", connections=4) == 200
+        assert (directory / "big.bin").read_bytes() == data
+
+        transferred = httpClient.bytesTransferred
+        assert httpClient.getRanges("GET", "big.bin", connections=4) == 304
+        assert httpClient.bytesTransferred == transferred
+
+        # Also without validators, by digest
+        os.remove(httpClient._validatorsFile(str(directory / "big.bin")))
+        assert httpClient.getRanges("GET", "big.bin", connections=4) == 304
+        assert httpClient.bytesTransferred == transferred
+    finally:
+        httpClient.close()
+
+
+def testGetRestartsUnusablePartInRelativeDirectory(server, tmp_path, monkeypatch):
+    with open(server.path("a.txt"), "wb") as f:
+        f.write(b"abc")
+    monkeypatch.chdir(tmp_path)
+    os.mkdir("cl")
+
+    httpClient = client(server, "cl")
+    try:
+        # A part larger than the file, of the version on the server
+        assert httpClient.getRanges("GET", "a.txt") == 200
+        etag = httpClient._loadValidators(os.path.join("cl", "a.txt"))["etag"]
+        os.remove(os.path.join("cl", "a.txt"))
+        partFile = httpClient._partFile(os.path.join("cl", "a.txt"))
+        with open(partFile, "wb") as f:
+            f.write(b"x" * 100)
+        httpClient._saveValidators(partFile, {"etag": etag})
+
+        assert httpClient.get("GET", "a.txt") == 200
+        with open(os.path.join("cl", "a.txt"), "rb") as f:
+            assert f.read() == b"abc"
+        assert not os.path.exists(partFile)
+    finally:
+        httpClient.close()
+
+
+def testAsyncClientPipelinesOnFewConnections(serve, tmp_path):
+    server = serve(maxRequests=10)
+    files = {"f%d.txt" % i: os.urandom(i * 101) for i in range(60)}
+    for name, data in files.items():
+        with open(server.path(name), "wb") as f:
+            f.write(data)
+    directory = tmp_path / "client"
+    directory.mkdir()
+
+    async def fetch():
+        httpClient = AsyncHTTPClient(clientDirectory=str(directory), maxConnections=2, pipeline=8)
+        try:
+            codes = await asyncio.gather(*[httpClient.get("127.0.0.1", server.port, name) for name in files])
+            assert len(sum(httpClient.connections.values(), [])) <= 2
+            return codes
+        finally:
+            httpClient.close()
+
+    assert asyncio.run(fetch()) == [200] * len(files)
+    for name, data in files.items():
+        assert (directory / name).read_bytes() == data
+    # Unchanged files are not downloaded again
+    assert asyncio.run(fetch()) == [304] * len(files)
+
+
+def testAsyncClientPutAndMissingFile(server, tmp_path):
+    directory = tmp_path / "client"
+    directory.mkdir()
+    data = os.urandom(HTTPClient.resumeThreshold + 12345)
+    (directory / "up.bin").write_bytes(data)
+
+    async def transfer():
+        httpClient = AsyncHTTPClient(clientDirectory=str(directory))
+        try:
+            assert await httpClient.put("127.0.0.1", server.port, "up.bin") == 200
+            assert await httpClient.get("127.0.0.1", server.port, "nope.txt") == 404
+        finally:
+            httpClient.close()
+
+    asyncio.run(transfer())
+    with open(server.path("up.bin"), "rb") as f:
+        assert f.read() == data
+    assert not (directory / "nope.txt").exists()
+
+
+def testBulkTransferAsyncEngine(server, tmp_path):
+    directory = tmp_path / "client"
+    directory.mkdir()
+    for i in range(20):
+        (directory / ("u%d.txt" % i)).write_bytes(b"%d" % i * 1000)
+
+    transfer = BulkTransfer("127.0.0.1", server.port, clientDirectory=str(directory),
+                            concurrency=50, connections=2, engine="async")
+    report = transfer.upload()
+    assert report["completed"] == 20
+    assert report["failed"] == []
+    for i in range(20):
+        with open(server.path("u%d.txt" % i), "rb") as f:
+            assert f.read() == b"%d" % i * 1000
+
+    report = transfer.run([("GET", "nope.txt")])
+    assert report["completed"] == 0
+    assert report["failed"][0][1] == "nope.txt"
+
+
+def testGetRejectsFileNotMatchingItsDigest(server, tmp_path):
+    with open(server.path("a.bin"), "wb") as f:
+        f.write(b"abc")
+    # The server believes a.bin to be something else
+    server.httpServer.digests.put(server.path("a.bin"), os.stat(server.path("a.bin")), b"x" * 32)
+    directory = tmp_path / "client"
+    directory.mkdir()
+
+    httpClient = client(server, directory)
+    try:
+        with pytest.raises(RequestError):
+            httpClient.get("GET", "a.bin")
+    finally:
+        httpClient.close()
+    assert os.listdir(str(directory)) == []
+
+    async def fetch():
+        httpClient = AsyncHTTPClient(clientDirectory=str(directory))
+        try:
+            with pytest.raises(RequestError):
+                await httpClient.get("127.0.0.1", server.port, "a.bin")
+        finally:
+            httpClient.close()
+
+    asyncio.run(fetch())
+    assert os.listdir(str(directory)) == []
+
+
+def testPutSkipsFileTheServerHas(server, tmp_path):
+    directory = tmp_path / "client"
+    directory.mkdir()
+    data = os.urandom(HTTPClient.skipThreshold)
+    (directory / "same.bin").write_bytes(data)
+
+    httpClient = client(server, directory)
+    try:
+        assert httpClient.put("PUT", "same.bin") == 200
+        transferred = httpClient.bytesTransferred
+        assert httpClient.put("PUT", "same.bin") == 304
+        assert httpClient.bytesTransferred == transferred
+    finally:
+        httpClient.close()
+
+    async def transfer():
+        httpClient = AsyncHTTPClient(clientDirectory=str(directory))
+        try:
+            assert await httpClient.put("127.0.0.1", server.port, "same.bin") == 304
+            (directory / "same.bin").write_bytes(data[::-1])
+            assert await httpClient.put("127.0.0.1", server.port, "same.bin") == 200
+        finally:
+            httpClient.close()
+
+    asyncio.run(transfer())
+    with open(server.path("same.bin"), "rb") as f:
+        assert f.read() == data[::-1]
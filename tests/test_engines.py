@@ -0,0 +1,463 @@
+"""
+Behavioural tests run against both server engines, HTTPServer (a thread
+per connection or a worker pool) and AsyncHTTPServer (an event loop).
+The server is driven over raw sockets, so that framing, pipelining and
+connection handling are checked on the wire.
+"""
+import os
+import gzip
+import socket
+import hashlib
+import time
+
+import pytest
+
+from HTTP_v1_1.parser import ResponseParser, ChunkedDecoder
+from HTTP_v1_1.digest import formatDigest
+
+from conftest import INDEX
+
+
+def connect(server, timeout=10):
+    return socket.create_connection(("127.0.0.1", server.port), timeout=timeout)
+
+
+def recvAll(connection):
+    """
+    Returns everything received until the server closes the connection.
+    """
+    data = b""
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            return data
+        data += chunk
+
+
+def exchange(server, data):
+    """
+    Send raw request bytes, returns the raw bytes of all responses,
+    received until the server closes the connection.
+    """
+    with connect(server) as connection:
+        connection.sendall(data)
+        return recvAll(connection)
+
+
+def parseResponses(data, heads=()):
+    """
+    Returns the (response, body) pairs in the raw bytes of responses.
+    heads lists the positions of the responses to HEAD requests.
+    """
+    buffer = bytearray(data)
+    parser = ResponseParser()
+    responses = []
+    while buffer:
+        response = parser.parse(buffer)
+        assert response is not None, "incomplete response head: %r" % bytes(buffer)
+
+        if len(responses) in heads or response.code in (204, 304):
+            body = b""
+        elif response.headers.get("transfer-encoding") == "chunked":
+            decoder = ChunkedDecoder()
+            body = decoder.feed(bytes(buffer))
+            assert decoder.done
+            buffer = bytearray(decoder.unused)
+        else:
+            length = int(response.headers["content-length"])
+            assert len(buffer) >= length, "truncated body"
+            body = bytes(buffer[:length])
+            del buffer[:length]
+        responses.append((response, body))
+    return responses
+
+
+def request(server, method, target, headers=(), body=b"", version="HTTP/1.1"):
+    """
+    Send a single request on a connection of its own.
+    Returns the response and its body.
+    """
+    head = "%s %s %s\r\nHost: localhost\r\n" % (method, target, version)
+    head += "".join("%s: %s\r\n" % header for header in headers)
+    if body:
+        head += "Content-Length: %d\r\n" % len(body)
+    if version == "HTTP/1.1":
+        head += "Connection: close\r\n"
+    responses = parseResponses(exchange(server, head.encode() + b"\r\n" + body),
+                               heads=(0,) if method == "HEAD" else ())
+    assert len(responses) == 1
+    return responses[0]
+
+
+def testGetServesFileWithContentLength(server):
+    response, body = request(server, "GET", "/index.html")
+    assert response.code == 200
+    assert response.headers["content-length"] == str(len(INDEX))
+    assert body == INDEX
+
+
+def testGetRootServesIndex(server):
+    response, body = request(server, "GET", "/")
+    assert response.code == 200
+    assert body == INDEX
+
+
+def testHeadSendsHeadersOnly(server):
+    with connect(server) as connection:
+        connection.sendall(b"HEAD /index.html HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+        data = recvAll(connection)
+    head, _, body = data.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200")
+    assert b"Content-Length: %d" % len(INDEX) in head
+    assert body == b""
+
+
+def testMissingFileIs404(server):
+    response, body = request(server, "GET", "/nope.html")
+    assert response.code == 404
+    assert len(body) == int(response.headers["content-length"])
+
+
+def testPutWithContentLength(server):
+    data = os.urandom(300000)
+    response, _ = request(server, "PUT", "/upload.bin", body=data)
+    assert response.code == 200
+    with open(server.path("upload.bin"), "rb") as f:
+        assert f.read() == data
+
+    response, body = request(server, "GET", "/upload.bin")
+    assert body == data
+
+
+def testPutChunked(server):
+    data = (b"a" * 20, b"b" * 70000)
+    encoded = b"".join(b"%x\r\n%s\r\n" % (len(chunk), chunk) for chunk in data) + b"0\r\n\r\n"
+    response, _ = parseResponses(exchange(server, b"PUT /chunked.txt HTTP/1.1\r\nHost: x\r\n"
+                                                  b"Transfer-Encoding: chunked\r\n"
+                                                  b"Connection: close\r\n\r\n" + encoded))[0]
+    assert response.code == 200
+    with open(server.path("chunked.txt"), "rb") as f:
+        assert f.read() == b"".join(data)
+
+
+def testPutWithoutLengthIs411(server):
+    data = exchange(server, b"PUT /x.txt HTTP/1.1\r\nHost: x\r\n\r\n")
+    assert data.startswith(b"HTTP/1.1 411")
+    assert not os.path.exists(server.path("x.txt"))
+
+
+def testPutFailingToWriteIs500(server):
+    response, body = request(server, "PUT", "/nodir/x.txt", body=b"abc")
+    assert response.code == 500
+    assert len(body) == int(response.headers["content-length"])
+
+
+def testUnknownMethodIs501(server):
+    data = exchange(server, b"DELETE /index.html HTTP/1.1\r\nHost: x\r\n\r\n")
+    assert data.startswith(b"HTTP/1.1 501")
+    assert b"Connection: close" in data
+
+
+def testMalformedRequestIs400(server):
+    data = exchange(server, b"GET /index.html\r\nHost: x\r\n\r\n")
+    assert data.startswith(b"HTTP/1.1 400")
+
+
+def testPipelinedRequestsAnsweredInOrder(server):
+    data = exchange(server, b"GET /index.html HTTP/1.1\r\nHost: x\r\n\r\n"
+                            b"GET /nope HTTP/1.1\r\nHost: x\r\n\r\n"
+                            b"PUT /p.txt HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\n\r\nabc"
+                            b"HEAD /p.txt HTTP/1.1\r\nHost: x\r\n\r\n"
+                            b"GET /p.txt HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n")
+    responses = parseResponses(data, heads=(3,))
+    assert [response.code for response, _ in responses] == [200, 404, 200, 200, 200]
+    assert responses[0][1] == INDEX
+    assert responses[4][1] == b"abc"
+    assert responses[4][0].headers["connection"] == "close"
+
+
+def testKeepAliveServesSequentialRequests(server):
+    with connect(server) as connection:
+        for i in range(3):
+            connection.sendall(b"GET /index.html HTTP/1.1\r\nHost: x\r\n\r\n")
+            buffer = bytearray()
+            parser = ResponseParser()
+            response = None
+            while response is None:
+                buffer += connection.recv(65536)
+                response = parser.parse(buffer)
+            assert response.code == 200
+            assert response.headers["connection"] == "keep-alive"
+            while len(buffer) < len(INDEX):
+                buffer += connection.recv(65536)
+            assert bytes(buffer) == INDEX
+
+
+def testConnectionCloseClosesAfterResponse(server):
+    with connect(server) as connection:
+        connection.sendall(b"GET /index.html HTTP/1.1\r\nHost: x\r\nConnection: close\r\n\r\n"
+                           b"GET /index.html HTTP/1.1\r\nHost: x\r\n\r\n")
+        responses = parseResponses(recvAll(connection))
+    assert len(responses) == 1
+
+
+def testHTTP10ClosesByDefault(server):
+    with connect(server) as connection:
+        connection.sendall(b"GET /index.html HTTP/1.0\r\n\r\n")
+        responses = parseResponses(recvAll(connection))
+    assert len(responses) == 1
+    assert responses[0][0].headers["connection"] == "close"
+
+
+def testMaxRequestsClosesConnection(serve):
+    server = serve(maxRequests=2)
+    data = exchange(server, b"GET / HTTP/1.1\r\nHost: x\r\n\r\n" * 3)
+    assert len(parseResponses(data)) == 2
+
+
+def testIdleConnectionClosedAfterKeepAliveTimeout(serve):
+    server = serve(keepAliveTimeout=1)
+    with connect(server) as connection:
+        started = time.time()
+        assert connection.recv(1) == b""
+    assert 0.5 < time.time() - started < 5
+
+
+def testGetWithBodyIsNotPipelined(server):
+    data = exchange(server, b"GET /index.html HTTP/1.1\r\nHost: x\r\nContent-Length: 39\r\n\r\n"
+                            b"GET /nope HTTP/1.1\r\nHost: x\r\n\r\n")
+    responses = parseResponses(data)
+    assert [response.code for response, _ in responses] == [200]
+    assert responses[0][0].headers["connection"] == "close"
+
+
+def testRangeRequest(server):
+    response, body = request(server, "GET", "/index.html", headers=[("Range", "bytes=6-11")])
+    assert response.code == 206
+    assert response.headers["content-range"] == "bytes 6-11/%d" % len(INDEX)
+    assert body == INDEX[6:12]
+
+
+def testUnsatisfiableRangeIs416(server):
+    response, _ = request(server, "GET", "/index.html", headers=[("Range", "bytes=1000-")])
+    assert response.code == 416
+    assert response.headers["content-range"] == "bytes */%d" % len(INDEX)
+
+
+def testIfNoneMatchIs304(server):
+    response, _ = request(server, "GET", "/index.html")
+    etag = response.headers["etag"]
+    response, body = request(server, "GET", "/index.html", headers=[("If-None-Match", etag)])
+    assert response.code == 304
+    assert body == b""
+
+
+def testOversizedPutIs413(serve):
+    server = serve(maxBodySize=10)
+    response, _ = request(server, "PUT", "/big.txt", body=b"x" * 11)
+    assert response.code == 413
+    assert not os.path.exists(server.path("big.txt"))
+
+
+def testSlowRequestHeadIsDropped(serve):
+    server = serve(headerTimeout=1)
+    with connect(server) as connection:
+        started = time.time()
+        connection.sendall(b"GET /index.html HTTP/1.1\r\n")
+        try:
+            data = connection.recv(1)
+        except ConnectionResetError:
+            data = b""
+    assert data == b""
+    assert time.time() - started < 5
+
+    # Other clients are still served
+    response, body = request(server, "GET", "/index.html")
+    assert body == INDEX
+
+
+def testGzipNegotiated(serve):
+    server = serve(compression=True)
+    text = b"<p>compress me</p>\n" * 500
+    with open(server.path("page.html"), "wb") as f:
+        f.write(text)
+
+    response, body = request(server, "GET", "/page.html", headers=[("Accept-Encoding", "gzip")])
+    assert response.code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert gzip.decompress(body) == text
+
+    response, body = request(server, "GET", "/page.html")
+    assert "content-encoding" not in response.headers
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert body == text
+
+
+def testCacheHitsStayOffTheFilesystem(serve, monkeypatch):
+    server = serve(compression=True, cacheSize=1024 * 1024)
+    with open(server.path("page.html"), "wb") as f:
+        f.write(b"<p>compress me</p>\n" * 500)
+    headers = [("Accept-Encoding", "gzip")]
+    request(server, "GET", "/page.html", headers=headers)
+    request(server, "GET", "/page.html")
+    request(server, "GET", "/index.html", headers=headers)
+
+    stats = []
+    monkeypatch.setattr(os, "stat", lambda path, *args, **kwargs: stats.append(path))
+    for target in ("/page.html", "/index.html"):
+        for headers in ([], [("Accept-Encoding", "gzip")]):
+            response, _ = request(server, "GET", target, headers=headers)
+            assert response.code == 200
+    assert stats == []
+
+
+def outsideFile(server):
+    """
+    Creates a file next to the web server directory, returns its path.
+    """
+    path = os.path.join(os.path.dirname(server.www), "secret.txt")
+    with open(path, "wb") as f:
+        f.write(b"secret")
+    return path
+
+
+@pytest.mark.parametrize("target", [
+    "/../secret.txt",
+    "/a/../../secret.txt",
+    "/%2e%2e/secret.txt",
+    "/%2E%2E%2Fsecret.txt",
+    "/..%5csecret.txt",
+])
+def testTraversalIs404(server, target):
+    outsideFile(server)
+    response, body = request(server, "GET", target)
+    assert response.code == 404
+    assert b"secret" not in body
+
+
+def testAbsolutePathStaysInWebServerDirectory(server):
+    path = outsideFile(server)
+    response, _ = request(server, "GET", "/" + path)
+    assert response.code == 404
+
+
+def testSymbolicLinkOutOfWebServerDirectoryIs404(server):
+    os.symlink(outsideFile(server), server.path("link.txt"))
+    response, body = request(server, "GET", "/link.txt")
+    assert response.code == 404
+    assert b"secret" not in body
+
+
+def testPutOutOfWebServerDirectoryIs404(server):
+    response, _ = request(server, "PUT", "/../evil.txt", body=b"evil")
+    assert response.code == 404
+    assert not os.path.exists(os.path.join(os.path.dirname(server.www), "evil.txt"))
+    assert os.listdir(os.path.dirname(server.www)) == [os.path.basename(server.www)]
+
+
+def testDotSegmentsInsideWebServerDirectory(server):
+    response, body = request(server, "GET", "/a/./../index.html")
+    assert response.code == 200
+    assert body == INDEX
+
+
+def testDirectoryServesItsIndex(server):
+    os.mkdir(server.path("sub"))
+    with open(server.path(os.path.join("sub", "index.html")), "wb") as f:
+        f.write(b"sub index")
+    for target in ("/sub", "/sub/"):
+        response, body = request(server, "GET", target)
+        assert response.code == 200
+        assert body == b"sub index"
+
+
+def testContentType(server):
+    with open(server.path("data.json"), "wb") as f:
+        f.write(b"{}")
+    with open(server.path("blob"), "wb") as f:
+        f.write(b"?")
+    assert request(server, "GET", "/index.html")[0].headers["content-type"] == "text/html"
+    assert request(server, "GET", "/data.json")[0].headers["content-type"] == "application/json"
+    assert request(server, "GET", "/blob")[0].headers["content-type"] == "application/octet-stream"
+
+
+def testMissingFileLookupsAreCached(server, monkeypatch):
+    request(server, "GET", "/nope.html")
+
+    calls = []
+    monkeypatch.setattr(os, "stat", lambda path, *args, **kwargs: calls.append(path))
+    monkeypatch.setattr("builtins.open", lambda path, *args, **kwargs: calls.append(path))
+    for i in range(3):
+        response, _ = request(server, "GET", "/nope.html")
+        assert response.code == 404
+    assert calls == []
+
+
+def testPutOverMissingFileIsServed(server):
+    assert request(server, "GET", "/new.txt")[0].code == 404
+    assert request(server, "PUT", "/new.txt", body=b"new")[0].code == 200
+    response, body = request(server, "GET", "/new.txt")
+    assert response.code == 200
+    assert body == b"new"
+
+
+def sha256(data):
+    return formatDigest(hashlib.sha256(data).digest())
+
+
+def testGetSendsReprDigest(server):
+    response, _ = request(server, "GET", "/index.html")
+    assert response.headers["repr-digest"] == sha256(INDEX)
+    # Of the whole file, also for ranges
+    response, _ = request(server, "GET", "/index.html", headers=[("Range", "bytes=6-11")])
+    assert response.headers["repr-digest"] == sha256(INDEX)
+    response, _ = request(server, "HEAD", "/index.html", headers=[("Want-Repr-Digest", "sha-256=10")])
+    assert response.headers["repr-digest"] == sha256(INDEX)
+
+
+def testPutDigestIsCheckedAndKept(server):
+    data = os.urandom(100000)
+    response, _ = request(server, "PUT", "/up.bin", headers=[("Repr-Digest", sha256(data))], body=data)
+    assert response.code == 200
+    assert response.headers["repr-digest"] == sha256(data)
+
+    # The digest of the uploaded file is not computed again
+    digests = server.httpServer.digests
+    hits = digests.hits
+    response, body = request(server, "GET", "/up.bin")
+    assert body == data
+    assert response.headers["repr-digest"] == sha256(data)
+    assert digests.hits == hits + 1
+
+
+@pytest.mark.parametrize("header", ["Repr-Digest", "Content-Digest", "Digest"])
+def testPutWithMismatchedDigestIs400(server, header):
+    value = sha256(b"other") if header != "Digest" else "SHA-256=" + sha256(b"other")[9:-1]
+    response, _ = request(server, "PUT", "/index.html", headers=[(header, value)], body=b"corrupted")
+    assert response.code == 400
+    with open(server.path("index.html"), "rb") as f:
+        assert f.read() == INDEX
+    assert sorted(os.listdir(server.www)) == ["index.html"]
+
+
+def testPartialPutWithMismatchedDigest(server):
+    data = b"0123456789"
+    response, _ = request(server, "PUT", "/part.txt", body=data[:5],
+                          headers=[("Content-Range", "bytes 0-4/10"), ("Content-Digest", sha256(b"xxxxx"))])
+    assert response.code == 400
+    # The corrupted range is dropped
+    response, _ = request(server, "PUT", "/part.txt", headers=[("Content-Range", "bytes */10"),
+                                                              ("Content-Length", "0")])
+    assert response.code == 202
+    assert "range" not in response.headers
+
+    headers = [("Repr-Digest", sha256(b"01234abcde"))]
+    response, _ = request(server, "PUT", "/part.txt", body=data[:5],
+                          headers=headers + [("Content-Range", "bytes 0-4/10")])
+    assert response.code == 202
+    response, _ = request(server, "PUT", "/part.txt", body=data[5:],
+                          headers=headers + [("Content-Range", "bytes 5-9/10")])
+    assert response.code == 400
+    assert not os.path.exists(server.path("part.txt"))
+    assert sorted(os.listdir(server.www)) == ["index.html"]
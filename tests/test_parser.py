@@ -0,0 +1,206 @@
+"""
+Unit tests of the incremental message parser.
+"""
+import pytest
+
+from HTTP_v1_1.parser import RequestParser, ResponseParser, ChunkedDecoder, ParseError
+
+
+def parse(data):
+    """
+    Returns the request parsed from data and the bytes left in the buffer.
+    """
+    buffer = bytearray(data)
+    return RequestParser().parse(buffer), bytes(buffer)
+
+
+def parseError(data):
+    """
+    Returns the code of the ParseError raised parsing data.
+    """
+    with pytest.raises(ParseError) as error:
+        parse(data)
+    return error.value.code
+
+
+def testRequestLineAndHeaders():
+    request, rest = parse(b"GET /dir/a%20b.html?x=1%202 HTTP/1.1\r\n"
+                          b"Host: example.com\r\n"
+                          b"Accept-Encoding:  gzip \t\r\n"
+                          b"X-Tag: a\r\n"
+                          b"x-tag: b\r\n\r\n")
+    assert (request.method, request.target, request.version) == \
+        ("GET", "/dir/a%20b.html?x=1%202", "HTTP/1.1")
+    assert request.path == "/dir/a b.html"
+    assert request.query == "x=1%202"
+    assert request.headers == {"host": "example.com", "accept-encoding": "gzip", "x-tag": "a, b"}
+    assert rest == b""
+
+
+def testAbsoluteFormTarget():
+    request, _ = parse(b"GET http://example.com/a.txt?q HTTP/1.1\r\nHost: example.com\r\n\r\n")
+    assert request.path == "/a.txt"
+    assert request.query == "q"
+
+
+def testPartialReads():
+    data = b"PUT /a.txt HTTP/1.1\r\nHost: x\r\nContent-Length: 5\r\n\r\nhello"
+    parser = RequestParser()
+    buffer = bytearray()
+    head = data.index(b"\r\n\r\n") + 4
+    for i in range(head - 1):
+        buffer += data[i:i + 1]
+        assert parser.parse(buffer) is None
+
+    buffer += data[head - 1:]
+    request = parser.parse(buffer)
+    assert request.headers["content-length"] == "5"
+    # The body is left for the caller
+    assert bytes(buffer) == b"hello"
+
+
+def testPipelinedRequests():
+    buffer = bytearray(b"GET /a HTTP/1.1\r\nHost: x\r\n\r\n\r\nGET /b HTTP/1.1\r\nHost: x\r\n\r\nGET /c")
+    parser = RequestParser()
+    assert parser.parse(buffer).path == "/a"
+    assert parser.parse(buffer).path == "/b"
+    assert parser.parse(buffer) is None
+    assert bytes(buffer) == b"GET /c"
+
+
+def testBareLineFeeds():
+    request, _ = parse(b"GET / HTTP/1.1\nHost: x\n\n")
+    assert request.headers == {"host": "x"}
+
+
+def testHTTP10WithoutHost():
+    request, _ = parse(b"GET / HTTP/1.0\r\n\r\n")
+    assert request.version == "HTTP/1.0"
+
+
+def testRepeatedEqualContentLength():
+    request, _ = parse(b"PUT / HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\nContent-Length: 3\r\n\r\n")
+    assert request.headers["content-length"] == "3"
+
+
+@pytest.mark.parametrize("data", [
+    # Conflicting or invalid Content-Length
+    b"PUT / HTTP/1.1\r\nHost: x\r\nContent-Length: 3\r\nContent-Length: 4\r\n\r\n",
+    b"PUT / HTTP/1.1\r\nHost: x\r\nContent-Length: -1\r\n\r\n",
+    b"PUT / HTTP/1.1\r\nHost: x\r\nContent-Length: 1, 1\r\n\r\n",
+    # Obsolete line folding
+    b"GET / HTTP/1.1\r\nHost: x\r\nX-Long: a\r\n  b\r\n\r\n",
+    # Bare CR and NUL
+    b"GET / HTTP/1.1\r\nHost: x\rX-Evil: 1\r\n\r\n",
+    b"GET / HTTP/1.1\r\nHost: x\0\r\n\r\n",
+    # Whitespace before the colon
+    b"GET / HTTP/1.1\r\nHost : x\r\n\r\n",
+    # Malformed request lines and targets
+    b"GET /\r\nHost: x\r\n\r\n",
+    b"GET  / HTTP/1.1\r\nHost: x\r\n\r\n",
+    b"G(T / HTTP/1.1\r\nHost: x\r\n\r\n",
+    b"GET / HTTP/x\r\nHost: x\r\n\r\n",
+    b"GET a.txt HTTP/1.1\r\nHost: x\r\n\r\n",
+    b"GET /%ff HTTP/1.1\r\nHost: x\r\n\r\n",
+    b"GET /a%00 HTTP/1.1\r\nHost: x\r\n\r\n",
+    b"GET /\xe9 HTTP/1.1\r\nHost: x\r\n\r\n",
+    # Missing or repeated Host
+    b"GET / HTTP/1.1\r\n\r\n",
+    b"GET / HTTP/1.1\r\nHost: x\r\nHost: y\r\n\r\n",
+])
+def testMalformedRequestIs400(data):
+    assert parseError(data) == 400
+
+
+def testUnsupportedVersionIs505():
+    assert parseError(b"GET / HTTP/2.0\r\nHost: x\r\n\r\n") == 505
+
+
+def testLongRequestLineIs414():
+    target = b"/" + b"a" * RequestParser.maxLineSize
+    assert parseError(b"GET " + target + b" HTTP/1.1\r\nHost: x\r\n\r\n") == 414
+    # Rejected before the line is complete
+    assert parseError(b"GET " + target) == 414
+
+
+def testLargeHeadIs431():
+    field = b"X-Big: " + b"a" * 4000 + b"\r\n"
+    count = RequestParser.maxHeadSize // len(field) + 1
+    assert parseError(b"GET / HTTP/1.1\r\nHost: x\r\n" + field * count) == 431
+    assert parseError(b"GET / HTTP/1.1\r\nHost: x\r\n" + field * count + b"\r\n") == 431
+
+
+def testTooManyHeadersIs431():
+    fields = b"".join(b"X-%d: 1\r\n" % i for i in range(RequestParser.maxHeaders + 1))
+    assert parseError(b"GET / HTTP/1.1\r\nHost: x\r\n" + fields + b"\r\n") == 431
+
+
+def testResponseParser():
+    buffer = bytearray(b"HTTP/1.1 404 Not Found\r\nContent-Length: 2\r\n\r\nno")
+    response = ResponseParser().parse(buffer)
+    assert (response.version, response.code, response.reason) == ("HTTP/1.1", 404, "Not Found")
+    assert response.headers == {"content-length": "2"}
+    assert bytes(buffer) == b"no"
+
+
+def testMalformedStatusLine():
+    with pytest.raises(ParseError):
+        ResponseParser().parse(bytearray(b"HTTP/1.1 2000 OK\r\n\r\n"))
+
+
+def decode(pieces):
+    decoder = ChunkedDecoder()
+    body = b"".join(decoder.feed(piece) for piece in pieces)
+    return decoder, body
+
+
+def testChunkedBody():
+    data = b"5\r\nhello\r\n7;name=value\r\n, world\r\n0\r\nTrailer: 1\r\n\r\n"
+    decoder, body = decode([data])
+    assert decoder.done
+    assert body == b"hello, world"
+    assert decoder.unused == b""
+
+
+def testChunkedBodyFedByteByByte():
+    data = b"5\r\nhello\r\n10\r\n" + b"x" * 16 + b"\r\n0\r\n\r\n"
+    decoder, body = decode([data[i:i + 1] for i in range(len(data))])
+    assert decoder.done
+    assert body == b"hello" + b"x" * 16
+
+
+def testChunkedBodyHandsBackPipelinedData():
+    decoder, body = decode([b"3\r\nabc\r\n0\r\n", b"\r\nGET / HTTP/1.1\r\n"])
+    assert body == b"abc"
+    assert decoder.done
+    assert decoder.unused == b"GET / HTTP/1.1\r\n"
+
+
+def testChunkedBodyStopsAtItsEnd():
+    decoder, body = decode([b"0\r\n\r\n3\r\nabc\r\n"])
+    assert body == b""
+    assert decoder.unused == b"3\r\nabc\r\n"
+
+
+@pytest.mark.parametrize("data", [
+    b"x\r\n",
+    b"-1\r\n",
+    b"\r\n",
+    b"11111111111111111\r\n",
+    b"3\r\nabcd\r\n",
+])
+def testMalformedChunkedBody(data):
+    with pytest.raises(ParseError) as error:
+        decode([data])
+    assert error.value.code == 400
+
+
+def testOversizedChunkSizeLine():
+    decoder = ChunkedDecoder()
+    with pytest.raises(ParseError):
+        decoder.feed(b"1;" + b"x" * ChunkedDecoder.maxLineSize)
+    # Also when the line arrives in pieces
+    decoder = ChunkedDecoder()
+    with pytest.raises(ParseError):
+        for i in range(ChunkedDecoder.maxLineSize // 512 + 2):
+            decoder.feed(b";" + b"x" * 511)
@@ -0,0 +1,49 @@
+"""
+Unit tests of the request path resolver.
+"""
+import os
+
+import pytest
+
+from HTTP_v1_1.resolver import PathResolver
+
+
+@pytest.mark.parametrize("requestPath, name", [
+    ("/", ""),
+    ("/a/b.txt", "a/b.txt"),
+    ("//a//./b.txt", "a/b.txt"),
+    ("/a/../b.txt", "b.txt"),
+    ("/a/b/../../", ""),
+    ("/..", None),
+    ("/a/../../b.txt", None),
+])
+def testNormalise(tmp_path, requestPath, name):
+    assert PathResolver(str(tmp_path)).normalise(requestPath) == name
+
+
+def testResolveMapsDirectoriesToIndex(tmp_path):
+    (tmp_path / "index.html").write_bytes(b"x")
+    resolver = PathResolver(str(tmp_path))
+    resolution = resolver.resolve("/")
+    assert resolution.path == os.path.join(os.path.realpath(str(tmp_path)), "index.html")
+    assert resolution.stat.st_size == 1
+    assert resolution.contentType == "text/html"
+
+
+def testMissingFilesAreCachedUntilInvalidated(tmp_path):
+    resolver = PathResolver(str(tmp_path), ttl=60)
+    assert resolver.resolve("/a.txt").stat is None
+    (tmp_path / "a.txt").write_bytes(b"x")
+    assert resolver.resolve("/a.txt").stat is None
+    assert resolver.stats()["hits"] == 1
+
+    resolver.invalidate("a.txt")
+    assert resolver.resolve("/a.txt").stat is not None
+
+
+def testCacheIsBounded(tmp_path):
+    resolver = PathResolver(str(tmp_path), maxEntries=8)
+    for i in range(100):
+        resolver.resolve("/missing%d" % i)
+    assert resolver.stats()["entries"] == 8
+    assert resolver.stats()["evictions"] == 92